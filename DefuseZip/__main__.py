@@ -1,32 +1,67 @@
+import os
 import sys
 import zipfile
 from argparse import ArgumentParser
 from argparse import Namespace
+from concurrent.futures import as_completed
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import wait
+from functools import lru_cache
 from pathlib import Path
+from typing import Iterable
+from typing import Iterator
 from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
 
-import psutil
 from loguru import logger
 
 from DefuseZip.loader import DefuseZip
+from DefuseZip.loader import LINUX
 from DefuseZip.loader import MaliciousFileException
+from DefuseZip.utils.cache import ScanCache
+from DefuseZip.utils.containers import sniff
+from DefuseZip.utils.containers import SNIFF_SIZE
+from DefuseZip.utils.log import configure_logging
+from DefuseZip.utils.policy import Policy
+from DefuseZip.utils.report import PrometheusExporter
 
 
 class ArgParser(ArgumentParser):
-    def error(self, message):  # dead: disable
+    def error(self, message):
         print(message)
         self.print_help()
         raise SystemExit(1)
 
 
 def main():
+    configure_logging()
+    if sys.argv[1:2] == ["serve"]:
+        from DefuseZip.server import serve
+
+        return serve(parse_arguments(sys.argv[2:], serve=True))
     opts = parse_arguments()
     return launch(opts)
 
 
-def parse_arguments():
+def parse_arguments(argv: Optional[List[str]] = None, serve: bool = False):
     args = ArgParser(description="")
-    args.add_argument("--file", "-f", type=str, help="Path to zip")
+    args.add_argument(
+        "--file",
+        "-f",
+        type=str,
+        help="Path to zip, or directory to scan recursively. - reads the paths from stdin, one per line",
+    )
+    args.add_argument(
+        "--manifest",
+        "-ma",
+        dest="manifest",
+        default=False,
+        action="store_true",
+        help="Toggle to read the paths to scan from --file, one per line",
+    )
     args.add_argument(
         "logtofile",
         default=False,
@@ -67,6 +102,14 @@ def parse_arguments():
         default=3,
         help="Seconds to allow traversing the zip. After the limit is hit, zip is ruled malicious.",
     )
+    args.add_argument(
+        "--hard_killswitch",
+        "-hk",
+        dest="hard_killswitch",
+        default=False,
+        action="store_true",
+        help="Toggle to scan in a subprocess that is terminated when the killswitch is hit",
+    )
     args.add_argument(
         "--symlinks_allowed",
         "-sl",
@@ -81,6 +124,85 @@ def parse_arguments():
         default=False,
         help="Boolean to toggle directory travelsal protection",
     )
+    args.add_argument(
+        "--memory_budget",
+        "-mb",
+        type=int,
+        default=16777216,
+        help="Bytes of nested zip data to buffer in memory while scanning, the rest is spooled to disk.",
+    )
+    args.add_argument(
+        "--disk_budget",
+        "-db",
+        type=int,
+        default=1073741824,
+        help="Bytes of nested zip data allowed on disk while scanning. After the limit is hit, zip is ruled malicious.",
+    )
+    args.add_argument(
+        "--cache_file",
+        "-cf",
+        type=str,
+        help="SQLite file to remember scan results in, identical zips are not scanned again.",
+    )
+    args.add_argument(
+        "--policy",
+        "-po",
+        type=str,
+        help="TOML or JSON file of policy rules for the entries, e.g. deny patterns and size limits. Breaking any of them rules the zip malicious.",
+    )
+    args.add_argument(
+        "--full_report",
+        "-fr",
+        dest="full_report",
+        default=False,
+        action="store_true",
+        help="Toggle to walk the whole zip for complete statistics instead of stopping at the first finding",
+    )
+    args.add_argument(
+        "--verify",
+        "-vf",
+        dest="verify",
+        default=False,
+        action="store_true",
+        help="Toggle to inflate the members in chunks to check their declared sizes",
+    )
+    args.add_argument(
+        "--verify_budget",
+        "-vb",
+        type=int,
+        default=1073741824,
+        help="Bytes allowed to be inflated in total by --verify. After the limit is hit, zip is ruled malicious.",
+    )
+    args.add_argument(
+        "--sniff_contents",
+        "-sc",
+        dest="sniff_contents",
+        default=False,
+        action="store_true",
+        help="Toggle to read the first bytes of every member to find archives that aren't named like one",
+    )
+    args.add_argument(
+        "--format",
+        "-fm",
+        dest="format",
+        choices=("text", "ndjson"),
+        default="text",
+        help="Output format, ndjson writes one JSON record per file to stdout.",
+    )
+    args.add_argument(
+        "--metrics_file",
+        "-mt",
+        type=str,
+        help="File to write the scans' timings and counters to in the Prometheus text format, e.g. for "
+        "node_exporter's textfile collector.",
+    )
+    args.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="Number of processes to scan the files with.",
+    )
     args.add_argument(
         "--safe_extract",
         "-se",
@@ -91,6 +213,14 @@ def parse_arguments():
     )
 
     args.add_argument("--destination", "-d", type=str, help="Target directory")
+    if serve:
+        args.add_argument(
+            "--socket",
+            "-so",
+            type=str,
+            required=True,
+            help="Unix socket to listen on for scan requests, see DefuseZip.client",
+        )
     if "--safe_extract" in sys.argv or "-se" in sys.argv:
         group = args.add_argument_group(description="Arguments for --safe_extract")
         group.add_argument(
@@ -115,8 +245,8 @@ def parse_arguments():
             help="Maximum single file size",
         )
 
-    opts = args.parse_args()
-    if not opts.file:
+    opts = args.parse_args(argv)
+    if not opts.file and not serve:
         args.print_help()
         raise SystemExit(1)
     return opts
@@ -138,10 +268,10 @@ def verify_options(opts: Namespace, filename: Path):
         print("--destination PATH required with --safe_extract")
         raise SystemExit(1)
 
-    if opts.safe_extract and not psutil.LINUX:
+    if opts.safe_extract and not LINUX:
         raise NotImplementedError("Only implemented for Linux OS")
 
-    if opts.symlinks_allowed and not psutil.LINUX:
+    if opts.symlinks_allowed and not LINUX:
         raise NotImplementedError("Only implemented for Linux OS")
 
 
@@ -154,6 +284,10 @@ def launch(opts: Namespace) -> int:
         print(f"DefuseZip v{__version__}")
         raise SystemExit(1)
 
+    if opts.file == "-":
+        verify_options(opts, Path("stdin"))
+        return scan_files(discover_each(read_manifest(sys.stdin)), opts)
+
     filename = Path(opts.file)
     if not filename.exists():
         print(f"File/Folder not found: {opts.file}")
@@ -161,35 +295,164 @@ def launch(opts: Namespace) -> int:
 
     verify_options(opts, filename)
 
-    files: List[Path] = []
-    if filename.is_file():
-        files.append(filename)
-    else:
-        for f in filename.glob("*.*"):
-            if zipfile.is_zipfile(f):
-                files.append(f)
-    return scan_files(files, opts)
-
-
-def scan_files(files: List[Path], opts: Namespace) -> int:
-    for file in files:
-
-        target_zip = DefuseZip(
-            file,
-            opts.ratio_threshold,
-            opts.nested_zips_limit,
-            opts.nested_levels_limit,
-            opts.killswitch_seconds,
-            opts.symlinks_allowed,
-            opts.directory_travelsal_allowed,
-        )
+    if opts.manifest:
+        with open(filename, encoding="utf8") as manifest:
+            return scan_files(discover_each(read_manifest(manifest)), opts)
+    return scan_files(discover(filename), opts)
+
+
+def read_manifest(lines: Iterable[str]) -> Iterator[Path]:
+    """Paths listed one per line, blank lines are skipped"""
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line:
+            yield Path(line)
+
+
+def discover(root: Path) -> Iterator[Path]:
+    """Yields the file, or every file under the directory, as the directories are read
+
+    Files are yielded whatever their name, whether they are zips is sniffed when they are scanned.
+    Symlinked directories are not followed.
+
+    Args:
+        root (Path): file or directory
+
+    Yields:
+        Iterator[Path]: files to scan
+    """
+    if not root.is_dir():
+        if root.exists():
+            yield root
+        else:
+            logger.warning(f"File/Folder not found: {root}")
+        return
+    directories = [str(root)]
+    while directories:
         try:
-            target_zip.scan()
-        except MaliciousFileException:
+            with os.scandir(directories.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+                    elif entry.is_file():
+                        yield Path(entry.path)
+        except OSError as e:
+            logger.warning(f"Skipped directory: {e}")
+
+
+def discover_each(paths: Iterable[Path]) -> Iterator[Path]:
+    for path in paths:
+        yield from discover(path)
+
+
+@lru_cache(maxsize=None)
+def get_scan_cache(cache_file: str) -> ScanCache:
+    """One ScanCache per cache file and process"""
+    return ScanCache(path=cache_file)
+
+
+@lru_cache(maxsize=None)
+def get_policy(policy_file: str) -> Policy:
+    """Policy files are read and compiled once per process"""
+    return Policy.load(policy_file)
+
+
+def is_archive(file: Path) -> bool:
+    """True for zips, including self-extracting ones, and for the tar, gzip, bz2 and xz files DefuseZip walks
+
+    A file that can't be read, e.g. deleted since it was listed, is skipped like any other non-archive.
+    """
+    if zipfile.is_zipfile(file):
+        return True
+    try:
+        with open(file, "rb") as f:
+            return sniff(f.read(SNIFF_SIZE)) is not None
+    except OSError:
+        return False
+
+
+def scan_file(file: Path, opts: Namespace) -> Tuple[Path, Optional[DefuseZip]]:
+    """Scans the file, None if it isn't an archive"""
+    if not is_archive(file):
+        return file, None
+    target_zip = DefuseZip(
+        file,
+        opts.ratio_threshold,
+        opts.nested_zips_limit,
+        opts.nested_levels_limit,
+        opts.killswitch_seconds,
+        opts.symlinks_allowed,
+        opts.directory_travelsal_allowed,
+        opts.memory_budget,
+        opts.disk_budget,
+        opts.hard_killswitch,
+        get_scan_cache(opts.cache_file) if opts.cache_file else None,
+        opts.full_report,
+        opts.verify,
+        opts.verify_budget,
+        policy=get_policy(opts.policy) if opts.policy else None,
+        sniff_contents=opts.sniff_contents,
+    )
+    try:
+        target_zip.scan()
+    except MaliciousFileException:
+        pass
+    return file, target_zip
+
+
+def scan_parallel(
+    files: Iterable[Path], opts: Namespace
+) -> Iterator[Tuple[Path, Optional[DefuseZip]]]:
+    """Scans the files in a process pool, yielding the results in completion order
+
+    At most a few files per process are queued at a time, so results start streaming back right away.
+
+    Args:
+        files (Iterable[Path]): zips to scan
+        opts (Namespace): parsed command line options
+
+    Yields:
+        Iterator[Tuple[Path, Optional[DefuseZip]]]: the file and its completed scan, None if it isn't a zip
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    max_pending = opts.jobs * 4
+    with ProcessPoolExecutor(max_workers=opts.jobs) as executor:
+        pending: Set[Future] = set()
+        for file in files:
+            pending.add(executor.submit(scan_file, file, opts))
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in as_completed(pending):
+            yield future.result()
+
+
+def scan_files(files: Iterable[Path], opts: Namespace) -> int:
+    if opts.jobs > 1:
+        results = scan_parallel(files, opts)
+    else:
+        results = (scan_file(file, opts) for file in files)
+
+    exporter = PrometheusExporter() if opts.metrics_file else None
+    for file, target_zip in results:
+        if target_zip is None:
+            logger.info(f"Skipped, not an archive: {file}")
+            continue
+        if exporter is not None:
+            exporter.observe(target_zip.report())
+        if target_zip.is_dangerous:
             sys.tracebacklimit = 0
 
-        target_zip.output()
+        if opts.format == "ndjson":
+            sys.stdout.write(target_zip.report().to_json() + "\n")
+        else:
+            target_zip.output()
 
+        if not zipfile.is_zipfile(file):
+            # Other archives are only scanned, extraction is for zips
+            continue
         if opts.safe_extract:
             target_path = Path(opts.destination)
 
@@ -200,6 +463,8 @@ def scan_files(files: List[Path], opts: Namespace) -> int:
             if opts.destination and not target_zip.is_dangerous:
                 target_zip.extract_all(Path(opts.destination) / Path(file).stem)
 
+    if exporter is not None:
+        Path(opts.metrics_file).write_text(exporter.render())
     return 0
 
 
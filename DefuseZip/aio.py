@@ -0,0 +1,138 @@
+import asyncio
+import mmap
+import tempfile
+from pathlib import Path
+from typing import Any
+from typing import AsyncIterable
+from typing import IO
+from typing import Optional
+from typing import Union
+
+from DefuseZip.loader import DefuseZip
+from DefuseZip.loader import MaliciousFileException
+from DefuseZip.utils.pool import run_scan
+from DefuseZip.utils.pool import scan_pool
+from DefuseZip.utils.pool import ScanPool
+
+# Extra seconds allowed past killswitch_seconds before giving up on a scan that is stuck somewhere
+# it can't check the deadline, e.g. parsing a huge central directory
+KILLSWITCH_GRACE_SECONDS = 1.0
+
+# Streamed uploads are kept in memory up to this size, anything bigger is spooled to a temporary file
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+Source = Union[str, Path, bytes, memoryview, IO[bytes], AsyncIterable[bytes], Any]
+
+
+class AsyncDefuseZip:
+    """Scans zips from asyncio code on a bounded thread pool, by default the process wide ScanPool.
+
+    Scans past the pool's threads and queue wait in the event loop for a free slot, so bursts of uploads
+    don't pile up threads. Keyword arguments are the DefuseZip defaults for every scan, each scan can
+    override them.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, **options):
+        """
+        AsyncDefuseZip initializer
+        :param max_workers: Threads of a pool of this scanner's own. Default = None, the scans share the
+        process wide pool of DefuseZip.utils.pool.scan_pool with every other scanner
+        :param options: DefuseZip arguments
+        """
+        self.options = options
+        self.__pool: Optional[ScanPool] = (
+            ScanPool(max_workers) if max_workers is not None else None
+        )
+
+    @property
+    def pool(self) -> ScanPool:
+        return self.__pool if self.__pool is not None else scan_pool()
+
+    async def scan(self, source: Source, **options) -> DefuseZip:
+        """Scans a zip given as a path, bytes, a memoryview, an mmap, a seekable file object, an async iterable
+        of bytes or a stream with async read()
+
+        Unlike DefuseZip.scan, a dangerous zip doesn't raise, check is_dangerous on the result. Paths, buffers
+        and file objects are scanned in place. Async sources are spooled first, in memory up to
+        SPOOL_MAX_SIZE, and the spool is closed after the scan, so the result can't be extracted.
+
+        Args:
+            source (Source): the zip
+            **options: DefuseZip arguments overriding the defaults of this scanner
+
+        Raises:
+            MaliciousFileException: the scan got stuck past the killswitch and was abandoned
+
+        Returns:
+            DefuseZip: the completed scan
+        """
+        options = {**self.options, **options}
+        if isinstance(
+            source, (str, Path, bytes, bytearray, memoryview, mmap.mmap)
+        ) or not (hasattr(source, "__aiter__") or _has_async_read(source)):
+            return await self.__run(source, options, spool=None)
+        spool = await self.__to_spool(source)
+        return await self.__run(spool, options, spool=spool)
+
+    async def __run(
+        self, source: Any, options: dict, spool: Optional[IO[bytes]]
+    ) -> DefuseZip:
+        try:
+            defusezip = DefuseZip(source, **options)
+            future = await self.pool.submit_async(run_scan, defusezip)
+        except BaseException:
+            if spool is not None:
+                spool.close()
+            raise
+
+        if spool is not None:
+            # The spool is closed only once the thread is really done with it
+            future.add_done_callback(lambda _: spool.close())
+
+        killswitch_seconds = options.get("killswitch_seconds", 3)
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(future), killswitch_seconds + KILLSWITCH_GRACE_SECONDS
+            )
+        except asyncio.TimeoutError:
+            raise MaliciousFileException(
+                Path(source).name if isinstance(source, (str, Path)) else "<memory>"
+            ) from None
+
+    @staticmethod
+    async def __to_spool(source: Any) -> IO[bytes]:
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        try:
+            if hasattr(source, "__aiter__"):
+                async for chunk in source:
+                    spool.write(chunk)
+            else:
+                while True:
+                    chunk = await source.read(65536)
+                    if not chunk:
+                        break
+                    spool.write(chunk)
+        except BaseException:
+            spool.close()
+            raise
+        return spool  # type: ignore
+
+    def close(self):
+        """Shuts this scanner's own thread pool down until the next scan, the process wide one keeps running"""
+        if self.__pool is not None:
+            self.__pool.close()
+
+
+def _has_async_read(source: Source) -> bool:
+    return asyncio.iscoroutinefunction(getattr(source, "read", None))
+
+
+_default_scanner: Optional[AsyncDefuseZip] = None
+
+
+async def scan_async(source: Source, **options) -> DefuseZip:  # dead: disable
+    """Scans a zip on the module wide AsyncDefuseZip, see AsyncDefuseZip.scan"""
+    global _default_scanner
+    if _default_scanner is None:
+        _default_scanner = AsyncDefuseZip()
+    return await _default_scanner.scan(source, **options)
@@ -0,0 +1,102 @@
+import json
+import socket
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Union
+
+
+class ScanClient:
+    """Sends zips to a ``python -m DefuseZip serve`` daemon over its Unix domain socket
+
+    Only the standard library is imported, so scanning a file costs little more than the scan itself. The
+    connection is opened on the first request and reused for the next ones.
+    """
+
+    def __init__(self, path: Union[str, Path], timeout: Optional[float] = None):
+        self.path = str(path)
+        self.timeout = timeout
+        self.__socket: Optional[socket.socket] = None
+        self.__stream: Any = None
+
+    def __enter__(self) -> "ScanClient":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):  # dead: disable
+        self.close()
+
+    def scan(
+        self, file: Union[str, Path], destination: Optional[Union[str, Path]] = None
+    ) -> Dict[str, Any]:
+        """Scans the zip in the daemon, extracting it to ``destination`` with safe_extract if given and safe
+
+        The daemon opens the file itself, so relative paths are resolved here first.
+
+        Args:
+            file (Union[str, Path]): the zip
+            destination (Optional[Union[str, Path]]): directory to extract to. Defaults to None.
+
+        Returns:
+            Dict[str, Any]: the ScanReport fields, with "extracted" if a destination was given, or "error"
+        """
+        request: Dict[str, Any] = {"file": str(Path(file).resolve())}
+        if destination is not None:
+            request["destination"] = str(Path(destination).resolve())
+        if self.__stream is None:
+            self.__socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.__socket.settimeout(self.timeout)
+            self.__socket.connect(self.path)
+            self.__stream = self.__socket.makefile("rwb")
+        self.__stream.write(json.dumps(request).encode() + b"\n")
+        self.__stream.flush()
+        line = self.__stream.readline()
+        if not line:
+            self.close()
+            raise ConnectionError("The server closed the connection")
+        return json.loads(line)
+
+    def close(self):
+        if self.__stream is not None:
+            self.__stream.close()
+            self.__stream = None
+        if self.__socket is not None:
+            self.__socket.close()
+            self.__socket = None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Prints the daemon's response for every file, one JSON object per line
+
+    Exits with 1 if any file was dangerous or couldn't be scanned.
+    """
+    args = ArgumentParser(description="Scans zips in a DefuseZip serve daemon")
+    args.add_argument("files", nargs="+", help="Paths to zips")
+    args.add_argument(
+        "--socket", "-so", required=True, help="Unix socket the daemon listens on"
+    )
+    args.add_argument(
+        "--destination",
+        "-d",
+        type=str,
+        help="Directory to extract the safe zips to, each in a directory named after it",
+    )
+    opts = args.parse_args(argv)
+
+    status = 0
+    with ScanClient(opts.socket) as client:
+        for file in opts.files:
+            destination = None
+            if opts.destination:
+                destination = Path(opts.destination) / Path(file).stem
+            response = client.scan(file, destination)
+            print(json.dumps(response, separators=(",", ":")), flush=True)
+            if "error" in response or response["dangerous"]:
+                status = 1
+    return status
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,652 @@
+import struct
+import time
+import zlib
+from array import array
+from typing import Any
+from typing import Dict
+from typing import Optional
+from zipfile import BadZipFile
+from zipfile import ZIP_DEFLATED
+from zipfile import ZIP_STORED
+
+from DefuseZip.loader import MaliciousFileException
+from DefuseZip.utils.central_directory import CentralDirectory
+from DefuseZip.utils.central_directory import has_zip64_extra
+from DefuseZip.utils.central_directory import read_central_directory
+from DefuseZip.utils.central_directory import zip64_fields
+from DefuseZip.utils.central_directory import ZIP64_LIMIT
+from DefuseZip.utils.containers import Container
+from DefuseZip.utils.containers import MIN_CONTAINER_SIZE
+from DefuseZip.utils.containers import sniff
+from DefuseZip.utils.containers import SNIFF_SIZE
+from DefuseZip.utils.containers import ZIP
+from DefuseZip.utils.metrics import ScanMetrics
+from DefuseZip.utils.policy import Policy
+from DefuseZip.utils.policy import SYMLINK
+from DefuseZip.utils.policy import TRAVELSAL
+from DefuseZip.utils.ratios import RatioTracker
+from DefuseZip.utils.report import ScanReport
+from DefuseZip.utils.streams import BufferReader
+from DefuseZip.utils.streams import CHUNK_SIZE
+from DefuseZip.utils.streams import LOCAL_HEADER
+from DefuseZip.utils.streams import LOCAL_HEADER_SIGNATURE
+
+_DESCRIPTOR_SIGNATURE = b"PK\007\010"
+
+_DEFAULT_POLICY = Policy()
+
+# What the scanner is waiting for next
+_HEADER = 0
+_DATA = 1
+_DESCRIPTOR = 2
+# Local headers can't be followed any further, the central directory is read at close()
+_DIRECTORY = 3
+
+
+class _Member:
+    """State of the entry whose data is being received"""
+
+    __slots__ = (
+        "name",
+        "offset",
+        "flags",
+        "compress_size",
+        "file_size",
+        "zip64",
+        "remaining",
+        "received",
+        "inflater",
+        "inflated",
+        "head",
+        "container",
+        "child",
+    )
+
+    def __init__(
+        self, name: str, offset: int, flags: int, compress_size: int, file_size: int
+    ):
+        self.name = name
+        self.offset = offset
+        self.flags = flags
+        self.compress_size = compress_size
+        self.file_size = file_size
+        self.zip64 = False
+        # None until the data descriptor tells where the data of a streamed entry ends
+        self.remaining: Optional[int] = None
+        self.received = 0
+        self.inflater: Any = None
+        self.inflated = 0
+        # First bytes of the data while its format is still unknown
+        self.head: Optional[bytearray] = None
+        self.container: Optional[Container] = None
+        self.child: Optional["IncrementalScanner"] = None
+
+    @property
+    def streamed(self) -> bool:
+        return bool(self.flags & 0x8)
+
+
+class IncrementalScanner:
+    """Scans a zip while it is being received, e.g. uploaded in chunks, rejecting it as soon as it is proven dangerous
+
+    ``feed`` parses the local file headers as their bytes arrive. It tracks the sizes they declare against the
+    bytes they take up, the policy's name rules and nested archives, and raises MaliciousFileException at the first
+    finding, so the rest of a bomb never has to be received. Nested zips are scanned the same way while their
+    data is inflated. ``close`` then reads the central directory at the end of the zip and checks it against
+    the local headers, a mismatch between the two rules the zip malicious.
+
+    Only the last ``memory_budget`` bytes received are kept, the central directory must fit in them.
+    """
+
+    def __init__(
+        self,
+        name: str = "<stream>",
+        ratio_threshold: int = 1032,
+        nested_zips_limit: int = 3,
+        nested_levels_limit: int = 3,
+        symlinks_allowed: bool = False,
+        directory_travelsal_allowed: bool = False,
+        memory_budget: int = 16777216,
+        top_members: int = 5,
+        policy: Optional[Policy] = None,
+        _parent: Optional["IncrementalScanner"] = None,
+    ):
+        """
+        IncrementalScanner initializer, the limits are those of DefuseZip
+        :param name: Name of the zip for the MaliciousFileException and the report. Default = "<stream>"
+        :param ratio_threshold: compression ratio threshold when to call the zip malicious
+        :param nested_zips_limit: Total zip count when to reject the zip
+        :param nested_levels_limit: Limit of zips nested inside each other when to reject the zip
+        :param symlinks_allowed: Boolean. Default = False
+        :param directory_travelsal_allowed: Boolean. Default = False
+        :param memory_budget: Bytes of the end of the zip kept for reading the central directory at close, and
+        the same again for each nested zip being scanned. Default = 16 MiB
+        :param top_members: Count of members with the highest compression ratios to keep for the report, from the
+        sizes their local headers declare. Default = 5
+        :param policy: Policy with more rules for the entries, like DefuseZip's. The name rules are checked as the
+        local headers arrive, the others against the central directory at close. Breaking any of them rejects the
+        zip! Default = None
+        """
+        self.__name = name
+        self.__ratio_threshold = ratio_threshold
+        self.__nested_zips_limit = nested_zips_limit
+        self.__nested_levels_limit = nested_levels_limit
+        self.__symlinks_allowed = symlinks_allowed
+        self.__directory_travelsal_allowed = directory_travelsal_allowed
+        self.__memory_budget = memory_budget
+        self.__policy = policy if policy is not None else _DEFAULT_POLICY
+        # Nested scanners leave the verdict, and the count of bytes inflated for them, to the outermost one
+        self.__root: IncrementalScanner = self if _parent is None else _parent.__root
+        self.__level: int = 0 if _parent is None else _parent.__level + 1
+        self.__ratios: RatioTracker = (
+            RatioTracker(top_members) if _parent is None else _parent.__root.__ratios
+        )
+        self.__violations: Dict[str, str] = (
+            {} if _parent is None else _parent.__root.__violations
+        )
+
+        self.__tail = bytearray()
+        self.__tail_start = 0
+        self.__received = 0
+        self.__cursor = 0
+        self.__committed = 0
+        self.__state = _HEADER
+        self.__member: Optional[_Member] = None
+        self.__offsets = array("q")
+        self.__compress_sizes = array("Q")
+        self.__file_sizes = array("Q")
+        self.__zipsize = 0
+        self.__inflated = 0
+        self.__metrics = ScanMetrics()
+        self.__seconds = 0.0
+
+        self.__closed = False
+        self.__rejected = False
+        self.__is_dangerous = False
+        self.__message = ""
+        self.__symlink_found = False
+        self.__directory_travelsal = False
+        self.__overlapping_entries = 0
+        self.__size_mismatch = False
+        self.__nested_zips = 0
+        self.__highest_level = 0
+
+    @property
+    def is_dangerous(self) -> bool:
+        return self.__is_dangerous
+
+    @property
+    def uncompressed_size(self) -> int:
+        """Bytes declared by the entries seen so far, nested zips replaced by their content"""
+        size = self.__zipsize
+        member = self.__member
+        if member is not None:
+            if member.child is not None:
+                size += member.child.uncompressed_size
+            elif member.streamed:
+                size += member.inflated
+        return size
+
+    @property
+    def nested_zips_count(self) -> int:
+        member = self.__member
+        if member is not None and member.child is not None:
+            return self.__nested_zips + member.child.nested_zips_count
+        return self.__nested_zips
+
+    @property
+    def highest_level(self) -> int:
+        member = self.__member
+        if member is not None and member.child is not None:
+            return max(self.__highest_level, member.child.highest_level)
+        return self.__highest_level
+
+    @property
+    def has_travelsal(self) -> bool:
+        member = self.__member
+        if member is not None and member.child is not None:
+            return self.__directory_travelsal or member.child.has_travelsal
+        return self.__directory_travelsal
+
+    def feed(self, chunk: bytes):
+        """
+        Parses the next chunk of the zip
+        :param chunk: bytes following the ones fed before
+        :raises MaliciousFileException: the zip is proven dangerous by what was received so far
+        """
+        if self.__closed:
+            raise ValueError("feed() after close()")
+        if self.__rejected:
+            raise MaliciousFileException(self.__name)
+        started = time.perf_counter()
+        try:
+            self.__tail += chunk
+            self.__received += len(chunk)
+            self.__metrics.bytes_read += len(chunk)
+            self.__parse()
+            self.__trim()
+            self.__check()
+        finally:
+            elapsed = time.perf_counter() - started
+            self.__metrics.add("walk", elapsed)
+            self.__seconds += elapsed
+
+    def close(self) -> bool:
+        """
+        Reads the central directory at the end of the zip, checks it against the local headers and completes the
+        scan, returning if the zip should be considered dangerous. Like DefuseZip.scan, True is never returned,
+        a dangerous zip raises MaliciousFileException instead.
+        :raises BadZipFile: the zip is truncated, damaged, or its central directory doesn't fit in memory_budget
+        :return: boolean
+        """
+        if self.__rejected:
+            raise MaliciousFileException(self.__name)
+        if self.__closed:
+            return self.__is_dangerous
+        started = time.perf_counter()
+        try:
+            if self.__state != _DIRECTORY and (
+                self.__member is not None or self.__cursor < self.__received
+            ):
+                raise BadZipFile(f"Truncated zip {self.__name}")
+            with self.__metrics.timed("central_directory"):
+                self.__reconcile(self.__read_directory())
+            self.__closed = True
+        finally:
+            self.__seconds += time.perf_counter() - started
+        if self.__level:
+            return False
+
+        self.__check_total_size()
+        self.__is_dangerous = self.__has_finding(self.__ratio())
+        self.__message = "Success"
+        if self.__is_dangerous:
+            raise MaliciousFileException(self.__name)
+        return self.__is_dangerous
+
+    def report(self) -> ScanReport:
+        """
+        Returns the results of the scan, complete after close() or the rejection, as raw values
+        :return: ScanReport
+        """
+        return ScanReport(
+            file=self.__name,
+            dangerous=self.__is_dangerous,
+            message=self.__message,
+            compressed_size=self.__received,
+            uncompressed_size=self.uncompressed_size,
+            ratio=self.__ratio(),
+            level_ratios=self.__ratios.level_ratios(),
+            top_members=self.__ratios.top(),
+            nested_zips=self.nested_zips_count,
+            nested_levels=self.highest_level,
+            symlinks=self.__symlink_found,
+            directory_travelsal=self.has_travelsal,
+            overlapping_entries=self.__overlapping_entries,
+            size_mismatch=self.__size_mismatch,
+            violations=tuple(
+                f"{rule}: {finding}" for rule, finding in self.__violations.items()
+            ),
+            killswitch=False,
+            stopped_early=self.__rejected,
+            cached=False,
+            seconds=self.__seconds,
+            metrics=self.__metrics,
+        )
+
+    def __ratio(self) -> float:
+        try:
+            return self.uncompressed_size / self.__received
+        except ZeroDivisionError:
+            return 0.00
+
+    def __has_finding(self, ratio: float) -> bool:
+        return bool(
+            ratio > self.__ratio_threshold
+            or (self.has_travelsal and not self.__directory_travelsal_allowed)
+            or (self.__symlink_found and not self.__symlinks_allowed)
+            or self.__overlapping_entries
+            or self.__size_mismatch
+            or self.__violations
+            or (
+                self.__nested_zips_limit
+                and (
+                    self.nested_zips_count > self.__nested_zips_limit
+                    or self.highest_level > self.__nested_levels_limit
+                )
+            )
+        )
+
+    def __check(self):
+        """Rejects the zip at the first finding
+
+        Until the whole zip is received the ratio is taken over the bytes the entries seen so far take up,
+        by their headers, so a large entry isn't mistaken for a bomb while its data is still arriving.
+
+        Raises:
+            MaliciousFileException: the zip is proven dangerous
+        """
+        if self.__root is not self:
+            self.__root.__check()
+            return
+        self.__check_total_size()
+        compressed = max(self.__received, self.__committed, 1)
+        ratio = max(self.uncompressed_size, self.__inflated) / compressed
+        if not self.__has_finding(ratio):
+            return
+        self.__rejected = True
+        self.__is_dangerous = True
+        self.__message = (
+            "Stopped at the first finding that makes the zip dangerous, "
+            "values collected are valid only to that point"
+        )
+        raise MaliciousFileException(self.__name)
+
+    def __check_total_size(self):
+        """The policy's max_total_size applies to the whole zip, nested zips included"""
+        limit = self.__policy.max_total_size
+        size = self.uncompressed_size
+        if limit is not None and size > limit:
+            self.__violations.setdefault("max_total_size", f"{size} bytes")
+
+    def __trim(self):
+        """Drops received bytes that are neither waited on by the parser nor within memory_budget of the end"""
+        keep_from = self.__received - self.__memory_budget
+        if self.__state != _DIRECTORY:
+            keep_from = min(keep_from, self.__cursor)
+        excess = keep_from - self.__tail_start
+        # Trimming moves the tail, so it waits until it is worth it
+        if excess > max(self.__memory_budget, CHUNK_SIZE):
+            del self.__tail[:excess]
+            self.__tail_start += excess
+        self.__metrics.peak_buffered_bytes = max(
+            self.__metrics.peak_buffered_bytes, len(self.__tail)
+        )
+
+    def __parse(self):
+        progress = True
+        while progress:
+            if self.__state == _HEADER:
+                progress = self.__read_header()
+            elif self.__state == _DATA:
+                progress = self.__read_data()
+            elif self.__state == _DESCRIPTOR:
+                progress = self.__read_descriptor()
+            else:
+                progress = False
+
+    def __read_header(self) -> bool:
+        """Parses the local header at the cursor once all of it is received
+
+        Anything other than a local header ends the entries, e.g. the central directory, or the stub of a self
+        extracting zip. The central directory accounts whatever follows.
+
+        Returns:
+            bool: True if the header was parsed
+        """
+        tail = self.__tail
+        pos = self.__cursor - self.__tail_start
+        if len(tail) - pos < len(LOCAL_HEADER_SIGNATURE):
+            return False
+        if not tail.startswith(LOCAL_HEADER_SIGNATURE, pos):
+            self.__state = _DIRECTORY
+            return False
+        if len(tail) - pos < LOCAL_HEADER.size:
+            return False
+        fields = LOCAL_HEADER.unpack_from(tail, pos)
+        flags, compress_type = fields[3], fields[4]
+        compress_size, file_size = fields[8], fields[9]
+        name_start = pos + LOCAL_HEADER.size
+        extra_start = name_start + fields[10]
+        end = extra_start + fields[11]
+        if len(tail) < end:
+            return False
+
+        filename = bytes(tail[name_start:extra_start]).decode(
+            "utf-8" if flags & 0x800 else "cp437"
+        )
+        extra = bytes(tail[extra_start:end])
+        member = _Member(filename, self.__cursor, flags, compress_size, file_size)
+        member.zip64 = has_zip64_extra(extra)
+        if ZIP64_LIMIT in (compress_size, file_size):
+            member.file_size, member.compress_size, _ = zip64_fields(
+                extra, file_size, compress_size, 0
+            )
+        self.__cursor += end - pos
+        self.__metrics.entries += 1
+        for rule in self.__policy.match_name(filename):
+            if rule == TRAVELSAL:
+                self.__directory_travelsal = True
+            else:
+                self.__violations.setdefault(rule, filename)
+
+        inflatable = compress_type in (ZIP_STORED, ZIP_DEFLATED) and not flags & 0x1
+        if member.streamed:
+            if compress_type != ZIP_DEFLATED or flags & 0x1:
+                # Only deflate tells where its data ends, the rest is left to the central directory
+                self.__state = _DIRECTORY
+                return False
+        else:
+            member.remaining = member.compress_size
+            self.__zipsize += member.file_size
+            self.__committed = max(
+                self.__committed, self.__cursor + member.compress_size
+            )
+        if member.streamed or (inflatable and member.file_size >= MIN_CONTAINER_SIZE):
+            member.head = bytearray()
+            if filename.endswith(".zip"):
+                member.container = ZIP
+        if compress_type == ZIP_DEFLATED and member.head is not None:
+            member.inflater = zlib.decompressobj(-15)
+
+        self.__member = member
+        self.__state = _DATA
+        return True
+
+    def __read_data(self) -> bool:
+        """Passes the received data of the current entry on, up to its end
+
+        Returns:
+            bool: True if the entry's data ended
+        """
+        member: _Member = self.__member  # type: ignore
+        pos = self.__cursor - self.__tail_start
+        available = len(self.__tail) - pos
+        if member.remaining is None:
+            if not available:
+                return False
+            data = bytes(self.__tail[pos:])
+            consumed = len(data) - self.__member_data(member, data)
+            self.__cursor += consumed
+            member.received += consumed
+            if member.inflater.eof:  # type: ignore
+                member.compress_size = member.received
+                self.__state = _DESCRIPTOR
+                return True
+            return False
+
+        size = min(available, member.remaining)
+        if size and (
+            member.inflater is not None or member.head is not None or member.child
+        ):
+            end = pos + size
+            self.__member_data(member, bytes(self.__tail[pos:end]))
+        self.__cursor += size
+        member.received += size
+        member.remaining -= size
+        if member.remaining:
+            return False
+        self.__end_member(member)
+        return True
+
+    def __read_descriptor(self) -> bool:
+        """Parses the data descriptor following a streamed entry, its sizes must match the data
+
+        Returns:
+            bool: True if the descriptor was parsed
+        """
+        member: _Member = self.__member  # type: ignore
+        tail = self.__tail
+        pos = self.__cursor - self.__tail_start
+        if len(tail) - pos < len(_DESCRIPTOR_SIGNATURE):
+            return False
+        signed = tail.startswith(_DESCRIPTOR_SIGNATURE, pos)
+        sizes = struct.Struct("<2Q" if member.zip64 else "<2L")
+        start = pos + 4 + (4 if signed else 0)
+        if len(tail) < start + sizes.size:
+            return False
+        compress_size, file_size = sizes.unpack_from(tail, start)
+        if compress_size != member.compress_size or file_size != member.inflated:
+            self.__size_mismatch = True
+        member.file_size = file_size
+        self.__cursor += start + sizes.size - pos
+        self.__committed = max(self.__committed, self.__cursor)
+        if member.child is None:
+            self.__zipsize += member.inflated
+        self.__end_member(member)
+        return True
+
+    def __member_data(self, member: _Member, data: bytes) -> int:
+        """Inflates the entry's data as needed to sniff its format, scan a nested zip or find its end
+
+        Returns:
+            int: count of bytes past the end of a streamed entry's data
+        """
+        inflater = member.inflater
+        if inflater is None:
+            self.__member_output(member, data)
+            return 0
+        while data and not inflater.eof and member.inflater is not None:
+            if member.head is not None and member.child is None:
+                limit = SNIFF_SIZE - len(member.head)
+            else:
+                limit = CHUNK_SIZE
+            output = inflater.decompress(data, limit)
+            data = inflater.unconsumed_tail
+            self.__member_output(member, output)
+            self.__check()
+        if inflater.eof:
+            return len(inflater.unused_data)
+        return 0
+
+    def __member_output(self, member: _Member, data: bytes):
+        if not data:
+            return
+        member.inflated += len(data)
+        if member.child is not None:
+            self.__root.__inflated += len(data)
+            member.child.feed(data)
+        elif member.head is not None:
+            member.head += data
+            if len(member.head) >= SNIFF_SIZE:
+                self.__sniffed(member)
+
+    def __sniffed(self, member: _Member):
+        """Starts scanning the entry's data if it is a zip, counts it if it is another archive"""
+        head = bytes(member.head)  # type: ignore
+        member.head = None
+        container = member.container or sniff(head)
+        if container is None:
+            if not member.streamed:
+                member.inflater = None
+            return
+
+        self.__nested_zips += 1
+        self.__highest_level = max(self.__highest_level, self.__level + 1)
+        self.__metrics.nested_opened += 1
+        if container.members is not None or self.__level >= self.__nested_levels_limit:
+            # Other archives are walked by DefuseZip.scan once the zip is complete
+            if not member.streamed:
+                member.inflater = None
+            return
+        member.child = IncrementalScanner(
+            self.__name,
+            self.__ratio_threshold,
+            self.__nested_zips_limit,
+            self.__nested_levels_limit,
+            self.__symlinks_allowed,
+            self.__directory_travelsal_allowed,
+            self.__memory_budget,
+            policy=self.__policy,
+            _parent=self,
+        )
+        if not member.streamed:
+            self.__zipsize -= member.file_size
+        self.__root.__inflated += len(head)
+        member.child.feed(head)
+
+    def __end_member(self, member: _Member):
+        if member.head is not None:
+            self.__sniffed(member)
+        child = member.child
+        if child is not None:
+            try:
+                child.close()
+            except BadZipFile:
+                self.__size_mismatch = True
+            self.__zipsize += child.uncompressed_size
+            self.__nested_zips += child.nested_zips_count
+            self.__highest_level = max(self.__highest_level, child.highest_level)
+            self.__directory_travelsal = (
+                self.__directory_travelsal or child.has_travelsal
+            )
+            child_report = child.report()
+            self.__symlink_found = self.__symlink_found or child_report.symlinks
+            self.__overlapping_entries += child_report.overlapping_entries
+            self.__size_mismatch = self.__size_mismatch or child_report.size_mismatch
+            member.child = None
+        self.__ratios.add(
+            self.__level, member.name, member.compress_size, member.file_size
+        )
+        self.__offsets.append(member.offset)
+        self.__compress_sizes.append(member.compress_size)
+        self.__file_sizes.append(member.file_size)
+        self.__member = None
+        self.__state = _HEADER
+
+    def __read_directory(self) -> CentralDirectory:
+        """The central directory from the end of the zip, with the header offsets from the start of the stream"""
+        try:
+            table = read_central_directory(BufferReader(self.__tail))  # type: ignore
+        except BadZipFile as e:
+            if self.__tail_start:
+                raise BadZipFile(
+                    f"Central directory of {self.__name} is damaged, or larger than memory_budget"
+                ) from e
+            raise
+        table.header_offset = array(
+            "q", (offset + self.__tail_start for offset in table.header_offset)
+        )
+        return table
+
+    def __reconcile(self, table: CentralDirectory):
+        """Checks the central directory against the local headers, and accounts the entries only it lists
+
+        The central directory must list the local headers in the same order, with the same sizes, each at the
+        same distance from the first one, the offsets of a zip with bytes prepended or cut are all off by as
+        much. Unless the local headers couldn't be followed to the end, it must not list any more entries.
+        """
+        listed = sorted(zip(table.header_offset, table.compress_size, table.file_size))
+        seen = len(self.__offsets)
+        if len(listed) < seen or (len(listed) > seen and self.__state != _DIRECTORY):
+            self.__size_mismatch = True
+        shifts = set()
+        for local, entry in zip(
+            zip(self.__offsets, self.__compress_sizes, self.__file_sizes), listed
+        ):
+            shifts.add(entry[0] - local[0])
+            if entry[1:] != local[1:]:
+                self.__size_mismatch = True
+        if len(shifts) > 1:
+            self.__size_mismatch = True
+        self.__zipsize += sum(file_size for _, _, file_size in listed[seen:])
+        self.__metrics.entries += max(0, len(listed) - seen)
+
+        self.__overlapping_entries += table.overlapping_entries()
+        findings = self.__policy.evaluate(table, self.__received)
+        if findings.pop(TRAVELSAL, None) is not None:
+            self.__directory_travelsal = True
+        if findings.pop(SYMLINK, None) is not None:
+            self.__symlink_found = True
+        for rule, finding in findings.items():
+            self.__violations.setdefault(rule, finding)
@@ -1,75 +1,113 @@
-import concurrent.futures
+import hashlib
 import io
+import mmap
+import os
+import shutil
+import stat
 import sys
-from functools import partialmethod
+import tempfile
+import time
+import zlib
+from contextlib import contextmanager
+from contextlib import nullcontext
 from pathlib import Path
 from pathlib import PosixPath
 from pathlib import WindowsPath
 from typing import Any
+from typing import Callable
+from typing import ContextManager
 from typing import Dict
+from typing import IO
+from typing import Iterator
 from typing import Optional
 from typing import Tuple
+from typing import TYPE_CHECKING
 from typing import Union
+from zipfile import BadZipFile
+from zipfile import ZIP_STORED
 from zipfile import ZipFile
+from zipfile import ZipInfo
 
-import psutil
-from loguru import logger
+from DefuseZip.utils.central_directory import CentralDirectory
+from DefuseZip.utils.central_directory import count_overlaps
+from DefuseZip.utils.central_directory import read_central_directory
+from DefuseZip.utils.containers import Container
+from DefuseZip.utils.containers import container_errors
+from DefuseZip.utils.containers import container_suffixes
+from DefuseZip.utils.containers import MIN_CONTAINER_SIZE
+from DefuseZip.utils.containers import sniff
+from DefuseZip.utils.containers import SNIFF_SIZE
+from DefuseZip.utils.containers import ZIP
+from DefuseZip.utils.metrics import CountingReader
+from DefuseZip.utils.metrics import ScanMetrics
+from DefuseZip.utils.policy import Policy
+from DefuseZip.utils.policy import SYMLINK
+from DefuseZip.utils.policy import TRAVELSAL
+from DefuseZip.utils.ratios import RatioTracker
+from DefuseZip.utils.report import NestedResult
+from DefuseZip.utils.report import ScanReport
+from DefuseZip.utils.streams import BufferReader
+from DefuseZip.utils.streams import CHUNK_SIZE
+from DefuseZip.utils.streams import member_data_offset
+from DefuseZip.utils.streams import MeteredReader
+from DefuseZip.utils.streams import open_member
+from DefuseZip.utils.streams import PrefixedReader
+from DefuseZip.utils.streams import probe_member
+from DefuseZip.utils.streams import read_chunks
+from DefuseZip.utils.streams import read_head
+from DefuseZip.utils.streams import spool
+from DefuseZip.utils.streams import SpoolLimitError
 
-from DefuseZip.utils.managers import set_rlimit  # type: ignore
+if TYPE_CHECKING:  # pragma: no cover
+    from multiprocessing.connection import Connection
+
+    from DefuseZip.utils.cache import ScanCache
 
 
 class PreRequisitesNotMetError(Exception):
     ...
 
 
-logger.remove()
-logger = logger.opt(depth=-1)
-logger.level("malicious", no=50, icon="❌", color="<red>")
-logger.level("safe", no=50, icon="✔️", color="<green>")
-logger.add(
-    sys.stderr,
-    colorize=True,
-    filter=lambda record: all(
-        level not in record["level"].name for level in ["malicious", "safe"]
-    ),
-)
-logger.add(
-    sys.stderr,
-    colorize=True,
-    filter=lambda record: "file" in record["extra"]
-    and "malicious" in record["level"].name,
-    format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> <white>|</white> <red>{level: <9} </red><white>|</white> <red>{extra[file]: <20}</red> <white>|</white> {level.icon: <3} {message}",
-    level="malicious",
-)
-logger.add(
-    sys.stderr,
-    colorize=True,
-    filter=lambda record: "file" in record["extra"] and "safe" in record["level"].name,
-    format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> <white>|</white> <white>{level: <9} </white><white>|</white> <white>{extra[file]: <20}</white> <white>|</white> {level.icon: <3} {message}",
-    level="malicious",
-)
-logger.__class__.malicious = partialmethod(logger.__class__.log, "malicious")
-logger.__class__.safe = partialmethod(logger.__class__.log, "safe")
+# Checked instead of psutil's, so psutil is imported only for safe_extract's limits
+LINUX = sys.platform.startswith("linux")
 
 
 class MaliciousFileException(Exception):
     ...
 
 
+_DEFAULT_POLICY = Policy()
+
+
 class DefuseZip:
     def __init__(
         self,
-        zip_file: Union[Path, PosixPath, WindowsPath],
+        zip_file: Union[
+            Path, PosixPath, WindowsPath, str, bytes, memoryview, mmap.mmap, IO[bytes]
+        ],
         ratio_threshold: int = 1032,
         nested_zips_limit: int = 3,
         nested_levels_limit: int = 3,
         killswitch_seconds: int = 3,
         symlinks_allowed: bool = False,
         directory_travelsal_allowed: bool = False,
+        memory_budget: int = 16777216,
+        disk_budget: int = 1073741824,
+        hard_killswitch: bool = False,
+        cache: Optional["ScanCache"] = None,
+        full_report: bool = False,
+        verify: bool = False,
+        verify_budget: int = 1073741824,
+        metrics_callback: Optional[Callable[[ScanReport], None]] = None,
+        policy: Optional[Policy] = None,
+        top_members: int = 5,
+        sniff_contents: bool = False,
+        sniff_budget: int = 1048576,
     ):
         """
         DefuseZip initializer, loads the zip and sets the arguments
-        :param zip_file: Path to zip
+        :param zip_file: Path to zip, or the zip itself as bytes, a memoryview, an mmap or a seekable binary file
+        object. In-memory zips are read in place without copying them
         :param ratio_threshold: compression ratio threshold when to call the zip malicious
         :param nested_zips_limit: Total zip count when to abort. !Aborting will mark the zip as malicious!
         :param nested_levels_limit: Limit when to abort when travelling inside zips. !Aborting will mark the zip as
@@ -77,24 +115,91 @@ class DefuseZip:
         :param killswitch_seconds: Seconds to allow traversing the zip, before hitting killswitch to prevent hangs
         :param symlinks_allowed: Boolean. Default = False
         :param directory_travelsal_allowed: Boolean. Default = False
+        :param memory_budget: Bytes of nested archive data allowed to be buffered in memory during a scan, anything
+        beyond is spooled to a temporary file. Default = 16 MiB
+        :param disk_budget: Bytes of nested archive data allowed to be spooled to temporary files at once. Going over
+        it aborts the scan and marks the zip as malicious! Default = 1 GiB
+        :param hard_killswitch: Run the scan in a subprocess that is terminated when the killswitch is hit, instead
+        of relying on the scan checking the deadline between entries and chunks. Default = False
+        :param cache: ScanCache to look the result up from by the zip's content digest, a hit skips walking the
+        zip. Default = None
+        :param full_report: Walk the whole zip to collect complete statistics. By default the scan stops as soon as
+        the zip is proven dangerous, by its ratio, travelsal, symlinks or nested zips count. Default = False
+        :param verify: Inflate every member in chunks instead of trusting the sizes declared in its headers. A member
+        inflating past ratio_threshold times its compressed size, or all of them past verify_budget, aborts the scan
+        and marks the zip as malicious! So does a member not matching its declared size or CRC. Default = False
+        :param verify_budget: Bytes allowed to be inflated in total by verify. Default = 1 GiB
+        :param metrics_callback: Called with the ScanReport of every completed scan, its metrics hold the time
+        spent in each phase and the bytes, entries and nested zips it went through, e.g.
+        PrometheusExporter.observe. Default = None
+        :param policy: Policy with more rules for the entries, like deny patterns or size limits. Breaking any of
+        them marks the zip as malicious! One Policy can be shared by any number of scans. Default = None
+        :param top_members: Count of members with the highest compression ratios to keep for the report, 0 keeps
+        none. Default = 5
+        :param sniff_contents: Read the first bytes of every member to find archives that aren't named like one,
+        e.g. a zip renamed to .dat. Members named like an archive are always looked into. Default = False
+        :param sniff_budget: Bytes of member data read in total to tell the members' formats, members past it are
+        judged by their names only. Default = 1 MiB
         """
-        if not Path(zip_file).exists():
-            raise FileNotFoundError(zip_file)
+        self.__zip_file: Optional[Path] = None
+        self.__fileobj: Optional[IO[bytes]] = None
+        if isinstance(zip_file, (str, os.PathLike)):
+            self.__zip_file = Path(zip_file)
+            if not self.__zip_file.exists():
+                raise FileNotFoundError(zip_file)
+            self.__compressed_size: int = self.__zip_file.stat().st_size
+            self.__name = self.__zip_file.name
+        else:
+            fileobj: IO[bytes]
+            if isinstance(zip_file, (bytes, bytearray, memoryview, mmap.mmap)):
+                fileobj = BufferReader(zip_file)  # type: ignore
+            else:
+                fileobj = zip_file
+            self.__fileobj = fileobj
+            self.__compressed_size = fileobj.seek(0, io.SEEK_END)
+            name = getattr(zip_file, "name", None)
+            self.__name = Path(name).name if isinstance(name, str) else "<memory>"
         self.__killswitch_seconds = killswitch_seconds
+        self.__hard_killswitch = hard_killswitch
+        self.__deadline: float = 0.0
         self.__ratio_threshold = ratio_threshold
         self.__nested_zips_limit = nested_zips_limit
         self.__symlinks_allowed = symlinks_allowed
         self.__nested_levels_limit = nested_levels_limit
-        self.__zip_file = zip_file
         self.__directory_travelsal_allowed = directory_travelsal_allowed
+        self.__memory_budget = memory_budget
+        self.__disk_budget = disk_budget
+        self.__buffered_bytes: int = 0
+        self.__spilled_bytes: int = 0
+        self.__inflated_bytes: int = 0
+        self.__cache = cache
+        self.__nested_results: Dict[str, NestedResult] = {}
+        self.__truncated: bool = False
+        self.__full_report = full_report
+        self.__verify = verify
+        self.__verify_budget = verify_budget
+        self.__verified_bytes: int = 0
+        self.__size_mismatch: bool = False
+        self.__stopped_early: bool = False
+        self.__metrics = ScanMetrics()
+        self.__metrics_callback = metrics_callback
+        self.__policy = policy if policy is not None else _DEFAULT_POLICY
+        self.__violations: Dict[str, str] = {}
+        self.__ratios = RatioTracker(top_members)
+        self.__sniff_contents = sniff_contents
+        self.__sniff_budget = sniff_budget
+        self.__sniffed_bytes: int = 0
 
         self.__scan_completed: bool = False
+        self.__cached: bool = False
+        self.__scan_seconds: float = 0.0
         self.__is_dangerous: bool = False
         self.__killswitch: bool = False
+        self.__spool_limit_reached: bool = False
         self.__symlink_found: bool = False
         self.__directory_travelsal = False
+        self.__overlapping_entries: int = 0
 
-        self.__compressed_size: int = self.__zip_file.stat().st_size
         self.__zipsize: int = 0
         self.__ratio: float = 0.00
         self.highest_level = 0
@@ -105,8 +210,76 @@ class DefuseZip:
         self.__compressed_size_str: str = ""
         self.__message: str = ""
 
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state.pop("_DefuseZip__cache", None)
+        state.pop("_DefuseZip__fileobj", None)
+        state.pop("_DefuseZip__metrics_callback", None)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self.__cache = None
+        self.__fileobj = None
+        self.__metrics_callback = None
+
+    def __open(self) -> ContextManager[IO[bytes]]:
+        """Opens the zip for reading, an in-memory zip or a given file object is left open afterwards"""
+        if self.__fileobj is not None:
+            return nullcontext(self.__fileobj)
+        return open(self.__zip_file, "rb")  # type: ignore
+
+    @contextmanager
+    def __as_file(self) -> Iterator[Path]:
+        """Path of the zip, an in-memory zip or a file object is copied to a temporary file for the duration"""
+        if self.__zip_file is not None:
+            yield self.__zip_file
+            return
+        with self.__open() as f, tempfile.NamedTemporaryFile(suffix=".zip") as copy:
+            f.seek(0)
+            shutil.copyfileobj(f, copy, CHUNK_SIZE)
+            copy.flush()
+            yield Path(copy.name)
+
+    def __killswitch_hit(self) -> bool:
+        """Hits the killswitch once the scan's deadline has passed"""
+        if not self.__killswitch and time.monotonic() >= self.__deadline:
+            self.__killswitch = True
+        return self.__killswitch
+
+    def __verdict_reached(self) -> bool:
+        """Fail-fast check, True once the zip is proven dangerous, unless a full report was asked for"""
+        self.__check_total_size()
+        if self.__full_report or self.__stopped_early:
+            return self.__stopped_early
+        if (
+            self.__zipsize > self.__ratio_threshold * self.__compressed_size
+            or (self.__directory_travelsal and not self.__directory_travelsal_allowed)
+            or (self.__symlink_found and not self.__symlinks_allowed)
+            or self.__overlapping_entries
+            or self.__size_mismatch
+            or self.__violations
+            or (
+                self.__nested_zips_limit
+                and self.nested_zips_count > self.__nested_zips_limit
+            )
+        ):
+            self.__stopped_early = True
+        return self.__stopped_early
+
+    def __check_total_size(self):
+        """The policy's max_total_size applies to the whole scan, nested zips included"""
+        limit = self.__policy.max_total_size
+        if limit is not None and self.__zipsize > limit:
+            self.__violations.setdefault("max_total_size", f"{self.__zipsize} bytes")
+
+    def __violations_text(self) -> Tuple[str, ...]:
+        return tuple(
+            f"{rule}: {finding}" for rule, finding in self.__violations.items()
+        )
+
     def should_return_from_recursion(self) -> bool:
-        if self.__killswitch:
+        if self.__killswitch_hit() or self.__verdict_reached():
             return True
         if self.__nested_zips_limit and (
             self.nested_zips_count >= self.__nested_zips_limit
@@ -115,54 +288,576 @@ class DefuseZip:
             return True
         return False
 
-    def should_continue_recursion(self, filename: str) -> bool:
-        if any(travelsal in filename for travelsal in ("../", "..\\")):
-            self.__directory_travelsal = True
+    def should_continue_recursion(self, filename: str, external_attr: int = 0) -> bool:
+        """True if the entry is to be skipped, a travelsal name or a symlink by the Unix mode in its attributes
+
+        The entry's name is also checked against the policy's name rules.
+        """
+        rules = self.__policy.match_name(filename)
+        for rule in rules:
+            if rule == TRAVELSAL:
+                self.__directory_travelsal = True
+            else:
+                self.__violations.setdefault(rule, filename)
+        if TRAVELSAL in rules:
             return True
-        if psutil.LINUX and Path(filename).is_symlink():  # pragma: no cover
+        if stat.S_ISLNK(external_attr >> 16):
             self.__symlink_found = True
             return True
         return False
 
-    def __recursive_zips(
-        self, zip_bytes: io.BytesIO, level: int = 0
-    ) -> Tuple[int, int]:
-        """[summary]
+    def __apply_policy(self, table: CentralDirectory, compressed_size: int):
+        """Records what the policy finds in the central directory of one zip of the scan"""
+        findings = self.__policy.evaluate(table, compressed_size)
+        if findings.pop(TRAVELSAL, None) is not None:
+            self.__directory_travelsal = True
+        if findings.pop(SYMLINK, None) is not None:
+            self.__symlink_found = True
+        for rule, finding in findings.items():
+            self.__violations.setdefault(rule, finding)
+
+    def __recursive_zips(self, zip_bytes: IO[bytes], level: int = 0) -> Tuple[int, int]:
+        """Walks the zip and every nested zip inside it, summing up the uncompressed sizes
+
+        Nested zips are opened through seekable views or spooled buffers, never read whole into memory.
 
         Args:
-            zip_bytes (io.BytesIO): [description]
-            level (int, optional): [description]. Defaults to 0.
+            zip_bytes (IO[bytes]): seekable file object of the zip
+            level (int, optional): nesting level of the zip. Defaults to 0.
 
         Returns:
-            Tuple[int, int]: [description]
+            Tuple[int, int]: count of nested zips found, deepest level reached
         """
         if self.should_return_from_recursion():
+            self.__truncated = True
             return 0, level - 1
 
         toplevel = level
+        if level > 0 and self.__policy.has_rules:
+            try:
+                table = read_central_directory(zip_bytes)
+            except BadZipFile:
+                pass  # ZipFile raises it too
+            else:
+                self.__apply_policy(table, zip_bytes.seek(0, io.SEEK_END))
         with ZipFile(zip_bytes, "r") as zf:
             cur_count = 0
-            for f in zf.namelist():
-                if self.__killswitch:
+            infolist = zf.infolist()
+            if level > 0:
+                self.__overlapping_entries += count_overlaps(
+                    (info.header_offset for info in infolist),
+                    (info.compress_size for info in infolist),
+                )
+            for info in infolist:
+                if self.__killswitch_hit():
+                    self.__truncated = True
                     return cur_count, self.__nested_levels_limit
+                if self.__verdict_reached():
+                    self.__truncated = True
+                    return cur_count, toplevel
+                self.__metrics.entries += 1
 
-                if self.should_continue_recursion(f):
+                if self.should_continue_recursion(info.filename, info.external_attr):
                     continue
+                self.__ratios.add(
+                    level, info.filename, info.compress_size, info.file_size
+                )
 
-                if f.endswith(".zip"):
+                container = self.__sniff_member(zf, info)
+                if container is not None:
                     cur_count += 1
-                    zfiledata = io.BytesIO(zf.read(f))
-                    a, b = self.__recursive_zips(zfiledata, level=level + 1)
+                    if container.members is None:
+                        a, b = self.__nested_zip(zip_bytes, zf, info, level)
+                    else:
+                        a, b = self.__nested_container(zf, info, container, level)
                     cur_count += a
-                    if b > self.highest_level:
-                        toplevel = b
-                        self.highest_level = b
+                    toplevel = max(toplevel, b)
+                    self.highest_level = max(self.highest_level, b)
                     self.nested_zips_count = cur_count
+                elif self.__verify:
+                    self.__zipsize += self.__probe(zip_bytes, zf, info)
                 else:
-                    self.__zipsize += zf.getinfo(f).file_size
+                    self.__zipsize += info.file_size
 
         return cur_count, toplevel
 
+    def __sniff_member(self, zf: ZipFile, info: ZipInfo) -> Optional[Container]:
+        """The archive format of a member by the first bytes of its data, None if it isn't an archive
+
+        Members named .zip are walked as zips whatever their data, as they always were. Others are only read
+        when named like an archive, or with sniff_contents within sniff_budget.
+        """
+        if info.filename.endswith(".zip"):
+            return ZIP
+        if info.is_dir() or info.flag_bits & 0x1 or info.file_size < MIN_CONTAINER_SIZE:
+            return None
+        if not info.filename.lower().endswith(container_suffixes()) and (
+            not self.__sniff_contents or self.__sniffed_bytes >= self.__sniff_budget
+        ):
+            return None
+        try:
+            with zf.open(info) as member:
+                head = member.read(SNIFF_SIZE)
+        except (
+            BadZipFile,
+            EOFError,
+            OSError,
+            ValueError,
+            zlib.error,
+            NotImplementedError,
+        ):
+            return None
+        self.__sniffed_bytes += len(head)
+        return sniff(head)
+
+    def __nested_container(
+        self, zf: ZipFile, info: ZipInfo, container: Container, level: int
+    ) -> Tuple[int, int]:
+        """Walks a tar, gzip, bz2 or xz member as it is inflated, without spooling it
+
+        Args:
+            zf (ZipFile): the containing zip
+            info (ZipInfo): the nested container
+            container (Container): its format
+            level (int): nesting level of the containing zip
+
+        Returns:
+            Tuple[int, int]: count of nested containers found inside, deepest level reached
+        """
+        try:
+            with zf.open(info) as member:
+                data: IO[bytes] = member  # type: ignore
+                if info.compress_type != ZIP_STORED:
+                    data = MeteredReader(member, self.__account_inflated)  # type: ignore
+                return self.__walk_container(data, container, level + 1)
+        except BadZipFile:
+            self.__size_mismatch = True
+            return 0, level + 1
+
+    def __walk_container(
+        self, stream: IO[bytes], container: Container, level: int
+    ) -> Tuple[int, int]:
+        """Walks a streamed container front to back, and every container nested inside it
+
+        Damaged data ends the container, the entries read up to that point are accounted.
+
+        Args:
+            stream (IO[bytes]): the container's data, read sequentially
+            container (Container): its format
+            level (int): nesting level of the container
+
+        Returns:
+            Tuple[int, int]: count of nested containers found, deepest level reached
+        """
+        if self.should_return_from_recursion():
+            self.__truncated = True
+            return 0, level - 1
+
+        toplevel = level
+        cur_count = 0
+        try:
+            for entry in container.members(stream):  # type: ignore
+                if self.__killswitch_hit():
+                    self.__truncated = True
+                    return cur_count, self.__nested_levels_limit
+                if self.__verdict_reached():
+                    self.__truncated = True
+                    return cur_count, toplevel
+                self.__metrics.entries += 1
+
+                if entry.link:
+                    self.__symlink_found = True
+                    continue
+                if self.should_continue_recursion(entry.name):
+                    continue
+
+                with entry.open() as data:
+                    reader = data
+                    if container.decompresses:
+                        reader = MeteredReader(data, self.__account_inflated)  # type: ignore
+                    a, b = self.__stream_member(
+                        reader, entry.size, level, container.decompresses
+                    )
+                if a:
+                    cur_count += a
+                    toplevel = max(toplevel, b)
+                    self.highest_level = max(self.highest_level, b)
+                    self.nested_zips_count = cur_count
+        except container_errors():
+            pass
+        return cur_count, toplevel
+
+    def __stream_member(
+        self, data: IO[bytes], size: Optional[int], level: int, layer: bool
+    ) -> Tuple[int, int]:
+        """Accounts a member of a streamed container, walking it if it is a container itself
+
+        Args:
+            data (IO[bytes]): the member's data, read sequentially
+            size (Optional[int]): its size, None to count it by reading the data
+            level (int): nesting level of the containing container
+            layer (bool): the container only compresses the member, like the gzip of a tar.gz, so a
+                container in it is the same archive and not one more nested
+
+        Returns:
+            Tuple[int, int]: count of nested containers, the member itself included, deepest level reached
+        """
+        head = data.read(SNIFF_SIZE)
+        while 0 < len(head) < SNIFF_SIZE:
+            more = data.read(SNIFF_SIZE - len(head))
+            if not more:
+                break
+            head += more
+        container = sniff(head)
+        if container is None:
+            if size is None:
+                chunks = read_chunks(data, sys.maxsize, self.__killswitch_hit)
+                size = len(head) + sum(len(chunk) for chunk in chunks)
+            self.__zipsize += size
+            return 0, level
+
+        rest: IO[bytes] = PrefixedReader(head, data)  # type: ignore
+        if not layer:
+            level += 1
+        if container.members is not None:
+            count, deepest = self.__walk_container(rest, container, level)
+        else:
+            with self.__spool_stream(rest) as spooled:
+                count, deepest = self.__recursive_zips(spooled, level)
+        return count + (not layer), deepest
+
+    def __account_inflated(self, size: int):
+        """Counts bytes inflated from nested containers, in total capped at ratio_threshold times the
+        compressed size
+
+        Raises:
+            SpoolLimitError: killswitch hit or the cap was exceeded
+        """
+        self.__inflated_bytes += size
+        if self.__inflated_bytes > self.__ratio_threshold * self.__compressed_size:
+            raise SpoolLimitError("Nested archives inflate past the ratio threshold")
+        if self.__killswitch_hit():
+            raise SpoolLimitError("Cancelled while inflating")
+
+    @contextmanager
+    def __spool_stream(self, stream: IO[bytes]) -> Iterator[IO[bytes]]:
+        """Spools a zip found in a streamed container, to give it the seekable file it needs, within the
+        memory and disk budgets
+
+        Raises:
+            SpoolLimitError: killswitch hit or the disk budget was exhausted
+        """
+        reserved = max(0, self.__memory_budget - self.__buffered_bytes)
+        max_bytes = reserved + self.__disk_budget - self.__spilled_bytes
+        metrics = self.__metrics
+        metrics.nested_opened += 1
+        self.__buffered_bytes += reserved
+        metrics.peak_buffered_bytes = max(
+            metrics.peak_buffered_bytes, self.__buffered_bytes
+        )
+        try:
+            chunks = read_chunks(stream, max_bytes, self.__killswitch_hit)
+            with spool(chunks, reserved) as spooled:
+                size = spooled.seek(0, io.SEEK_END)
+                spooled.seek(0)
+                spilled = size if size > reserved else 0
+                self.__spilled_bytes += spilled
+                metrics.peak_spooled_bytes = max(
+                    metrics.peak_spooled_bytes, self.__spilled_bytes
+                )
+                try:
+                    yield spooled
+                finally:
+                    self.__spilled_bytes -= spilled
+        finally:
+            self.__buffered_bytes -= reserved
+
+    def __nested_zip(
+        self, zip_bytes: IO[bytes], zf: ZipFile, info: ZipInfo, level: int
+    ) -> Tuple[int, int]:
+        """Walks a nested zip, or reuses the result of an identical one walked before
+
+        Identical nested zips are recognised by CRC32 and sizes, confirmed by a digest of their
+        compressed data. Results are remembered for this scan and, with a cache, across scans.
+        Only walks that were not cut short by the limits or the killswitch are remembered.
+
+        Args:
+            zip_bytes (IO[bytes]): seekable file object of the containing zip
+            zf (ZipFile): the containing zip
+            info (ZipInfo): the nested zip
+            level (int): nesting level of the containing zip
+
+        Returns:
+            Tuple[int, int]: count of nested zips found inside, deepest level reached
+        """
+        key = self.__nested_key(zip_bytes, info)
+        subtree = self.__nested_results.get(key) if key else None
+        if subtree is None and key and self.__cache is not None:
+            subtree = self.__cache.get_nested(key)
+            if subtree is not None:
+                self.__nested_results[key] = subtree
+        if subtree is not None:
+            self.__metrics.nested_reused += 1
+            for rule, finding in subtree.violations.items():
+                self.__violations.setdefault(rule, finding)
+            self.__ratios.merge(subtree.ratios, level + 1)
+            self.__zipsize += subtree.uncompressed_size
+            self.__overlapping_entries += subtree.overlapping_entries
+            self.__size_mismatch = self.__size_mismatch or subtree.size_mismatch
+            self.__directory_travelsal = (
+                self.__directory_travelsal or subtree.directory_travelsal
+            )
+            self.__symlink_found = self.__symlink_found or subtree.symlinks
+            return subtree.nested_zips, level + subtree.nested_levels
+
+        zipsize_before = self.__zipsize
+        overlapping_before = self.__overlapping_entries
+        travelsal_before, self.__directory_travelsal = self.__directory_travelsal, False
+        symlink_before, self.__symlink_found = self.__symlink_found, False
+        mismatch_before, self.__size_mismatch = self.__size_mismatch, False
+        truncated_before, self.__truncated = self.__truncated, False
+        violations_before, self.__violations = self.__violations, {}
+        ratios_before = self.__ratios
+        self.__ratios = RatioTracker(ratios_before.top_k)
+        try:
+            with self.__open_nested(zip_bytes, zf, info) as zfiledata:
+                count, deepest = self.__recursive_zips(zfiledata, level=level + 1)
+            if key and not self.__truncated:
+                subtree = NestedResult(
+                    count,
+                    deepest - level,
+                    self.__zipsize - zipsize_before,
+                    self.__directory_travelsal,
+                    self.__symlink_found,
+                    self.__overlapping_entries - overlapping_before,
+                    self.__size_mismatch,
+                    dict(self.__violations),
+                    self.__ratios.export(level + 1),
+                )
+                self.__nested_results[key] = subtree
+                if self.__cache is not None:
+                    self.__cache.put_nested(key, subtree)
+        finally:
+            self.__directory_travelsal = self.__directory_travelsal or travelsal_before
+            self.__symlink_found = self.__symlink_found or symlink_before
+            self.__size_mismatch = self.__size_mismatch or mismatch_before
+            self.__truncated = self.__truncated or truncated_before
+            for rule, finding in self.__violations.items():
+                violations_before.setdefault(rule, finding)
+            self.__violations = violations_before
+            ratios_before.merge(self.__ratios.export(0), 0)
+            self.__ratios = ratios_before
+        return count, deepest
+
+    def __nested_key(self, zip_bytes: IO[bytes], info: ZipInfo) -> str:
+        """Identity of a nested zip for reusing its result, empty if it can't be reused
+
+        The digest is taken from the compressed data, so recognising a repeated zip costs reading its
+        compressed bytes once instead of inflating and walking it again.
+        """
+        if info.flag_bits & 0x1:
+            return ""
+        digest = hashlib.sha256()
+        zip_bytes.seek(member_data_offset(zip_bytes, info))
+        remaining = info.compress_size
+        while remaining > 0:
+            if self.__killswitch_hit():
+                return ""
+            chunk = zip_bytes.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                return ""
+            digest.update(chunk)
+            remaining -= len(chunk)
+        return (
+            f"nested:{info.compress_type}:{info.CRC}:{info.compress_size}:"
+            f"{info.file_size}:{digest.hexdigest()}"
+            + (":verified" if self.__verify else "")
+            + (":" + self.__policy.key if self.__policy.has_rules else "")
+        )
+
+    def __scan_archive(self, zip_bytes: IO[bytes]) -> None:
+        """Accounts the zip from its central directory alone, unless it has to be walked recursively
+
+        Tar, gzip, bz2 and xz files are recognised by their first bytes and walked as streams instead.
+
+        Args:
+            zip_bytes (IO[bytes]): seekable file object of the zip
+        """
+        zip_bytes.seek(0)
+        container = sniff(zip_bytes.read(SNIFF_SIZE))
+        if container is not None and container.members is not None:
+            zip_bytes.seek(0)
+            with self.__metrics.timed("walk"):
+                try:
+                    self.__walk_container(zip_bytes, container, 0)
+                except SpoolLimitError:
+                    self.__spool_limit_reached = not self.__killswitch
+            return
+
+        with self.__metrics.timed("central_directory"):
+            try:
+                table = read_central_directory(zip_bytes)
+            except BadZipFile:
+                table = None
+            if table is not None:
+                self.__overlapping_entries = table.overlapping_entries()
+                self.__apply_policy(table, self.__compressed_size)
+                if self.__verdict_reached():
+                    return
+            summed = (
+                table is not None
+                and not self.__verify
+                and self.__central_directory_scan(table, zip_bytes)
+            )
+        if not summed:
+            with self.__metrics.timed("walk"):
+                try:
+                    self.__recursive_zips(zip_bytes, 0)
+                except SpoolLimitError:
+                    self.__spool_limit_reached = not self.__killswitch
+
+    def __central_directory_scan(
+        self, table: CentralDirectory, zip_bytes: IO[bytes]
+    ) -> bool:
+        """Fast path for zips without nested archives or travelsal names, sums the sizes in one pass
+
+        Args:
+            table (CentralDirectory): central directory of the zip
+            zip_bytes (IO[bytes]): seekable file object of the zip
+
+        Returns:
+            bool: False if the zip needs the recursive walk instead
+        """
+        if self.__directory_travelsal:
+            return self.__verdict_reached()
+        if self.__may_hold_archives(table, zip_bytes):
+            return False
+
+        zipsize = table.total_uncompressed
+        if self.__symlink_found:
+            # Links are skipped by the walk, so they don't count here either
+            zipsize -= sum(
+                file_size
+                for file_size, attr in zip(table.file_size, table.external_attr)
+                if stat.S_ISLNK(attr >> 16)
+            )
+        self.__zipsize = zipsize
+        self.__ratios.add_table(0, table)
+        self.__metrics.entries += len(table)
+        return True
+
+    def __may_hold_archives(
+        self, table: CentralDirectory, zip_bytes: IO[bytes]
+    ) -> bool:
+        """True if a member is named like an archive, or with sniff_contents, its data can't rule it out
+
+        Without sniff_contents no member data is read. With it, the members' first bytes are read straight
+        from their local headers until sniff_budget is spent, members too short to hold an archive and
+        encrypted ones are skipped.
+        """
+        suffixes = (suffix.encode() for suffix in container_suffixes())
+        if table.has_name_ending(*suffixes, ignore_case=True):
+            return True
+        if not self.__sniff_contents:
+            return False
+        flags = table.flags
+        for index, file_size in enumerate(table.file_size):
+            if file_size < MIN_CONTAINER_SIZE or flags[index] & 0x1:
+                continue
+            if self.__killswitch_hit():
+                return True
+            if self.__sniffed_bytes >= self.__sniff_budget:
+                return False
+            head = read_head(
+                zip_bytes,
+                table.header_offset[index],
+                table.compress_type[index],
+                table.compress_size[index],
+                SNIFF_SIZE,
+            )
+            if head is None or sniff(head) is not None:
+                return True
+            self.__sniffed_bytes += len(head)
+        return False
+
+    def __probe(self, zip_bytes: IO[bytes], zf: ZipFile, info: ZipInfo) -> int:
+        """Real size of a member, inflated within ratio_threshold times its compressed size and verify_budget
+
+        A member whose size or CRC doesn't match its headers sets size_mismatch, its measured size counts.
+
+        Raises:
+            SpoolLimitError: killswitch hit or a limit was exceeded while inflating
+        """
+        if info.is_dir() or info.flag_bits & 0x1:
+            return info.file_size
+        max_bytes = min(
+            self.__ratio_threshold * max(info.compress_size, 1),
+            self.__verify_budget - self.__verified_bytes,
+        )
+        try:
+            with self.__metrics.timed("verify"):
+                size, crc = probe_member(
+                    zip_bytes, zf, info, max_bytes, self.__killswitch_hit
+                )
+        except NotImplementedError:  # pragma: no cover
+            return info.file_size
+        except (BadZipFile, EOFError, OSError, zlib.error):
+            self.__size_mismatch = True
+            return info.file_size
+        self.__verified_bytes += size
+        if size != info.file_size or crc != info.CRC:
+            self.__size_mismatch = True
+        return size
+
+    @contextmanager
+    def __open_nested(
+        self, zip_bytes: IO[bytes], zf: ZipFile, info: ZipInfo
+    ) -> Iterator[IO[bytes]]:
+        """Opens a nested zip, holding its share of the memory and disk budgets while it is open
+
+        Inflating nested zips is capped in total at ratio_threshold times the compressed size, going
+        past that already proves the zip malicious.
+
+        Raises:
+            SpoolLimitError: killswitch hit or a budget was exhausted while inflating
+        """
+        reserved = max(
+            0, min(info.file_size, self.__memory_budget - self.__buffered_bytes)
+        )
+        max_bytes = min(
+            self.__ratio_threshold * self.__compressed_size - self.__inflated_bytes,
+            reserved + self.__disk_budget - self.__spilled_bytes,
+        )
+        metrics = self.__metrics
+        metrics.nested_opened += 1
+        self.__buffered_bytes += reserved
+        metrics.peak_buffered_bytes = max(
+            metrics.peak_buffered_bytes, self.__buffered_bytes
+        )
+        started = time.perf_counter()
+        try:
+            with open_member(
+                zip_bytes, zf, info, reserved, max_bytes, self.__killswitch_hit
+            ) as member:
+                size = 0
+                # Stored members are read in place, only spooled ones were inflated
+                if not isinstance(member, io.BufferedReader):
+                    size = member.seek(0, 2)
+                    member.seek(0)
+                metrics.add("inflate", time.perf_counter() - started)
+                spilled = size if size > reserved else 0
+                self.__inflated_bytes += size
+                self.__spilled_bytes += spilled
+                metrics.peak_spooled_bytes = max(
+                    metrics.peak_spooled_bytes, self.__spilled_bytes
+                )
+                try:
+                    yield member
+                finally:
+                    self.__spilled_bytes -= spilled
+        finally:
+            self.__buffered_bytes -= reserved
+
     @classmethod
     def format_bytes(cls, filesize_bytes: Union[int, float]) -> str:
         """[summary]
@@ -201,32 +896,81 @@ class DefuseZip:
     def has_links(self) -> bool:
         return self.__symlink_found
 
+    @property
+    def has_overlaps(self) -> bool:  # dead: disable
+        return self.__overlapping_entries > 0
+
     def _recursive_nested_zips_check(self):
         """Scans the zip file for nested zips
 
-        Returns:
-            bool: True if limit has been reached, False if not.
+        The scan checks the killswitch deadline between entries and between inflated chunks. With
+        hard_killswitch it runs in a subprocess instead, which is terminated once the deadline passes.
         """
+        self.__deadline = time.monotonic() + self.__killswitch_seconds
+        if self.__hard_killswitch:
+            started = time.perf_counter()
+            self.__scan_in_subprocess()
+            self.__metrics.add("subprocess", time.perf_counter() - started)
+        else:
+            with self.__open() as f:
+                self.__scan_archive(CountingReader(f, self.__metrics))  # type: ignore
 
-        with open(self.__zip_file, "rb") as f:
-            zdata = io.BytesIO(f.read())
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                try:
-                    future = executor.submit(self.__recursive_zips, zdata, 0)
-                    future.result(timeout=self.__killswitch_seconds)
-                except concurrent.futures.TimeoutError:
-                    self.__killswitch = True
+        if (
+            self.__nested_zips_limit
+            and self.nested_zips_count > self.__nested_zips_limit
+        ):
+            self.__nested_zips_limit_reached = True  # pragma: no cover
+        else:
+            self.__nested_zips_limit_reached = False  # pragma: no cover
 
-            if (
-                self.__nested_zips_limit
-                and self.nested_zips_count > self.__nested_zips_limit
-            ):
-                self.__nested_zips_limit_reached = True  # pragma: no cover
-            else:
-                self.__nested_zips_limit_reached = False  # pragma: no cover
+    def _scan_in_child(self, sender: "Connection"):
+        """Subprocess side of hard_killswitch, sends back the scan's state or the exception it raised"""
+        try:
+            with self.__open() as f:
+                self.__scan_archive(CountingReader(f, self.__metrics))  # type: ignore
+        except Exception as e:
+            sender.send((False, e))
+        else:
+            sender.send((True, self.__getstate__()))
+        finally:
+            sender.close()
+
+    def __scan_in_subprocess(self):
+        """Runs the scan in a subprocess and terminates it when the killswitch is hit"""
+        import multiprocessing
+
+        context = multiprocessing.get_context()
+        if self.__fileobj is not None and context.get_start_method() != "fork":
+            raise ValueError(
+                "hard_killswitch needs the fork start method to scan an in-memory zip"
+            )  # pragma: no cover
+        receiver, sender = context.Pipe(duplex=False)
+        worker = context.Process(
+            target=self._scan_in_child, args=(sender,), daemon=True
+        )
+        worker.start()
+        sender.close()
+        try:
+            timeout = max(0.0, self.__deadline - time.monotonic())
+            if not receiver.poll(timeout):
+                self.__killswitch = True
+                return
+            try:
+                completed, result = receiver.recv()
+            except EOFError:
+                self.__killswitch = True
+                return
+            if not completed:
+                raise result
+            self.__dict__.update(result)
+        finally:
+            receiver.close()
+            worker.kill()
+            worker.join()
 
     def __set_zip_status(self):
         """[summary]"""
+        self.__check_total_size()
         ratio_check = self.__ratio > self.__ratio_threshold
         symlinks_check = not self.__symlinks_allowed and self.__symlink_found
         travelsal_check = (
@@ -239,13 +983,27 @@ class DefuseZip:
                 travelsal_check,
                 self.__killswitch,
                 self.__nested_zips_limit_reached,
+                self.__violations,
+                self.__spool_limit_reached,
+                self.__overlapping_entries,
+                self.__size_mismatch,
             )
         ):
             self.__is_dangerous = True
 
     def __set_zip_output(self):
         """[summary]"""
-        if not self.__killswitch:
+        if self.__stopped_early:
+            self.__message = (
+                "Stopped at the first finding that makes the zip dangerous, "
+                "values collected are valid only to that point"
+            )
+        elif self.__spool_limit_reached:
+            self.__message = (
+                "Aborted due to zips inflating past the ratio threshold, disk budget or verify budget, "
+                "values collected are valid only to that point"
+            )
+        elif not self.__killswitch:
             self.__message = (
                 f"Aborted due to too deep recursion {self.highest_level}>{self.__nested_levels_limit})"
                 if self.highest_level > self.__nested_levels_limit
@@ -274,7 +1032,69 @@ class DefuseZip:
             "Nested levels": self.highest_level,
             "Symlinks": self.has_links,
             "Directory travelsal": self.has_travelsal,
+            "Overlapping entries": self.__overlapping_entries,
+            "Size mismatch": self.__size_mismatch,
         }
+        top = self.__ratios.top()
+        if top:
+            self.__output["Highest member ratio"] = f"{top[0].ratio:.2f} {top[0].name}"
+        if self.__violations:
+            self.__output["Policy violations"] = self.__violations_text()
+
+    def __cache_key(self) -> str:
+        """Content digest of the zip and the thresholds that decide its verdict"""
+        digest = hashlib.sha256()
+        with self.__open() as f:
+            f.seek(0)
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                self.__metrics.bytes_read += len(chunk)
+        thresholds = (
+            self.__ratio_threshold,
+            self.__nested_zips_limit,
+            self.__nested_levels_limit,
+            self.__symlinks_allowed,
+            self.__directory_travelsal_allowed,
+            self.__disk_budget,
+            self.__full_report,
+            self.__verify,
+            self.__verify_budget,
+            self.__policy.key,
+            self.__sniff_contents,
+            self.__sniff_budget,
+        )
+        return digest.hexdigest() + ":" + ":".join(str(value) for value in thresholds)
+
+    def __result(self) -> Dict[str, Any]:
+        return {
+            "is_dangerous": self.__is_dangerous,
+            "zipsize": self.__zipsize,
+            "ratio": self.__ratio,
+            "highest_level": self.highest_level,
+            "nested_zips_count": self.nested_zips_count,
+            "symlink_found": self.__symlink_found,
+            "directory_travelsal": self.__directory_travelsal,
+            "overlapping_entries": self.__overlapping_entries,
+            "size_mismatch": self.__size_mismatch,
+            "violations": self.__violations,
+            "ratios": self.__ratios.export(0),
+            "output": self.__output,
+        }
+
+    def __restore_result(self, result: Dict[str, Any]):
+        self.__is_dangerous = result["is_dangerous"]
+        self.__zipsize = result["zipsize"]
+        self.__ratio = result["ratio"]
+        self.highest_level = result["highest_level"]
+        self.nested_zips_count = result["nested_zips_count"]
+        self.__symlink_found = result["symlink_found"]
+        self.__directory_travelsal = result["directory_travelsal"]
+        self.__overlapping_entries = result["overlapping_entries"]
+        self.__size_mismatch = result["size_mismatch"]
+        self.__violations = dict(result.get("violations", {}))
+        if "ratios" in result:
+            self.__ratios.merge(result["ratios"], 0)
+        self.__output = dict(result["output"])
 
     def scan(self) -> bool:
         """
@@ -282,23 +1102,41 @@ class DefuseZip:
         True if dangerous, False if not.
         :return: boolean
         """
-        if not self.__zip_file.exists():
+        if self.__zip_file is not None and not self.__zip_file.exists():
             raise FileNotFoundError
 
-        self._recursive_nested_zips_check()
+        started = time.perf_counter()
+        cache_key = ""
+        cached = None
+        if self.__cache is not None:
+            with self.__metrics.timed("cache"):
+                cache_key = self.__cache_key()
+                cached = self.__cache.get(cache_key)
+        self.__cached = cached is not None
+        if cached is not None:
+            self.__restore_result(cached)
+        else:
+            self._recursive_nested_zips_check()
 
-        try:
-            self.__ratio = self.__zipsize / self.__compressed_size
-        except ZeroDivisionError:  # pragma: no cover
-            self.__ratio = 0.00
+            try:
+                self.__ratio = self.__zipsize / self.__compressed_size
+            except ZeroDivisionError:  # pragma: no cover
+                self.__ratio = 0.00
 
-        self.__scan_completed = True
+            self.__set_zip_status()
+            self.__set_zip_output()
 
-        self.__set_zip_status()
-        self.__set_zip_output()
+            # A killswitch verdict depends on timing, not on the zip, so it is not worth remembering
+            if self.__cache is not None and not self.__killswitch:
+                self.__cache.put(cache_key, self.__result())
+
+        self.__scan_seconds = time.perf_counter() - started
+        self.__scan_completed = True
+        if self.__metrics_callback is not None:
+            self.__metrics_callback(self.report())
 
         if self.__is_dangerous:
-            raise MaliciousFileException(self.__zip_file.name)
+            raise MaliciousFileException(self.__name)
 
         return self.__is_dangerous
 
@@ -312,11 +1150,48 @@ class DefuseZip:
             raise PreRequisitesNotMetError(
                 "You need to run a scan first, to get output"
             )  # pragma: no cover
-        with logger.contextualize(file=self.__zip_file.name):
-            output = logger.safe if not self.__is_dangerous else logger.malicious
+        from loguru import logger
+
+        from DefuseZip.utils.log import configure_logging
+
+        configure_logging()
+        level = "safe" if not self.__is_dangerous else "malicious"
+        # Records are attributed to the caller of output(), not to this method
+        log = logger.opt(depth=1)
+        with logger.contextualize(file=self.__name):
             for k, v in self.__output.items():
-                output(f"\t{k} = {v}")
-            output(f"\tLocation: {self.__zip_file.resolve()}\n")
+                log.log(level, f"\t{k} = {v}")
+            location = self.__zip_file.resolve() if self.__zip_file else self.__name
+            log.log(level, f"\tLocation: {location}\n")
+
+    def report(self) -> ScanReport:
+        """
+        Returns the results of the scan as raw values, for logging or serializing them
+        :return: ScanReport
+        """
+        self.raise_for_exception()
+        return ScanReport(
+            file=str(self.__zip_file) if self.__zip_file else self.__name,
+            dangerous=self.__is_dangerous,
+            message=self.__message,
+            compressed_size=self.__compressed_size,
+            uncompressed_size=self.__zipsize,
+            ratio=self.__ratio,
+            level_ratios=self.__ratios.level_ratios(),
+            top_members=self.__ratios.top(),
+            nested_zips=self.nested_zips_count,
+            nested_levels=self.highest_level,
+            symlinks=self.__symlink_found,
+            directory_travelsal=self.__directory_travelsal,
+            overlapping_entries=self.__overlapping_entries,
+            size_mismatch=self.__size_mismatch,
+            violations=self.__violations_text(),
+            killswitch=self.__killswitch,
+            stopped_early=self.__stopped_early,
+            cached=self.__cached,
+            seconds=self.__scan_seconds,
+            metrics=self.__metrics,
+        )
 
     def get_compression_ratio(self):  # dead: disable
         """
@@ -331,30 +1206,54 @@ class DefuseZip:
         max_cpu_time: int = 5,
         max_memory: int = 134217728,
         max_filesize: int = 134217728,
+        workers: int = 1,
+        max_total_size: Optional[int] = None,
     ) -> bool:
         """
         Just in case the scan didn't pick up zip being malicious, this function will be the last line defence.
         If the extraction process goes over the given values, an exception is thrown and the extraction is cancelled.
+        Every member is inflated once, checking its CRC and size on the fly into a temporary file. The files are
+        renamed into place only once all of them succeeded, otherwise the partial extraction is removed.
+        The extraction runs in a pooled worker process and the limits apply to that worker only, so concurrent
+        extractions don't interfere and the calling process is never limited. A zip given as bytes or a file
+        object is copied to a temporary file for the worker.
         :param destination_path:
         :param max_cpu_time: Maximum time for the process to have for the extraction
         :param max_memory:  Maximum memory for the process to have for the extraction
         :param max_filesize: Maximum single file size allowed to be created
+        :param workers: Processes to extract the members with, largest first, each under the limits above
+        :param max_total_size: Maximum bytes written by all the members together, across workers
         :return: boolean stating the success
         """
 
         # try:
         self.raise_for_exception()  # pragma: no cover
 
-        if not self.__zip_file.exists():  # pragma: no cover
+        if (
+            self.__zip_file is not None and not self.__zip_file.exists()
+        ):  # pragma: no cover
             raise FileNotFoundError
-        if psutil.LINUX:  # pragma: no cover
+        if LINUX:  # pragma: no cover
+            from concurrent.futures.process import BrokenProcessPool
+
+            from loguru import logger
 
-            with ZipFile(self.__zip_file, "r") as zip_ref:
-                if zip_ref.testzip():
-                    return False
+            from DefuseZip.utils.extract import extraction_pool
+            from DefuseZip.utils.extract import StagedExtraction
 
-                with set_rlimit(max_cpu_time, max_memory, max_filesize):
-                    zip_ref.extractall(destination_path)
+            staging = StagedExtraction(Path(destination_path), max_total_size)
+            limits = (max_cpu_time, max_memory, max_filesize)
+            try:
+                with self.__as_file() as source, staging:
+                    if workers > 1:
+                        staging.extract_parallel(source, workers, max_filesize, limits)
+                    else:
+                        staging.extract_isolated(
+                            source, extraction_pool(), max_filesize, limits
+                        )
+            except (BadZipFile, SpoolLimitError, MemoryError, BrokenProcessPool) as e:
+                logger.error(f"Extraction failed: {e!r}")
+                return False
         else:
             raise NotImplementedError(
                 "Safe_extract not implemented only for Linux"
@@ -368,7 +1267,17 @@ class DefuseZip:
                 "You have to complete a scan before using other methods"
             )  # pragma: no cover
 
-    def extract_all(self, path: Optional[Path]) -> bool:  # pragma: no cover
+    def extract_all(
+        self, path: Optional[Path], workers: int = 1
+    ) -> bool:  # pragma: no cover
+        """
+        Extracts the zip, scanning it first if it wasn't scanned yet
+        :param path: Directory to extract to
+        :param workers: Processes to extract the members with, largest first. Only used for zips given as a path
+        :return: boolean stating the success
+        """
+        from loguru import logger
+
         if path:
             path = Path(path).resolve()
         logger.info(path)
@@ -376,11 +1285,17 @@ class DefuseZip:
             if self.scan():
                 raise MaliciousFileException("Scan failed")
 
-        with ZipFile(self.__zip_file) as zip_ref:
+        with self.__open() as f, ZipFile(f) as zip_ref:
             if len(zip_ref.filelist) <= 0:
                 return False
             try:
-                zip_ref.extractall(path=path)
+                if workers > 1 and self.__zip_file is not None:
+                    from DefuseZip.utils.extract import StagedExtraction
+
+                    with StagedExtraction(Path(path or Path.cwd())) as staging:
+                        staging.extract_parallel(self.__zip_file, workers, sys.maxsize)
+                else:
+                    zip_ref.extractall(path=path)
 
                 success = path.exists() and len(list(Path(path).iterdir())) > 0
                 if success:
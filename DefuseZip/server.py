@@ -0,0 +1,141 @@
+import json
+import os
+import signal
+import socket
+import socketserver
+import stat
+import threading
+import zipfile
+from argparse import Namespace
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any
+from typing import Dict
+
+from loguru import logger
+
+from DefuseZip.__main__ import scan_file
+
+
+class ScanServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Scans zips for clients connecting to a Unix domain socket, on a pool of warm worker processes
+
+    Each connection sends requests and gets responses as JSON, one object per line, in order. A request is
+    ``{"file": path}``, scanned with the options the server was started with. With ``"destination": path``
+    the zip is also extracted there with safe_extract, unless it is dangerous. The response is the scan's
+    ScanReport, with ``"extracted"`` for extraction requests, or ``{"file": path, "error": message}``.
+    """
+
+    daemon_threads = True  # dead: disable
+
+    def __init__(self, path: str, opts: Namespace):
+        _remove_stale_socket(path)
+        self.opts = opts
+        self.executor = ProcessPoolExecutor(max_workers=max(1, opts.jobs))
+        self.__executor_lock = threading.Lock()
+        super().__init__(path, _RequestHandler)
+        os.chmod(path, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+        try:
+            os.unlink(self.server_address)  # type: ignore
+        except FileNotFoundError:  # pragma: no cover
+            pass
+
+    def process(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Scans, and extracts if asked to, the zip of one request
+
+        Args:
+            request (Dict[str, Any]): "file" and optionally "destination"
+
+        Returns:
+            Dict[str, Any]: the scan's report, or the error
+        """
+        file = Path(request["file"])
+        if not file.is_file():
+            return {"file": str(file), "error": "File not found"}
+        executor = self.executor
+        try:
+            _, target_zip = executor.submit(scan_file, file, self.opts).result()
+        except BrokenProcessPool:
+            # A worker died, e.g. killed by the OOM killer, the next requests get a new pool
+            with self.__executor_lock:
+                if self.executor is executor:
+                    self.executor = ProcessPoolExecutor(
+                        max_workers=max(1, self.opts.jobs)
+                    )
+                    executor.shutdown(wait=False)
+            return {"file": str(file), "error": "Scan worker died"}
+        if target_zip is None:
+            return {"file": str(file), "error": "Not an archive"}
+        response = target_zip.report().as_dict()
+        destination = request.get("destination")
+        if destination:
+            response["extracted"] = (
+                not target_zip.is_dangerous and zipfile.is_zipfile(file)
+            ) and self.__extract(target_zip, Path(destination))
+        return response
+
+    def __extract(self, target_zip, destination: Path) -> bool:
+        if self.opts.safe_extract:
+            return target_zip.safe_extract(
+                destination,
+                self.opts.max_cpu_time,
+                self.opts.max_memory,
+                self.opts.max_filesize,
+            )
+        return target_zip.safe_extract(destination)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    server: ScanServer
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                response = self.server.process(request)
+            except Exception as e:
+                logger.exception(e)
+                response = {"error": repr(e)}
+            self.wfile.write(json.dumps(response, separators=(",", ":")).encode())
+            self.wfile.write(b"\n")
+            self.wfile.flush()
+
+
+def _remove_stale_socket(path: str):
+    """Removes a socket left behind by a server that is gone, refuses to replace a live one or another file"""
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(f"{path} exists and is not a socket")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+            return
+    raise FileExistsError(f"A server is already listening on {path}")
+
+
+def _terminate(signum, frame):
+    raise SystemExit(0)
+
+
+def serve(opts: Namespace) -> int:
+    """Runs the scan server on opts.socket until interrupted or terminated"""
+    signal.signal(signal.SIGTERM, _terminate)
+    with ScanServer(opts.socket, opts) as server:
+        logger.info(f"Listening on {opts.socket}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    return 0
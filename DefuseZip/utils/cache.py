@@ -0,0 +1,148 @@
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Optional
+from typing import Union
+
+from DefuseZip.utils.report import NestedResult
+
+
+class ScanCache:
+    """LRU cache of scan results, keyed by the zip's content digest and the scanner's thresholds.
+
+    Results are kept in memory, up to ``maxsize`` of them. Results of nested zips are kept apart, up to
+    ``nested_maxsize`` of them, so the many nested zips of one scan can't evict whole scan results. Given a
+    ``path``, both are also stored in a SQLite database there, so they survive restarts and can be shared
+    between processes.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        path: Optional[Union[str, Path]] = None,
+        nested_maxsize: Optional[int] = None,
+    ):
+        self.maxsize = maxsize
+        self.nested_maxsize = maxsize if nested_maxsize is None else nested_maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.__nested: "OrderedDict[str, NestedResult]" = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__db: Optional[sqlite3.Connection] = None
+        if path is not None:
+            self.__db = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+            with self.__db:
+                for table in ("results", "nested_results"):
+                    self.__db.execute(
+                        f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+                    )
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Returns the stored result for the key, None if there is none
+
+        Args:
+            key (str): content digest and thresholds of the scan
+
+        Returns:
+            Optional[Dict[str, Any]]: the stored result
+        """
+        return self.__get(self.__entries, self.maxsize, "results", key, json.loads)
+
+    def put(self, key: str, result: Dict[str, Any]):
+        """Stores a result, evicting the least recently used one when the cache is full
+
+        Args:
+            key (str): content digest and thresholds of the scan
+            result (Dict[str, Any]): JSON serializable scan result
+        """
+        self.__put(self.__entries, self.maxsize, "results", key, result)
+
+    def get_nested(self, key: str) -> Optional[NestedResult]:
+        """Returns the stored result of a nested zip, None if there is none
+
+        Args:
+            key (str): identity of the nested zip and thresholds of the scan
+
+        Returns:
+            Optional[NestedResult]: the stored result
+        """
+        return self.__get(
+            self.__nested, self.nested_maxsize, "nested_results", key, _load_nested
+        )
+
+    def put_nested(self, key: str, result: NestedResult):
+        """Stores the result of a nested zip, evicting only results of nested zips when full
+
+        Args:
+            key (str): identity of the nested zip and thresholds of the scan
+            result (NestedResult): what walking the nested zip found
+        """
+        self.__put(self.__nested, self.nested_maxsize, "nested_results", key, result)
+
+    def __get(
+        self,
+        entries: "OrderedDict[str, Any]",
+        maxsize: int,
+        table: str,
+        key: str,
+        load: Callable[[str], Any],
+    ) -> Any:
+        with self.__lock:
+            result = entries.get(key)
+            if result is not None:
+                entries.move_to_end(key)
+            elif self.__db is not None:
+                row = self.__db.execute(
+                    f"SELECT value FROM {table} WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    result = load(row[0])
+                    _remember(entries, maxsize, key, result)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return result
+
+    def __put(
+        self,
+        entries: "OrderedDict[str, Any]",
+        maxsize: int,
+        table: str,
+        key: str,
+        result: Any,
+    ):
+        with self.__lock:
+            _remember(entries, maxsize, key, result)
+            if self.__db is not None:
+                with self.__db:
+                    self.__db.execute(
+                        f"INSERT OR REPLACE INTO {table} (key, value) VALUES (?, ?)",
+                        (key, json.dumps(result)),
+                    )
+
+    def close(self):
+        with self.__lock:
+            if self.__db is not None:
+                self.__db.close()
+                self.__db = None
+
+
+def _remember(entries: "OrderedDict[str, Any]", maxsize: int, key: str, result: Any):
+    entries[key] = result
+    entries.move_to_end(key)
+    while len(entries) > maxsize:
+        entries.popitem(last=False)
+
+
+def _load_nested(value: str) -> NestedResult:
+    return NestedResult(*json.loads(value))
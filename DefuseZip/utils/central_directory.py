@@ -0,0 +1,260 @@
+import stat
+import struct
+from array import array
+from typing import IO
+from typing import Iterable
+from typing import Iterator
+from typing import Tuple
+from zipfile import BadZipFile
+
+from DefuseZip.utils.streams import LOCAL_HEADER
+
+_END_RECORD = struct.Struct("<4s4H2LH")
+_END_RECORD_SIGNATURE = b"PK\005\006"
+_END_RECORD64_LOCATOR = struct.Struct("<4sLQL")
+_END_RECORD64_LOCATOR_SIGNATURE = b"PK\006\007"
+_END_RECORD64 = struct.Struct("<4sQ2H2L4Q")
+_END_RECORD64_SIGNATURE = b"PK\006\006"
+_CENTRAL_DIR = struct.Struct("<4s4B4HL2L5H2L")
+_CENTRAL_DIR_SIGNATURE = b"PK\001\002"
+_EXTRA_HEADER = struct.Struct("<2H")
+_ZIP64_EXTRA_ID = 0x0001
+ZIP64_LIMIT = 0xFFFFFFFF
+_MAX_COMMENT = 0xFFFF
+_NAME_SEPARATOR = b"\0"
+
+
+class CentralDirectory:
+    """Compact, array-backed table of the central directory records of a zip.
+
+    File names are kept raw in a single ``\\0`` separated blob, ``name_offsets`` points at the start of
+    each name in it. The other columns are one typed array each, indexed by entry.
+    """
+
+    __slots__ = (
+        "names_blob",
+        "name_offsets",
+        "compress_size",
+        "file_size",
+        "flags",
+        "compress_type",
+        "external_attr",
+        "header_offset",
+    )
+
+    def __init__(self):
+        self.names_blob = b""
+        self.name_offsets = array("Q")
+        self.compress_size = array("Q")
+        self.file_size = array("Q")
+        self.flags = array("H")
+        self.compress_type = array("H")
+        self.external_attr = array("L")
+        self.header_offset = array("q")
+
+    def __len__(self) -> int:
+        return len(self.file_size)
+
+    @property
+    def total_uncompressed(self) -> int:
+        return sum(self.file_size)
+
+    def names(self) -> Iterator[str]:  # dead: disable
+        """Decodes the names the same way zipfile does, utf-8 if flagged, cp437 otherwise"""
+        blob = self.names_blob
+        for start, flags in zip(self.name_offsets, self.flags):
+            end = blob.index(_NAME_SEPARATOR, start)
+            yield blob[start:end].decode("utf-8" if flags & 0x800 else "cp437")
+
+    def name(self, index: int) -> str:
+        """Decodes the name of one entry, like names"""
+        start = self.name_offsets[index]
+        end = self.names_blob.index(_NAME_SEPARATOR, start)
+        encoding = "utf-8" if self.flags[index] & 0x800 else "cp437"
+        return self.names_blob[start:end].decode(encoding)
+
+    def overlapping_entries(self) -> int:
+        return count_overlaps(self.header_offset, self.compress_size)
+
+    def has_name_ending(self, *suffixes: bytes, ignore_case: bool = False) -> bool:
+        blob = self.names_blob.lower() if ignore_case else self.names_blob
+        return any(suffix + _NAME_SEPARATOR in blob for suffix in suffixes)
+
+    def has_symlinks(self) -> bool:
+        """True if an entry's Unix mode, in the high bytes of its external attributes, is a symlink"""
+        return any(stat.S_ISLNK(attr >> 16) for attr in self.external_attr)
+
+
+def count_overlaps(header_offsets: Iterable[int], compress_sizes: Iterable[int]) -> int:
+    """Counts the entries whose local header starts inside the data of another entry
+
+    Each entry is taken to span at least its fixed size local header and compressed data, names and
+    extra fields are left out, so a well-formed zip never overlaps. Overlapping or shared ranges are how
+    non-recursive zip bombs reuse one compressed kernel for many entries.
+
+    Args:
+        header_offsets (Iterable[int]): local header offset of each entry
+        compress_sizes (Iterable[int]): compressed size of each entry
+
+    Returns:
+        int: count of overlapping entries
+    """
+    overlaps = 0
+    end = -1
+    for start, compress_size in sorted(zip(header_offsets, compress_sizes)):
+        if start < end:
+            overlaps += 1
+        end = max(end, start + LOCAL_HEADER.size + compress_size)
+    return overlaps
+
+
+def _find_end_record(fileobj: IO[bytes]) -> Tuple[int, Tuple]:
+    """Locates the End-of-Central-Directory record, allowing for an archive comment after it"""
+    fileobj.seek(0, 2)
+    filesize = fileobj.tell()
+    if filesize < _END_RECORD.size:
+        raise BadZipFile("File is not a zip file")
+
+    fileobj.seek(filesize - _END_RECORD.size)
+    data = fileobj.read(_END_RECORD.size)
+    if data[:4] == _END_RECORD_SIGNATURE and data[-2:] == b"\000\000":
+        return filesize - _END_RECORD.size, _END_RECORD.unpack(data)
+
+    search_start = max(filesize - _MAX_COMMENT - _END_RECORD.size, 0)
+    fileobj.seek(search_start)
+    data = fileobj.read()
+    start = data.rfind(_END_RECORD_SIGNATURE)
+    if start < 0 or len(data) - start < _END_RECORD.size:
+        raise BadZipFile("File is not a zip file")
+    return search_start + start, _END_RECORD.unpack_from(data, start)
+
+
+def _find_directory(fileobj: IO[bytes]) -> Tuple[int, int, int]:
+    """Returns the central directory's start and size and the size of data prepended to the zip"""
+    location, endrec = _find_end_record(fileobj)
+    size_cd, offset_cd = endrec[5], endrec[6]
+    record_start = location
+
+    locator_at = location - _END_RECORD64_LOCATOR.size
+    if locator_at >= 0:
+        fileobj.seek(locator_at)
+        locator = fileobj.read(_END_RECORD64_LOCATOR.size)
+        if (
+            len(locator) == _END_RECORD64_LOCATOR.size
+            and locator[:4] == _END_RECORD64_LOCATOR_SIGNATURE
+        ):
+            if _END_RECORD64_LOCATOR.unpack(locator)[3] > 1:
+                raise BadZipFile("zipfiles that span multiple disks are not supported")
+            record64_at = locator_at - _END_RECORD64.size
+            fileobj.seek(max(record64_at, 0))
+            record64 = fileobj.read(_END_RECORD64.size)
+            if (
+                record64_at < 0
+                or len(record64) != _END_RECORD64.size
+                or record64[:4] != _END_RECORD64_SIGNATURE
+            ):
+                raise BadZipFile("Corrupt ZIP64 end of central directory record")
+            fields = _END_RECORD64.unpack(record64)
+            size_cd, offset_cd = fields[8], fields[9]
+            record_start = record64_at
+
+    concat = record_start - size_cd - offset_cd
+    if offset_cd + concat < 0:
+        raise BadZipFile("Bad offset for central directory")
+    return offset_cd + concat, size_cd, concat
+
+
+def has_zip64_extra(extra: bytes) -> bool:
+    """True if the extra fields hold a ZIP64 one, which makes a data descriptor's sizes 8 bytes each"""
+    pos = 0
+    while pos + _EXTRA_HEADER.size <= len(extra):
+        tag, length = _EXTRA_HEADER.unpack_from(extra, pos)
+        if tag == _ZIP64_EXTRA_ID:
+            return True
+        pos += _EXTRA_HEADER.size + length
+    return False
+
+
+def zip64_fields(
+    extra: bytes, file_size: int, compress_size: int, header_offset: int
+) -> Tuple[int, int, int]:
+    """Replaces the 0xFFFFFFFF placeholders with the values from the ZIP64 extra field"""
+    pos = 0
+    while pos + _EXTRA_HEADER.size <= len(extra):
+        tag, length = _EXTRA_HEADER.unpack_from(extra, pos)
+        pos += _EXTRA_HEADER.size
+        if tag == _ZIP64_EXTRA_ID:
+            end = pos + length
+            values = extra[pos:end]
+            index = 0
+            if file_size == ZIP64_LIMIT:
+                if len(values) < index + 8:
+                    raise BadZipFile("Corrupt extra field 0001 (file size)")
+                file_size = struct.unpack_from("<Q", values, index)[0]
+                index += 8
+            if compress_size == ZIP64_LIMIT:
+                if len(values) < index + 8:
+                    raise BadZipFile("Corrupt extra field 0001 (compress size)")
+                compress_size = struct.unpack_from("<Q", values, index)[0]
+                index += 8
+            if header_offset == ZIP64_LIMIT:
+                if len(values) < index + 8:
+                    raise BadZipFile("Corrupt extra field 0001 (header offset)")
+                header_offset = struct.unpack_from("<Q", values, index)[0]
+            break
+        pos += length
+    return file_size, compress_size, header_offset
+
+
+def read_central_directory(fileobj: IO[bytes]) -> CentralDirectory:
+    """Reads only the End-of-Central-Directory and central directory records of a zip, ZIP64 included
+
+    Args:
+        fileobj (IO[bytes]): seekable binary file object of the zip
+
+    Raises:
+        BadZipFile: not a zip or the central directory is damaged
+
+    Returns:
+        CentralDirectory: table of the central directory entries
+    """
+    start_dir, size_cd, concat = _find_directory(fileobj)
+    fileobj.seek(start_dir)
+    data = fileobj.read(size_cd)
+    if len(data) != size_cd:
+        raise BadZipFile("Truncated central directory")
+
+    table = CentralDirectory()
+    names_blob = bytearray()
+    pos = 0
+    record_size = _CENTRAL_DIR.size
+    unpack_from = _CENTRAL_DIR.unpack_from
+    while pos < size_cd:
+        if size_cd - pos < record_size:
+            raise BadZipFile("Truncated central directory")
+        record = unpack_from(data, pos)
+        if record[0] != _CENTRAL_DIR_SIGNATURE:
+            raise BadZipFile("Bad magic number for central directory")
+        compress_size, file_size, header_offset = record[10], record[11], record[18]
+        name_length, extra_length, comment_length = record[12], record[13], record[14]
+
+        pos += record_size
+        end = pos + name_length
+        table.name_offsets.append(len(names_blob))
+        names_blob += data[pos:end]
+        names_blob += _NAME_SEPARATOR
+        pos, end = end, end + extra_length
+        if ZIP64_LIMIT in (compress_size, file_size, header_offset):
+            file_size, compress_size, header_offset = zip64_fields(
+                data[pos:end], file_size, compress_size, header_offset
+            )
+        pos = end + comment_length
+        table.flags.append(record[5])
+        table.compress_type.append(record[6])
+        table.external_attr.append(record[17])
+        table.compress_size.append(compress_size)
+        table.file_size.append(file_size)
+        table.header_offset.append(header_offset + concat)
+
+    table.names_blob = bytes(names_blob)
+    return table
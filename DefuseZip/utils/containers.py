@@ -0,0 +1,154 @@
+import zlib
+from typing import Callable
+from typing import IO
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+from typing import Type
+
+# Bytes of a member's data read to tell its format, enough for the tar magic at offset 257
+SNIFF_SIZE = 512
+
+# Nothing shorter holds an archive worth looking into, e.g. an empty bzip2 stream is 14 bytes
+MIN_CONTAINER_SIZE = 14
+
+
+class Entry(NamedTuple):
+    """Member of a streamed container, it has to be read before the next one is asked for"""
+
+    name: str
+    # None when only reading the data tells the size, e.g. the content of a gzip stream
+    size: Optional[int]
+    link: bool
+    open: Callable[[], IO[bytes]]
+
+
+class Container(NamedTuple):
+    """Archive or compression format, recognised by the first SNIFF_SIZE bytes of its data
+
+    Members are only sniffed when their name ends with one of ``suffixes``, unless DefuseZip is asked to
+    sniff the contents of all of them.
+
+    ``members`` reads the container front to back, yielding its entries as it goes, so nested containers
+    are walked without seeking or holding them in memory. It is None for zip, which needs a seekable file
+    for its central directory and is walked by DefuseZip itself. ``decompresses`` tells whether reading the
+    entries inflates data, so their bytes count against the ratio threshold.
+    """
+
+    name: str
+    sniff: Callable[[bytes], bool]
+    members: Optional[Callable[[IO[bytes]], Iterator[Entry]]]
+    decompresses: bool
+    suffixes: Tuple[str, ...] = ()
+
+
+def _tar_members(fileobj: IO[bytes]) -> Iterator[Entry]:
+    import tarfile
+
+    with tarfile.open(fileobj=fileobj, mode="r|") as tf:
+        for member in tf:
+            if member.issym() or member.islnk():
+                yield Entry(member.name, 0, True, _not_readable)
+            elif member.isfile():
+                yield Entry(
+                    member.name,
+                    member.size,
+                    False,
+                    lambda member=member: tf.extractfile(member),  # type: ignore
+                )
+
+
+def _stream(name: str, opener: Callable[[IO[bytes]], IO[bytes]]):
+    def members(fileobj: IO[bytes]) -> Iterator[Entry]:
+        yield Entry(name, None, False, lambda: opener(fileobj))
+
+    return members
+
+
+def _gzip_open(fileobj: IO[bytes]) -> IO[bytes]:
+    import gzip
+
+    return gzip.GzipFile(fileobj=fileobj, mode="rb")  # type: ignore
+
+
+def _bz2_open(fileobj: IO[bytes]) -> IO[bytes]:
+    import bz2
+
+    return bz2.BZ2File(fileobj)  # type: ignore
+
+
+def _lzma_open(fileobj: IO[bytes]) -> IO[bytes]:
+    import lzma
+
+    return lzma.LZMAFile(fileobj)  # type: ignore
+
+
+def _not_readable() -> IO[bytes]:  # pragma: no cover
+    raise ValueError("Links have no data to read")
+
+
+ZIP = Container(
+    "zip",
+    lambda head: head[:4] in (b"PK\003\004", b"PK\005\006"),
+    None,
+    False,
+    (".zip", ".jar", ".war", ".ear", ".apk"),
+)
+
+CONTAINERS: List[Container] = [
+    ZIP,
+    Container(
+        "tar", lambda head: head[257:262] == b"ustar", _tar_members, False, (".tar",)
+    ),
+    Container(
+        "gzip",
+        lambda head: head[:2] == b"\037\213",
+        _stream("<gzip>", _gzip_open),
+        True,
+        (".gz", ".tgz"),
+    ),
+    Container(
+        "bz2",
+        lambda head: head[:3] == b"BZh",
+        _stream("<bz2>", _bz2_open),
+        True,
+        (".bz2", ".tbz", ".tbz2"),
+    ),
+    Container(
+        "lzma",
+        lambda head: head[:6] == b"\3757zXZ\0",
+        _stream("<lzma>", _lzma_open),
+        True,
+        (".xz", ".txz", ".lzma"),
+    ),
+]
+
+
+def container_errors() -> Tuple[Type[Exception], ...]:
+    """Raised by the containers on damaged data, the walk treats them as the end of the container
+
+    Only looked up once a container raises, so the formats' modules are imported when a member is walked.
+    """
+    import lzma
+    import tarfile
+
+    return tarfile.TarError, OSError, EOFError, lzma.LZMAError, zlib.error
+
+
+def register(container: Container):  # dead: disable
+    """Adds a format to sniff members for, checked before the built-in ones"""
+    CONTAINERS.insert(0, container)
+
+
+def sniff(head: bytes) -> Optional[Container]:
+    """The container the data starting with ``head`` is in, None if it isn't one"""
+    if len(head) < MIN_CONTAINER_SIZE:
+        return None
+    return next((container for container in CONTAINERS if container.sniff(head)), None)
+
+
+def container_suffixes() -> Tuple[str, ...]:
+    """Lower case name endings of the known containers, registered ones included"""
+    return tuple(suffix for container in CONTAINERS for suffix in container.suffixes)
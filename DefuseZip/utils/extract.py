@@ -0,0 +1,407 @@
+import multiprocessing
+import os
+import queue
+import secrets
+import threading
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from zipfile import ZipFile
+from zipfile import ZipInfo
+
+from DefuseZip.utils.streams import inflate
+from DefuseZip.utils.streams import SpoolLimitError
+
+_INVALID_PARTS = ("", os.path.curdir, os.path.pardir)
+
+# State of an extraction worker process, set up once by _init_worker
+_worker: Dict[str, Any] = {}
+
+_pool: Optional["ExtractionPool"] = None
+_pool_lock = threading.Lock()
+
+
+class StagedExtraction:
+    """Extracts members next to their destination under temporary names, publishing them all at once.
+
+    Every member is inflated once, zipfile checks its CRC as the last chunk is read, and it is renamed into
+    place only when the whole archive has been extracted. Leaving the context with an exception removes the
+    temporary files and the directories created for them instead, files already in ``destination`` are
+    never touched.
+
+    ``max_total`` caps the bytes written by all members together, in every worker process.
+    """
+
+    def __init__(self, destination: Path, max_total: Optional[int] = None):
+        self.destination = Path(destination)
+        self.max_total = max_total
+        self.written = 0
+        self.__token = secrets.token_hex(4)
+        self.__staged: List[Tuple[Path, Path]] = []
+        self.__created_dirs: List[Path] = []
+
+    def __enter__(self) -> "StagedExtraction":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):  # dead: disable
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+    def target(self, info: ZipInfo) -> Path:
+        """Path the member is extracted to, sanitised the same way ZipFile.extract does it"""
+        arcname = info.filename.replace("/", os.path.sep)
+        if os.path.altsep:
+            arcname = arcname.replace(os.path.altsep, os.path.sep)
+        arcname = os.path.splitdrive(arcname)[1]
+        parts = [
+            part for part in arcname.split(os.path.sep) if part not in _INVALID_PARTS
+        ]
+        if os.path.sep == "\\":  # pragma: no cover
+            parts = [
+                ZipFile._sanitize_windows_name(part, os.path.sep)  # type: ignore
+                for part in parts
+            ]
+        return self.destination.joinpath(*parts)
+
+    def extract_parallel(
+        self,
+        source: Path,
+        workers: int,
+        max_bytes: int,
+        limits: Optional[Tuple[int, int, int]] = None,
+    ) -> int:
+        """Extracts every member of the zip at ``source`` in a pool of worker processes
+
+        Members are handed out largest compressed size first, so the longest ones don't end up last on a
+        single worker. Each worker opens its own handle to the zip and, given ``limits``, runs under its own
+        set_rlimit. The first failure stops the other workers between chunks.
+
+        Args:
+            source (Path): the zip
+            workers (int): number of worker processes
+            max_bytes (int): most bytes any one member is allowed to inflate to
+            limits (Optional[Tuple[int, int, int]]): max_cpu_time, max_memory and max_filesize of each worker.
+            Defaults to None.
+
+        Raises:
+            SpoolLimitError: a member inflated past ``max_bytes`` or all members past ``max_total``
+            BadZipFile: a member's CRC doesn't match
+            BrokenProcessPool: a worker was killed, e.g. for going over its limits
+
+        Returns:
+            int: count of bytes written
+        """
+        with ZipFile(source) as zf:
+            infolist = zf.infolist()
+        jobs = []
+        for index, info in enumerate(infolist):
+            temporary = self.__stage(info)
+            if temporary is not None:
+                jobs.append((info.compress_size, index, temporary))
+        jobs.sort(key=lambda job: job[0], reverse=True)
+
+        context = multiprocessing.get_context()
+        written = context.Value("q", self.written)
+        failed = context.Value("b", 0, lock=False)
+        error: Optional[BaseException] = None
+        max_pending = workers * 4
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(str(source), written, failed, self.max_total, limits),
+        ) as executor:
+            pending: Set = set()
+            for _, index, temporary in jobs:
+                if error is not None:
+                    break
+                pending.add(
+                    executor.submit(
+                        _extract_in_worker, index, str(temporary), max_bytes
+                    )
+                )
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    error = error or _first_error(done)
+            if error is not None:
+                failed.value = 1
+            error = error or _first_error(wait(pending).done)
+        self.written = written.value
+        if error is not None:
+            raise error
+        return self.written
+
+    def extract_isolated(
+        self,
+        source: Path,
+        pool: "ExtractionPool",
+        max_bytes: int,
+        limits: Tuple[int, int, int],
+    ) -> int:
+        """Extracts every member of the zip at ``source`` in a worker of ``pool``, under ``limits``
+
+        The directories and temporary names are set up here, the worker only inflates into the temporary
+        files, so a worker killed for going over its limits is rolled back like any other failure.
+
+        Args:
+            source (Path): the zip
+            pool (ExtractionPool): pool to take the worker from
+            max_bytes (int): most bytes any one member is allowed to inflate to
+            limits (Tuple[int, int, int]): max_cpu_time, max_memory and max_filesize of the worker
+
+        Raises:
+            SpoolLimitError: a member inflated past ``max_bytes`` or all members past ``max_total``
+            BadZipFile: a member's CRC doesn't match
+            MemoryError: the worker went over max_memory
+            BrokenProcessPool: the worker was killed, e.g. for going over max_cpu_time
+
+        Returns:
+            int: count of bytes written
+        """
+        with ZipFile(source) as zf:
+            infolist = zf.infolist()
+        jobs = []
+        for index, info in enumerate(infolist):
+            temporary = self.__stage(info)
+            if temporary is not None:
+                jobs.append((index, str(temporary)))
+        task = (str(source), jobs, max_bytes, self.max_total, self.written, limits)
+        self.written = pool.run(task)
+        return self.written
+
+    def commit(self):
+        """Renames every extracted member into place"""
+        for temporary, target in self.__staged:
+            os.replace(temporary, target)
+        self.__staged.clear()
+        self.__created_dirs.clear()
+
+    def rollback(self):
+        """Removes the temporary files and the directories created for them"""
+        for temporary, _ in self.__staged:
+            try:
+                temporary.unlink()
+            except FileNotFoundError:
+                pass
+        for directory in reversed(self.__created_dirs):
+            try:
+                directory.rmdir()
+            except OSError:  # pragma: no cover
+                pass
+        self.__staged.clear()
+        self.__created_dirs.clear()
+
+    def __stage(self, info: ZipInfo) -> Optional[Path]:
+        """Creates the member's directories and registers its temporary file, None for directories"""
+        target = self.target(info)
+        if info.is_dir() or target == self.destination:
+            self.__make_dirs(target)
+            return None
+        self.__make_dirs(target.parent)
+        temporary = target.parent / f".{self.__token}-{len(self.__staged)}.defusezip"
+        self.__staged.append((temporary, target))
+        return temporary
+
+    def __make_dirs(self, directory: Path):
+        missing = []
+        while not directory.exists():
+            missing.append(directory)
+            directory = directory.parent
+        for directory in reversed(missing):
+            directory.mkdir()
+            self.__created_dirs.append(directory)
+
+
+def _never() -> bool:
+    return False
+
+
+def _write_temporary(
+    zf: ZipFile,
+    info: ZipInfo,
+    temporary: Path,
+    max_bytes: int,
+    should_stop: Callable[[], bool],
+    account: Callable[[int], None],
+) -> int:
+    written = 0
+    try:
+        with open(temporary, "xb") as f:
+            for chunk in inflate(zf, info, max_bytes, should_stop):
+                account(len(chunk))
+                f.write(chunk)
+                written += len(chunk)
+    except BaseException:
+        try:
+            temporary.unlink()
+        except FileNotFoundError:
+            pass
+        raise
+    return written
+
+
+def _first_error(done: Set) -> Optional[BaseException]:
+    errors = [future.exception() for future in done]
+    return next((error for error in errors if error is not None), None)
+
+
+def _init_worker(
+    source: str,
+    written,
+    failed,
+    max_total: Optional[int],
+    limits: Optional[Tuple[int, int, int]],
+):
+    if limits is not None:
+        from DefuseZip.utils.managers import set_rlimit
+
+        # Held for the worker's lifetime, it exits with the pool
+        set_rlimit(*limits).__enter__()
+    _worker.update(
+        zf=ZipFile(source), written=written, failed=failed, max_total=max_total
+    )
+
+
+def _extract_in_worker(index: int, temporary: str, max_bytes: int) -> int:
+    zf: ZipFile = _worker["zf"]
+    written = _worker["written"]
+    failed = _worker["failed"]
+    max_total: Optional[int] = _worker["max_total"]
+
+    def account(size: int):
+        with written.get_lock():
+            written.value += size
+            total = written.value
+        if max_total is not None and total > max_total:
+            failed.value = 1
+            raise SpoolLimitError(f"Extraction writes past {max_total} bytes")
+
+    try:
+        return _write_temporary(
+            zf,
+            zf.infolist()[index],
+            Path(temporary),
+            max_bytes,
+            lambda: bool(failed.value),
+            account,
+        )
+    except BaseException:
+        failed.value = 1
+        raise
+
+
+class ExtractionPool:
+    """Long-lived worker processes for extracting zips under resource limits.
+
+    set_rlimit is applied inside a worker for one extraction and lifted afterwards, so the limits never
+    touch the calling process and concurrent extractions each get their own worker. The workers are started
+    up front and reused. One that is killed, e.g. by SIGXCPU, is replaced by a new one.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.__context = multiprocessing.get_context()
+        self.__idle: "queue.Queue[Tuple[Any, Connection]]" = queue.Queue()
+        for _ in range(size):
+            self.__idle.put(self.__start())
+
+    def __start(self) -> Tuple[Any, Connection]:
+        connection, child = self.__context.Pipe()
+        worker = self.__context.Process(target=_serve, args=(child,), daemon=True)
+        worker.start()
+        child.close()
+        return worker, connection
+
+    def run(self, task: Tuple) -> int:
+        """Runs an extraction task on the next idle worker, waiting for one if all are busy
+
+        Raises:
+            BrokenProcessPool: the worker died during the task
+
+        Returns:
+            int: bytes written by the extraction
+        """
+        worker, connection = self.__idle.get()
+        try:
+            connection.send(task)
+            completed, result = connection.recv()
+        except (EOFError, OSError):
+            connection.close()
+            worker.join()
+            self.__idle.put(self.__start())
+            raise BrokenProcessPool(
+                f"Extraction worker exited with code {worker.exitcode}"
+            ) from None
+        self.__idle.put((worker, connection))
+        if not completed:
+            raise result
+        return result
+
+    def close(self):
+        """Stops the workers, the pool can't be used afterwards"""
+        for _ in range(self.size):
+            worker, connection = self.__idle.get()
+            connection.send(None)
+            connection.close()
+            worker.join()
+
+
+def extraction_pool() -> ExtractionPool:
+    """The process wide ExtractionPool, started on first use with a worker per CPU"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ExtractionPool(os.cpu_count() or 1)
+        return _pool
+
+
+def _serve(connection: Connection):
+    """Extraction worker loop, runs tasks until it gets None"""
+    while True:
+        task = connection.recv()
+        if task is None:
+            break
+        try:
+            result: Any = _run_task(*task)
+        except Exception as e:
+            connection.send((False, e))
+        else:
+            connection.send((True, result))
+    connection.close()
+
+
+def _run_task(
+    source: str,
+    jobs: List[Tuple[int, str]],
+    max_bytes: int,
+    max_total: Optional[int],
+    written: int,
+    limits: Tuple[int, int, int],
+) -> int:
+    def account(size: int):
+        nonlocal written
+        written += size
+        if max_total is not None and written > max_total:
+            raise SpoolLimitError(f"Extraction writes past {max_total} bytes")
+
+    from DefuseZip.utils.managers import set_rlimit
+
+    with set_rlimit(*limits), ZipFile(source) as zf:
+        infolist = zf.infolist()
+        for index, temporary in jobs:
+            _write_temporary(
+                zf, infolist[index], Path(temporary), max_bytes, _never, account
+            )
+    return written
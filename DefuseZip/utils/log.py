@@ -0,0 +1,49 @@
+import sys
+import threading
+
+from loguru import logger
+
+_configured = False
+_lock = threading.Lock()
+
+
+def configure_logging():
+    """Sets up the stderr sinks and the malicious and safe levels of DefuseZip.output, once per process
+
+    Nothing is configured by importing DefuseZip, only output() and the command line call this. Loguru's
+    default handler is replaced, handlers added by the application are left alone.
+    """
+    global _configured
+    with _lock:
+        if _configured:
+            return
+        _configured = True
+        try:
+            logger.remove(0)
+        except ValueError:
+            pass
+        logger.level("malicious", no=50, icon="❌", color="<red>")
+        logger.level("safe", no=50, icon="✔️", color="<green>")
+        logger.add(
+            sys.stderr,
+            colorize=True,
+            filter=lambda record: all(
+                level not in record["level"].name for level in ["malicious", "safe"]
+            ),
+        )
+        logger.add(
+            sys.stderr,
+            colorize=True,
+            filter=lambda record: "file" in record["extra"]
+            and "malicious" in record["level"].name,
+            format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> <white>|</white> <red>{level: <9} </red><white>|</white> <red>{extra[file]: <20}</red> <white>|</white> {level.icon: <3} {message}",
+            level="malicious",
+        )
+        logger.add(
+            sys.stderr,
+            colorize=True,
+            filter=lambda record: "file" in record["extra"]
+            and "safe" in record["level"].name,
+            format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> <white>|</white> <white>{level: <9} </white><white>|</white> <white>{extra[file]: <20}</white> <white>|</white> {level.icon: <3} {message}",
+            level="malicious",
+        )
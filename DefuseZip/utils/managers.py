@@ -3,6 +3,12 @@ from loguru import logger
 
 
 class set_rlimit:  # pragma: no cover
+    """Lowers the soft CPU time, address space and file size limits of the current process
+
+    Only soft limits are changed, so they can be restored without privileges. The CPU time limit counts
+    from the CPU time already used, so a long-lived process can apply it again and again.
+    """
+
     def __init__(self, max_cpu_time: int, max_memory: int, max_filesize: int):
         self.process = psutil.Process()
         self.default_cpu = self.process.rlimit(psutil.RLIMIT_CPU)
@@ -13,9 +19,11 @@ class set_rlimit:  # pragma: no cover
         self.max_filesize = max_filesize
 
     def __enter__(self):
-        self.process.rlimit(psutil.RLIMIT_CPU, (self.max_cpu_time, self.max_cpu_time))
-        self.process.rlimit(psutil.RLIMIT_AS, (self.max_memory, self.max_memory))
-        self.process.rlimit(psutil.RLIMIT_FSIZE, (self.max_filesize, self.max_filesize))
+        cpu_times = self.process.cpu_times()
+        used = int(cpu_times.user + cpu_times.system) + 1
+        self.__lower(psutil.RLIMIT_CPU, self.default_cpu, used + self.max_cpu_time)
+        self.__lower(psutil.RLIMIT_AS, self.default_memory, self.max_memory)
+        self.__lower(psutil.RLIMIT_FSIZE, self.default_filesize, self.max_filesize)
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):  # dead: disable
@@ -25,3 +33,9 @@ class set_rlimit:  # pragma: no cover
             self.process.rlimit(psutil.RLIMIT_FSIZE, self.default_filesize)
         except Exception as e:
             logger.exception(e)
+
+    def __lower(self, resource: int, default, limit: int):
+        _, hard = default
+        if hard != psutil.RLIM_INFINITY:
+            limit = min(limit, hard)
+        self.process.rlimit(resource, (limit, hard))
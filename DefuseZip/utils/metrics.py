@@ -0,0 +1,93 @@
+import time
+from contextlib import contextmanager
+from typing import Any
+from typing import Dict
+from typing import IO
+from typing import Iterator
+
+
+class ScanMetrics:
+    """Timings and counters of one scan
+
+    ``phases`` holds the seconds spent in each phase of the scan. They can nest, the time of inflating
+    and verifying nested members is part of walking the zip too:
+
+    * cache: digesting the zip and looking it up in the cache
+    * central_directory: reading the central directory and summing it up without walking the zip
+    * walk: walking the zip and its nested zips entry by entry
+    * inflate: opening nested zips, inflating them to memory or spooling them to disk
+    * verify: inflating members to check their declared sizes
+    * subprocess: running the scan in the hard_killswitch subprocess, start up and transfer included
+    """
+
+    __slots__ = (
+        "phases",
+        "bytes_read",
+        "entries",
+        "nested_opened",
+        "nested_reused",
+        "peak_buffered_bytes",
+        "peak_spooled_bytes",
+    )
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.bytes_read = 0
+        self.entries = 0
+        self.nested_opened = 0
+        self.nested_reused = 0
+        self.peak_buffered_bytes = 0
+        self.peak_spooled_bytes = 0
+
+    def add(self, phase: str, seconds: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def timed(self, phase: str) -> Iterator[None]:
+        """Adds the time spent inside the block to ``phase``"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - started)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "phases": dict(self.phases),
+            "bytes_read": self.bytes_read,
+            "entries": self.entries,
+            "nested_opened": self.nested_opened,
+            "nested_reused": self.nested_reused,
+            "peak_buffered_bytes": self.peak_buffered_bytes,
+            "peak_spooled_bytes": self.peak_spooled_bytes,
+        }
+
+
+class CountingReader:
+    """Passes reads through to ``fileobj``, adding the bytes read to ``metrics``"""
+
+    def __init__(self, fileobj: IO[bytes], metrics: ScanMetrics):
+        self._fileobj = fileobj
+        self._metrics = metrics
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._fileobj, name)
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._fileobj.read(size)
+        self._metrics.bytes_read += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        size = self._fileobj.readinto(buffer)  # type: ignore
+        self._metrics.bytes_read += size or 0
+        return size
+
+    def seek(self, pos: int, whence: int = 0) -> int:
+        return self._fileobj.seek(pos, whence)
+
+    def tell(self) -> int:
+        return self._fileobj.tell()
+
+    def seekable(self) -> bool:  # dead: disable
+        return True
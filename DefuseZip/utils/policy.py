@@ -0,0 +1,219 @@
+import json
+import re
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+from typing import Pattern
+from typing import Tuple
+from typing import Union
+
+from DefuseZip.utils.central_directory import CentralDirectory
+from DefuseZip.utils.ratios import member_ratios
+
+# Findings that are always reported, DefuseZip's symlinks_allowed and directory_travelsal_allowed decide
+# whether they make the zip dangerous
+TRAVELSAL = "travelsal"
+SYMLINK = "symlink"
+
+_SETTINGS = (
+    "max_entries",
+    "max_total_size",
+    "max_member_size",
+    "max_level_ratio",
+    "max_member_ratio",
+    "deny",
+    "absolute_paths_allowed",
+    "encrypted_allowed",
+)
+_NAME_START = rb"(?<![^\0])"
+_NAME_END = rb"(?=\0)"
+
+
+class Policy:
+    """Rules the entries of every zip in a scan must follow, compiled once to serve any number of scans
+
+    ``evaluate`` checks them against a central directory in one pass over its columns. Each name rule, deny
+    patterns, absolute paths and travelsal, is compiled into a regular expression of its own that runs over
+    all the names at once, so a name breaking several rules is reported for every one of them. The defaults
+    add no rules, so a default Policy only reports travelsal names and symlinks, from the Unix mode in the
+    entries' external attributes.
+
+    ``deny`` holds glob patterns matched against whole names, ``*`` and ``?`` match ``/`` too, e.g.
+    ``"*.exe"`` or ``"__MACOSX/*"``.
+    """
+
+    __slots__ = _SETTINGS + ("_names", "_key")
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        max_total_size: Optional[int] = None,
+        max_member_size: Optional[int] = None,
+        max_level_ratio: Optional[float] = None,
+        max_member_ratio: Optional[float] = None,
+        deny: Iterable[str] = (),
+        absolute_paths_allowed: bool = True,
+        encrypted_allowed: bool = True,
+    ):
+        """
+        Policy initializer, a limit of None is no limit
+        :param max_entries: Entries allowed in each zip
+        :param max_total_size: Bytes allowed to be declared by all the entries of the scan, nested zips included
+        :param max_member_size: Bytes allowed to be declared by one entry
+        :param max_level_ratio: Compression ratio allowed for each zip on its own, the total size its entries
+        declare over its compressed size
+        :param max_member_ratio: Compression ratio allowed for each entry, the size it declares over its compressed
+        size
+        :param deny: Glob patterns of names not allowed
+        :param absolute_paths_allowed: Boolean. Names starting with / or \\ or a drive letter. Default = True
+        :param encrypted_allowed: Boolean. Default = True
+        """
+        self.max_entries = max_entries
+        self.max_total_size = max_total_size
+        self.max_member_size = max_member_size
+        self.max_level_ratio = max_level_ratio
+        self.max_member_ratio = max_member_ratio
+        self.deny = tuple(deny)
+        self.absolute_paths_allowed = absolute_paths_allowed
+        self.encrypted_allowed = encrypted_allowed
+
+        rules = [(TRAVELSAL, rb"\.\.[/\\]")]
+        if not absolute_paths_allowed:
+            rules.append(("absolute_path", _NAME_START + rb"(?:[/\\]|[A-Za-z]:)"))
+        if self.deny:
+            rules.append(
+                ("denied_name", b"|".join(_glob(pattern) for pattern in self.deny))
+            )
+        self._names: Tuple[Tuple[str, Pattern[bytes]], ...] = tuple(
+            (rule, re.compile(pattern)) for rule, pattern in rules
+        )
+
+        defaults = Policy.__init__.__defaults__ or ()
+        settings = {
+            name: list(value) if isinstance(value, tuple) else value
+            for name, value, default in zip(
+                _SETTINGS, (getattr(self, name) for name in _SETTINGS), defaults
+            )
+            if value != default
+        }
+        self._key = json.dumps(settings, sort_keys=True) if settings else ""
+
+    @classmethod
+    def from_dict(cls, settings: Dict[str, Any]) -> "Policy":
+        unknown = set(settings) - set(_SETTINGS)
+        if unknown:
+            raise ValueError(f"Unknown policy settings: {', '.join(sorted(unknown))}")
+        return cls(**settings)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "Policy":
+        """Reads the settings from a .toml file, or a JSON file otherwise
+
+        TOML needs Python 3.11, or the tomli package before it.
+        """
+        path = Path(path)
+        if path.suffix == ".toml":
+            try:
+                import tomllib
+            except ImportError:  # pragma: no cover
+                import tomli as tomllib  # type: ignore
+
+            with open(path, "rb") as f:
+                return cls.from_dict(tomllib.load(f))
+        return cls.from_dict(json.loads(path.read_text()))
+
+    @property
+    def has_rules(self) -> bool:
+        return bool(self._key)
+
+    @property
+    def key(self) -> str:
+        """The settings differing from the defaults, to tell apart results reached under other policies"""
+        return self._key
+
+    def match_name(self, name: str) -> Tuple[str, ...]:
+        """The name rules a single name breaks, e.g. of a tar member, empty if it breaks none"""
+        raw = name.encode("utf-8", "surrogateescape") + b"\0"
+        return tuple(rule for rule, pattern in self._names if pattern.search(raw))
+
+    def evaluate(self, table: CentralDirectory, compressed_size: int) -> Dict[str, str]:
+        """Checks the rules against the central directory of one zip
+
+        Args:
+            table (CentralDirectory): central directory of the zip
+            compressed_size (int): size of the zip, for max_level_ratio
+
+        Returns:
+            Dict[str, str]: first offending name and the count of the others, by the rule broken
+        """
+        findings: Dict[str, str] = {}
+        blob = table.names_blob
+        for rule, pattern in self._names:
+            count = 0
+            previous = -1
+            for match in pattern.finditer(blob):
+                start = blob.rfind(b"\0", 0, match.start()) + 1
+                if start == previous:
+                    # Another match in the same name, e.g. a/../../b
+                    continue
+                previous = start
+                if not count:
+                    end = blob.find(b"\0", match.start())
+                    findings[rule] = blob[start:end].decode("utf-8", "replace")
+                count += 1
+            if count > 1:
+                findings[rule] += f" and {count - 1} more"
+
+        if table.has_symlinks():
+            findings[SYMLINK] = "symlinks"
+        if self.max_entries is not None and len(table) > self.max_entries:
+            findings["max_entries"] = f"{len(table)} entries"
+        total = table.total_uncompressed
+        if self.max_total_size is not None and total > self.max_total_size:
+            findings["max_total_size"] = f"{total} bytes"
+        if self.max_member_size is not None and len(table):
+            largest = max(table.file_size)
+            if largest > self.max_member_size:
+                name = table.name(table.file_size.index(largest))
+                findings["max_member_size"] = f"{name}, {largest} bytes"
+        if (
+            self.max_level_ratio is not None
+            and total > self.max_level_ratio * compressed_size
+        ):
+            findings["max_level_ratio"] = f"{total / max(compressed_size, 1):.2f}"
+        if self.max_member_ratio is not None and len(table):
+            ratios = member_ratios(table.file_size, table.compress_size)
+            highest = max(ratios)
+            if highest > self.max_member_ratio:
+                name = table.name(ratios.index(highest))
+                findings["max_member_ratio"] = f"{name}, {highest:.2f}"
+        if not self.encrypted_allowed and any(flags & 0x1 for flags in table.flags):
+            findings["encrypted"] = "encrypted entries"
+        return findings
+
+
+def _glob(pattern: str) -> bytes:
+    """Regular expression matching a whole name in the \\0 separated names of a central directory"""
+    parts = [_NAME_START]
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        i += 1
+        if char == "*":
+            parts.append(rb"[^\0]*")
+        elif char == "?":
+            parts.append(rb"[^\0]")
+        elif char == "[" and pattern.find("]", i + 1) != -1:
+            end = pattern.find("]", i + 1)
+            members = pattern[i:end].replace("\\", "\\\\")
+            if members.startswith("!"):
+                # A negated set must not match the separator either
+                members = "^\\x00" + members[1:]
+            parts.append(b"[" + members.encode() + b"]")
+            i = end + 1
+        else:
+            parts.append(re.escape(char.encode()))
+    parts.append(_NAME_END)
+    return b"".join(parts)
@@ -0,0 +1,159 @@
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from typing import Callable
+from typing import Deque
+from typing import Optional
+
+from DefuseZip.loader import DefuseZip
+from DefuseZip.loader import MaliciousFileException
+
+_pool: Optional["ScanPool"] = None
+_pool_lock = threading.Lock()
+
+
+class ScanPool:
+    """Worker threads shared by any number of scans, with a bounded queue in front of them.
+
+    At most ``max_workers`` calls run at once and ``max_queued`` more wait for a thread. Past that the caller
+    is held back, ``submit`` blocks and ``submit_async`` waits in the event loop, until a call completes, so a
+    burst of scans doesn't pile up threads or queued work. The threads are started on the first call and
+    reused for every call after it.
+    """
+
+    def __init__(self, max_workers: int = 4, max_queued: Optional[int] = None):
+        """
+        ScanPool initializer
+        :param max_workers: Threads running the calls. Default = 4
+        :param max_queued: Calls allowed to wait for a free thread before callers are held back.
+        Default = max_workers
+        """
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        self.max_workers = max_workers
+        self.max_queued = max_workers if max_queued is None else max_queued
+        self.__lock = threading.Lock()
+        self.__executor: Optional[ThreadPoolExecutor] = None
+        self.__pending = 0
+        # Hand a freed slot over to a held back caller, False if it can't take it any more
+        self.__waiters: Deque[Callable[[], bool]] = deque()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Runs ``fn(*args, **kwargs)`` on a worker thread, blocking while the pool is full"""
+        ready = threading.Event()
+
+        def hand_over() -> bool:
+            ready.set()
+            return True
+
+        if not self.__reserve(hand_over):
+            ready.wait()
+        return self.__start(fn, args, kwargs)
+
+    async def submit_async(self, fn: Callable, *args) -> "asyncio.Future[Any]":
+        """Runs ``fn(*args)`` on a worker thread, waiting in the event loop while the pool is full"""
+        loop = asyncio.get_event_loop()
+        slot = loop.create_future()
+
+        def hand_over() -> bool:
+            try:
+                loop.call_soon_threadsafe(self.__hand_to, slot)
+            except RuntimeError:  # pragma: no cover
+                return False  # The loop is closed
+            return True
+
+        if not self.__reserve(hand_over):
+            try:
+                await slot
+            except asyncio.CancelledError:
+                if slot.done() and not slot.cancelled():
+                    self.__release()
+                raise
+        return asyncio.wrap_future(self.__start(fn, args, {}), loop=loop)
+
+    def scan(self, zip_file: Any, **options) -> Future:
+        """Scans a zip on a worker thread, the future's result is the completed DefuseZip
+
+        Like AsyncDefuseZip, a dangerous zip doesn't raise, check is_dangerous on the result.
+        """
+        return self.submit(run_scan, DefuseZip(zip_file, **options))
+
+    def close(self):
+        """Shuts the threads down once the calls already submitted complete, they are started again on the next call"""
+        with self.__lock:
+            executor, self.__executor = self.__executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def __reserve(self, hand_over: Callable[[], bool]) -> bool:
+        """Takes a slot if one is free and nobody is waiting for it, queues ``hand_over`` otherwise"""
+        with self.__lock:
+            if (
+                self.__pending < self.max_workers + self.max_queued
+                and not self.__waiters
+            ):
+                self.__pending += 1
+                return True
+            self.__waiters.append(hand_over)
+            return False
+
+    def __release(self):
+        with self.__lock:
+            while self.__waiters:
+                if self.__waiters.popleft()():
+                    return
+            self.__pending -= 1
+
+    def __hand_to(self, slot: "asyncio.Future[None]"):
+        # A coroutine cancelled while waiting passes its slot on
+        if slot.cancelled():
+            self.__release()
+        else:
+            slot.set_result(None)
+
+    def __start(self, fn: Callable, args: tuple, kwargs: dict) -> Future:
+        try:
+            with self.__lock:
+                if self.__executor is None:
+                    self.__executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix="DefuseZip"
+                    )
+                executor = self.__executor
+            future = executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self.__release()
+            raise
+        future.add_done_callback(lambda _: self.__release())
+        return future
+
+
+def run_scan(defusezip: DefuseZip) -> DefuseZip:
+    """Scans without raising MaliciousFileException, returning the DefuseZip"""
+    try:
+        defusezip.scan()
+    except MaliciousFileException:
+        pass
+    return defusezip
+
+
+def scan_pool() -> ScanPool:
+    """The process wide ScanPool, created on first use with the defaults or the size set by configure_scan_pool"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ScanPool()
+        return _pool
+
+
+def configure_scan_pool(  # dead: disable
+    max_workers: int = 4, max_queued: Optional[int] = None
+):
+    """Sizes the process wide ScanPool, a pool already in use finishes the calls it was given and is replaced"""
+    global _pool
+    with _pool_lock:
+        previous, _pool = _pool, ScanPool(max_workers, max_queued)
+    if previous is not None:
+        previous.close()
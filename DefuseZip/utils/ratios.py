@@ -0,0 +1,129 @@
+import heapq
+from itertools import chain
+from itertools import compress
+from itertools import count
+from itertools import islice
+from itertools import repeat
+from operator import truediv
+from typing import Any
+from typing import List
+from typing import NamedTuple
+from typing import Tuple
+
+from DefuseZip.utils.central_directory import CentralDirectory
+
+
+class MemberRatio(NamedTuple):
+    """Compression ratio of one member, its declared size over its compressed size"""
+
+    ratio: float
+    level: int
+    name: str
+    compress_size: int
+    file_size: int
+
+
+def member_ratios(file_sizes: Any, compress_sizes: Any) -> List[float]:
+    """Ratio of each member, a member with no compressed data counts as one byte compressed"""
+    try:
+        return list(map(truediv, file_sizes, compress_sizes))
+    except ZeroDivisionError:
+        return list(map(truediv, file_sizes, map(max, compress_sizes, repeat(1))))
+
+
+class RatioTracker:
+    """Compression ratios of the members of a scan, per member and per nesting level
+
+    Sizes are summed per level, for the ratio of each level on its own. Only the ``top_k`` members with the
+    highest ratios are kept, in a min-heap, so the extreme ones show up however many benign members surround
+    them. Everything comes from the sizes the zips declare, no data is read for it.
+    """
+
+    __slots__ = ("top_k", "_heap", "_levels")
+
+    def __init__(self, top_k: int = 5):
+        self.top_k = top_k
+        self._heap: List[MemberRatio] = []
+        # [compressed, uncompressed] bytes per level
+        self._levels: List[List[int]] = []
+
+    def __level(self, level: int) -> List[int]:
+        while len(self._levels) <= level:
+            self._levels.append([0, 0])
+        return self._levels[level]
+
+    def __push(self, member: MemberRatio):
+        if len(self._heap) < self.top_k:
+            heapq.heappush(self._heap, member)
+        elif member > self._heap[0]:
+            heapq.heapreplace(self._heap, member)
+
+    def add(self, level: int, name: str, compress_size: int, file_size: int):
+        sums = self.__level(level)
+        sums[0] += compress_size
+        sums[1] += file_size
+        if self.top_k:
+            ratio = file_size / max(compress_size, 1)
+            self.__push(MemberRatio(ratio, level, name, compress_size, file_size))
+
+    def add_table(self, level: int, table: CentralDirectory):
+        """Adds every member of a central directory, only the names of the top ones are decoded"""
+        sums = self.__level(level)
+        sums[0] += sum(table.compress_size)
+        sums[1] += sum(table.file_size)
+        if not self.top_k:
+            return
+        ratios = member_ratios(table.file_size, table.compress_size)
+        top = heapq.nlargest(self.top_k, ratios)
+        if not top:
+            return
+        # Indexes of the top ratios found without a loop in Python, ties with the lowest one fill what is left
+        lowest = top[-1]
+        higher = list(compress(count(), map(lowest.__lt__, ratios)))
+        ties = compress(count(), map(lowest.__eq__, ratios))
+        for index in chain(higher, islice(ties, self.top_k - len(higher))):
+            self.__push(
+                MemberRatio(
+                    ratios[index],
+                    level,
+                    table.name(index),
+                    table.compress_size[index],
+                    table.file_size[index],
+                )
+            )
+
+    def top(self) -> Tuple[MemberRatio, ...]:
+        """The members with the highest ratios, highest first"""
+        return tuple(sorted(self._heap, reverse=True))
+
+    def level_ratios(self) -> Tuple[float, ...]:
+        """Ratio of each nesting level, the outermost zip first"""
+        return tuple(
+            file_size / max(compressed, 1) for compressed, file_size in self._levels
+        )
+
+    def export(self, base_level: int) -> List[Any]:
+        """The ratios below ``base_level`` as JSON serializable values, with levels relative to it"""
+        return [
+            [list(sums) for sums in self._levels[base_level:]],
+            [
+                [m.ratio, m.level - base_level, m.name, m.compress_size, m.file_size]
+                for m in self._heap
+                if m.level >= base_level
+            ],
+        ]
+
+    def merge(self, exported: List[Any], base_level: int):
+        """Adds ratios exported from another tracker, placing their levels below ``base_level``"""
+        levels, members = exported
+        for offset, (compressed, file_size) in enumerate(levels):
+            sums = self.__level(base_level + offset)
+            sums[0] += compressed
+            sums[1] += file_size
+        for ratio, level, name, compress_size, file_size in members:
+            if self.top_k:
+                self.__push(
+                    MemberRatio(
+                        ratio, base_level + level, name, compress_size, file_size
+                    )
+                )
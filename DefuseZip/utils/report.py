@@ -0,0 +1,148 @@
+import json
+import threading
+from collections import Counter
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Tuple
+
+from DefuseZip.utils.metrics import ScanMetrics
+from DefuseZip.utils.ratios import MemberRatio
+
+
+class ScanReport(NamedTuple):
+    """Result of a scan with raw values, sizes in bytes and seconds as floats"""
+
+    file: str
+    dangerous: bool
+    message: str
+    compressed_size: int
+    uncompressed_size: int
+    ratio: float
+    # Declared size over compressed size of each nesting level, the outermost zip first
+    level_ratios: Tuple[float, ...]
+    # Members with the highest ratios, highest first
+    top_members: Tuple[MemberRatio, ...]
+    nested_zips: int
+    nested_levels: int
+    symlinks: bool
+    directory_travelsal: bool
+    overlapping_entries: int
+    size_mismatch: bool
+    violations: Tuple[str, ...]
+    killswitch: bool
+    stopped_early: bool
+    cached: bool
+    seconds: float
+    metrics: ScanMetrics
+
+    def as_dict(self) -> Dict[str, Any]:
+        """The report as a dict of JSON serializable values"""
+        record = self._asdict()
+        record["metrics"] = self.metrics.as_dict()
+        record["top_members"] = [member._asdict() for member in self.top_members]
+        return record
+
+    def to_json(self) -> str:
+        """One line JSON object, e.g. a record of NDJSON output"""
+        return json.dumps(self.as_dict(), separators=(",", ":"))
+
+
+class NestedResult(NamedTuple):
+    """What walking one nested zip found, added again for every identical copy instead of walking it"""
+
+    nested_zips: int
+    # Deepest level reached, relative to the containing zip
+    nested_levels: int
+    uncompressed_size: int
+    directory_travelsal: bool
+    symlinks: bool
+    overlapping_entries: int
+    size_mismatch: bool
+    violations: Dict[str, str]
+    # RatioTracker.export of the subtree
+    ratios: List[Any]
+
+
+class PrometheusExporter:
+    """Sums up scan reports into metrics in the Prometheus text exposition format
+
+    ``observe`` fits DefuseZip's metrics_callback, so every scan is counted as it completes. It can be called
+    from several threads at once.
+    """
+
+    def __init__(self, namespace: str = "defusezip"):
+        self.namespace = namespace
+        self.__lock = threading.Lock()
+        self.__scans: Counter = Counter()
+        self.__phases: Dict[str, float] = {}
+        self.__totals: Counter = Counter()
+        self.__seconds = 0.0
+        self.__peak_buffered_bytes = 0
+        self.__peak_spooled_bytes = 0
+
+    def observe(self, report: ScanReport):
+        metrics = report.metrics
+        with self.__lock:
+            self.__scans[(report.dangerous, report.cached)] += 1
+            self.__seconds += report.seconds
+            self.__totals["bytes_read"] += metrics.bytes_read
+            self.__totals["entries"] += metrics.entries
+            self.__totals["nested_opened"] += metrics.nested_opened
+            self.__totals["nested_reused"] += metrics.nested_reused
+            for phase, seconds in metrics.phases.items():
+                self.__phases[phase] = self.__phases.get(phase, 0.0) + seconds
+            self.__peak_buffered_bytes = max(
+                self.__peak_buffered_bytes, metrics.peak_buffered_bytes
+            )
+            self.__peak_spooled_bytes = max(
+                self.__peak_spooled_bytes, metrics.peak_spooled_bytes
+            )
+
+    def render(self) -> str:
+        """The metrics observed so far, in the text exposition format"""
+        prefix = self.namespace
+        lines: List[str] = []
+
+        def metric(name: str, kind: str, description: str):
+            lines.append(f"# HELP {prefix}_{name} {description}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+        with self.__lock:
+            metric("scans_total", "counter", "Zips scanned")
+            for (dangerous, cached), count in sorted(self.__scans.items()):
+                labels = f'dangerous="{str(dangerous).lower()}",cached="{str(cached).lower()}"'
+                lines.append(f"{prefix}_scans_total{{{labels}}} {count}")
+            metric("scan_seconds_total", "counter", "Seconds spent scanning")
+            lines.append(f"{prefix}_scan_seconds_total {self.__seconds}")
+            metric(
+                "phase_seconds_total",
+                "counter",
+                "Seconds spent in each phase of the scans, phases can nest",
+            )
+            for phase, seconds in sorted(self.__phases.items()):
+                lines.append(
+                    f'{prefix}_phase_seconds_total{{phase="{phase}"}} {seconds}'
+                )
+            for name, description in (
+                ("bytes_read", "Bytes read from the zips"),
+                ("entries", "Entries visited"),
+                ("nested_opened", "Nested zips opened"),
+                ("nested_reused", "Nested zips recognised and not walked again"),
+            ):
+                metric(f"{name}_total", "counter", description)
+                lines.append(f"{prefix}_{name}_total {self.__totals[name]}")
+            metric(
+                "peak_buffered_bytes",
+                "gauge",
+                "Most memory held for nested zips by a scan",
+            )
+            lines.append(f"{prefix}_peak_buffered_bytes {self.__peak_buffered_bytes}")
+            metric(
+                "peak_spooled_bytes",
+                "gauge",
+                "Most nested zip data spooled to disk by a scan",
+            )
+            lines.append(f"{prefix}_peak_spooled_bytes {self.__peak_spooled_bytes}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,366 @@
+import io
+import struct
+import tempfile
+import zlib
+from typing import Callable
+from typing import IO
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
+from zipfile import BadZipFile
+from zipfile import ZIP_DEFLATED
+from zipfile import ZIP_STORED
+from zipfile import ZipFile
+from zipfile import ZipInfo
+
+CHUNK_SIZE = 64 * 1024
+
+LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+LOCAL_HEADER_SIGNATURE = b"PK\003\004"
+
+
+class SpoolLimitError(Exception):
+    """Spooling a member was cancelled or it inflated past its byte limit"""
+
+
+class _ReadOnlyView(io.RawIOBase):
+    """Seek and tell over ``length`` bytes, subclasses implement readinto"""
+
+    def __init__(self, length: int):
+        super().__init__()
+        self._length = length
+        self._pos = 0
+
+    def readable(self) -> bool:  # dead: disable
+        return True
+
+    def seekable(self) -> bool:  # dead: disable
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, pos: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            pos += self._length
+        elif whence != io.SEEK_SET:
+            raise ValueError(f"Invalid whence ({whence})")
+        if pos < 0:
+            raise ValueError(f"Negative seek position {pos}")
+        self._pos = pos
+        return self._pos
+
+
+class SeekableView(_ReadOnlyView):
+    """Read-only, seekable window of ``length`` bytes starting at ``offset`` in ``fileobj``.
+
+    Closing the view leaves the underlying file object open.
+    """
+
+    def __init__(self, fileobj: IO[bytes], offset: int, length: int):
+        super().__init__(length)
+        self._fileobj = fileobj
+        self._offset = offset
+
+    def readinto(self, buffer) -> int:
+        size = min(len(buffer), self._length - self._pos)
+        if size <= 0:
+            return 0
+        self._fileobj.seek(self._offset + self._pos)
+        data = self._fileobj.read(size)
+        buffer[: len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+class BufferReader(_ReadOnlyView):
+    """Read-only, seekable file object over a bytes-like object such as bytes, a memoryview or an mmap.
+
+    The buffer is never copied as a whole, each read copies only the bytes it returns.
+    """
+
+    def __init__(self, buffer):
+        self._buffer = memoryview(buffer).cast("B")
+        super().__init__(self._buffer.nbytes)
+
+    def readinto(self, buffer) -> int:
+        size = min(len(buffer), self._length - self._pos)
+        if size <= 0:
+            return 0
+        start, end = self._pos, self._pos + size
+        buffer[:size] = self._buffer[start:end]
+        self._pos = end
+        return size
+
+
+class PrefixedReader(io.RawIOBase):
+    """Reads ``prefix`` and then the rest of ``fileobj``, to put back bytes already read from a stream"""
+
+    def __init__(self, prefix: bytes, fileobj: IO[bytes]):
+        super().__init__()
+        self._prefix = memoryview(prefix)
+        self._fileobj = fileobj
+
+    def readable(self) -> bool:  # dead: disable
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._prefix:
+            size = min(len(buffer), len(self._prefix))
+            buffer[:size] = self._prefix[:size]
+            self._prefix = self._prefix[size:]
+            return size
+        data = self._fileobj.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+class MeteredReader(io.RawIOBase):
+    """Passes reads through to ``fileobj``, calling ``account`` with the size of each, which may raise to stop
+
+    Closing the reader leaves ``fileobj`` open.
+    """
+
+    def __init__(self, fileobj: IO[bytes], account: Callable[[int], None]):
+        super().__init__()
+        self._fileobj = fileobj
+        self._account = account
+
+    def readable(self) -> bool:  # dead: disable
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._fileobj.read(len(buffer))
+        self._account(len(data))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+def member_data_offset(fileobj: IO[bytes], info: ZipInfo) -> int:
+    """Returns the absolute offset of the member's (compressed) data in ``fileobj``
+
+    Args:
+        fileobj (IO[bytes]): file object the archive was opened from
+        info (ZipInfo): member to locate
+
+    Raises:
+        BadZipFile: local file header is missing or damaged
+
+    Returns:
+        int: offset of the first data byte
+    """
+    return _data_offset(fileobj, info.header_offset, info.filename)
+
+
+def _data_offset(fileobj: IO[bytes], header_offset: int, name: str) -> int:
+    if header_offset < 0:
+        raise BadZipFile(f"Local header offset before the start of the file for {name}")
+    fileobj.seek(header_offset)
+    header = fileobj.read(LOCAL_HEADER.size)
+    if len(header) != LOCAL_HEADER.size:
+        raise BadZipFile(f"Truncated local header for {name}")
+    fields = LOCAL_HEADER.unpack(header)
+    if fields[0] != LOCAL_HEADER_SIGNATURE:
+        raise BadZipFile(f"Bad local header signature for {name}")
+    return header_offset + LOCAL_HEADER.size + fields[10] + fields[11]
+
+
+def read_head(
+    fileobj: IO[bytes],
+    header_offset: int,
+    compress_type: int,
+    compress_size: int,
+    size: int,
+) -> Optional[bytes]:
+    """First ``size`` bytes of a member's data, inflating only as much of it as they take
+
+    The local header is read directly, so no ZipFile is needed, e.g. for a table of the central directory.
+
+    Args:
+        fileobj (IO[bytes]): file object of the archive
+        header_offset (int): offset of the member's local header
+        compress_type (int): compression method of the member
+        compress_size (int): compressed size of the member
+        size (int): count of bytes to read
+
+    Returns:
+        Optional[bytes]: up to ``size`` bytes, None if the member is damaged or compressed other than deflated
+    """
+    if compress_type not in (ZIP_STORED, ZIP_DEFLATED):
+        return None
+    try:
+        fileobj.seek(_data_offset(fileobj, header_offset, f"offset {header_offset}"))
+        if compress_type == ZIP_STORED:
+            return fileobj.read(min(size, compress_size))
+        decompressor = zlib.decompressobj(-15)
+        head = b""
+        remaining = compress_size
+        while len(head) < size and remaining > 0:
+            chunk = fileobj.read(min(1024, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            # Stops once head is full, so an unconsumed tail is never followed by another chunk
+            head += decompressor.decompress(chunk, size - len(head))
+        return head
+    except (BadZipFile, zlib.error):
+        return None
+
+
+def read_chunks(
+    fileobj: IO[bytes], max_bytes: int, should_stop: Callable[[], bool]
+) -> Iterator[bytes]:
+    """Yields the rest of ``fileobj`` in CHUNK_SIZE chunks, raising SpoolLimitError on cancel or past ``max_bytes``"""
+    read = 0
+    while True:
+        if should_stop():
+            raise SpoolLimitError("Cancelled while reading")
+        chunk = fileobj.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        read += len(chunk)
+        if read > max_bytes:
+            raise SpoolLimitError(f"Data goes on past {max_bytes} bytes")
+        yield chunk
+
+
+def spool(chunks: Iterable[bytes], max_in_memory: int) -> IO[bytes]:
+    """Writes the chunks to a seekable buffer kept in memory up to ``max_in_memory`` bytes, on disk past that
+
+    Returns:
+        IO[bytes]: the buffer positioned at its start, caller is responsible for closing it
+    """
+    buffer: IO[bytes]
+    if max_in_memory > 0:
+        buffer = tempfile.SpooledTemporaryFile(max_size=max_in_memory)  # type: ignore
+    else:
+        buffer = tempfile.TemporaryFile()
+    try:
+        for chunk in chunks:
+            buffer.write(chunk)
+        buffer.seek(0)
+    except BaseException:
+        buffer.close()
+        raise
+    return buffer
+
+
+def open_member(
+    fileobj: IO[bytes],
+    zf: ZipFile,
+    info: ZipInfo,
+    max_in_memory: int,
+    max_bytes: int,
+    should_stop: Callable[[], bool],
+) -> IO[bytes]:
+    """Opens a member of ``zf`` as a seekable file object without reading it whole into memory.
+
+    Unencrypted stored members are served as a buffered view straight into ``fileobj``. Everything else is
+    decompressed in chunks into a spooled buffer that keeps at most ``max_in_memory`` bytes in memory
+    before rolling over to a temporary file on disk.
+
+    Args:
+        fileobj (IO[bytes]): file object ``zf`` was opened from
+        zf (ZipFile): the containing archive
+        info (ZipInfo): member to open
+        max_in_memory (int): memory budget for this member in bytes
+        max_bytes (int): most bytes the member is allowed to inflate to, in memory and on disk combined
+        should_stop (Callable[[], bool]): checked between chunks, spooling is cancelled when it returns True
+
+    Raises:
+        SpoolLimitError: cancelled by ``should_stop`` or the member inflated past ``max_bytes``
+
+    Returns:
+        IO[bytes]: seekable binary file object, caller is responsible for closing it
+    """
+    if info.compress_type == ZIP_STORED and not info.flag_bits & 0x1:
+        offset = member_data_offset(fileobj, info)
+        return io.BufferedReader(SeekableView(fileobj, offset, info.compress_size))
+    return spool(inflate(zf, info, max_bytes, should_stop), max_in_memory)
+
+
+def probe_member(
+    fileobj: IO[bytes],
+    zf: ZipFile,
+    info: ZipInfo,
+    max_bytes: int,
+    should_stop: Callable[[], bool],
+) -> Tuple[int, int]:
+    """Inflates a member chunk by chunk without keeping any of it, to learn its real size and CRC32.
+
+    Stored and deflated members are read raw from ``fileobj`` and inflated until their deflate stream
+    ends, whatever size their headers declare, so a member inflating past its declared size is measured
+    instead of cut off. Other compression methods go through zipfile, which stops at the declared size
+    and checks the CRC itself.
+
+    Args:
+        fileobj (IO[bytes]): file object ``zf`` was opened from
+        zf (ZipFile): the containing archive
+        info (ZipInfo): member to probe
+        max_bytes (int): most bytes the member is allowed to inflate to
+        should_stop (Callable[[], bool]): checked between chunks, probing is cancelled when it returns True
+
+    Raises:
+        SpoolLimitError: cancelled by ``should_stop`` or the member inflated past ``max_bytes``
+        BadZipFile: the member's local header or, past zipfile, its CRC is damaged
+        EOFError: the member's data ends before its deflate stream does
+        zlib.error: the member's deflate stream is damaged
+
+    Returns:
+        Tuple[int, int]: count of bytes the member inflated to, CRC32 of those bytes
+    """
+    if info.compress_type not in (ZIP_STORED, ZIP_DEFLATED):
+        size = sum(len(chunk) for chunk in inflate(zf, info, max_bytes, should_stop))
+        return size, info.CRC
+
+    fileobj.seek(member_data_offset(fileobj, info))
+    decompressor = zlib.decompressobj(-15) if info.compress_type else None
+    remaining = info.compress_size
+    size = crc = 0
+    data = b""
+    while decompressor is None or not decompressor.eof:
+        if should_stop():
+            raise SpoolLimitError(f"Cancelled while inflating {info.filename}")
+        if not data and remaining > 0:
+            data = fileobj.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                raise EOFError(f"Data of {info.filename} is truncated")
+            remaining -= len(data)
+        if decompressor is None:
+            chunk, data = data, b""
+        else:
+            # Output past max_length stays in the decompressor, so it is also called with no input left
+            chunk = decompressor.decompress(data, CHUNK_SIZE)
+            data = decompressor.unconsumed_tail
+        if not chunk and not data and remaining <= 0:
+            if decompressor is not None and not decompressor.eof:
+                raise EOFError(f"Deflate stream of {info.filename} is truncated")
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise SpoolLimitError(f"{info.filename} inflates past {max_bytes} bytes")
+        crc = zlib.crc32(chunk, crc)
+    return size, crc
+
+
+def inflate(
+    zf: ZipFile, info: ZipInfo, max_bytes: int, should_stop: Callable[[], bool]
+) -> Iterator[bytes]:
+    """Yields a member's data in CHUNK_SIZE chunks, raising SpoolLimitError on cancel or past ``max_bytes``"""
+    written = 0
+    with zf.open(info) as member:
+        while True:
+            if should_stop():
+                raise SpoolLimitError(f"Cancelled while inflating {info.filename}")
+            chunk = member.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            written += len(chunk)
+            if written > max_bytes:
+                raise SpoolLimitError(
+                    f"{info.filename} inflates past {max_bytes} bytes"
+                )
+            yield chunk
@@ -0,0 +1,119 @@
+import io
+import random
+import struct
+import zipfile
+from pathlib import Path
+from typing import Callable
+from typing import Dict
+from typing import NamedTuple
+
+_END_RECORD = struct.Struct("<4s4H2LH")
+
+# Repetitive data compresses to almost nothing, the raw material of every bomb here
+_KERNEL = b"\0" * (1024 * 1024)
+
+
+class Scenario(NamedTuple):
+    generate: Callable[[Path, float], None]
+    benign: bool
+
+
+def flat(path: Path, scale: float):
+    """One million small entries at scale 1.0, stresses per-entry overhead"""
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as zf:
+        for index in range(max(1, int(1_000_000 * scale))):
+            zf.writestr(f"{index:07d}.txt", b"x")
+
+
+def deep(path: Path, scale: float):
+    """A zip nested inside itself, 64 levels deep at scale 1.0"""
+    data = _zip_bytes({"leaf.txt": b"leaf"})
+    for level in range(max(1, int(64 * scale))):
+        data = _zip_bytes({f"level{level}.zip": data})
+    path.write_bytes(data)
+
+
+def fan_out(path: Path, scale: float):
+    """42.zip layout, 16 copies of the level below on every level, 4 levels at scale 1.0"""
+    copies = max(2, int(16 * scale))
+    data = _zip_bytes({"0.txt": _KERNEL * 4})
+    for level in range(4):
+        data = _zip_bytes({f"{level}_{index}.zip": data for index in range(copies)})
+    path.write_bytes(data)
+
+
+def overlapping(path: Path, scale: float):
+    """Every central directory entry points at the same local file, 65534 of them at scale 1.0
+
+    Nothing is nested and the data is stored once, the ratio only shows when the entries are summed.
+    """
+    data = _zip_bytes({"bomb.txt": _KERNEL * 16})
+    _, _, _, _, _, size_cd, offset_cd, _ = _END_RECORD.unpack_from(
+        data, len(data) - _END_RECORD.size
+    )
+    local_file = data[:offset_cd]
+    end = offset_cd + size_cd
+    record = data[offset_cd:end]
+    entries = max(1, min(0xFFFE, int(0xFFFE * scale)))
+    central_directory = record * entries
+    end_record = _END_RECORD.pack(
+        b"PK\005\006",
+        0,
+        0,
+        entries,
+        entries,
+        len(central_directory),
+        len(local_file),
+        0,
+    )
+    path.write_bytes(local_file + central_directory + end_record)
+
+
+def large(path: Path, scale: float):
+    """256 MiB of incompressible data in 256 entries at scale 1.0, seeded so every run writes the same"""
+    rng = random.Random(42)
+    size = 1024 * 1024
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for index in range(max(1, int(256 * scale))):
+            zf.writestr(
+                f"{index:03d}.bin", rng.getrandbits(size * 8).to_bytes(size, "little")
+            )
+
+
+def _zip_bytes(members: Dict[str, bytes]) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return buffer.getvalue()
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    "flat": Scenario(flat, benign=True),
+    "deep": Scenario(deep, benign=False),
+    "fan_out": Scenario(fan_out, benign=False),
+    "overlapping": Scenario(overlapping, benign=False),
+    "large": Scenario(large, benign=True),
+}
+
+
+def build(directory: Path, scale: float) -> Dict[str, Path]:
+    """Writes every scenario's zip into ``directory``, zips already there from an earlier run are reused
+
+    Args:
+        directory (Path): where to keep the corpus
+        scale (float): multiplier for the size of every scenario, 1.0 is the full corpus
+
+    Returns:
+        Dict[str, Path]: zip of each scenario
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = {}
+    for name, scenario in SCENARIOS.items():
+        path = directory / f"{name}-{scale:g}.zip"
+        if not path.exists():
+            partial = path.with_suffix(".partial")
+            scenario.generate(partial, scale)
+            partial.replace(path)
+        paths[name] = path
+    return paths
@@ -0,0 +1,230 @@
+import json
+import multiprocessing
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from argparse import Namespace
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from benchmarks.corpus import build
+from benchmarks.corpus import SCENARIOS
+from DefuseZip import __version__
+from DefuseZip.loader import DefuseZip
+from DefuseZip.loader import MaliciousFileException
+from DefuseZip.utils.central_directory import read_central_directory
+
+OPERATIONS = ("scan", "safe_extract", "extract_all")
+
+
+def parse_arguments() -> Namespace:
+    args = ArgumentParser(
+        description="Measures DefuseZip's latency, throughput and peak RSS on generated corpora"
+    )
+    args.add_argument(
+        "--corpus",
+        type=Path,
+        default=Path(tempfile.gettempdir()) / "DefuseZip-benchmarks",
+        help="Directory to generate the corpus in, zips already there are reused",
+    )
+    args.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="Size of the corpus, 1.0 is the full one, e.g. 0.01 for a quick run",
+    )
+    args.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Runs of each measurement, each in a fresh process",
+    )
+    args.add_argument(
+        "--scenario",
+        action="append",
+        choices=list(SCENARIOS),
+        help="Scenario to run, can be given more than once. Default all",
+    )
+    args.add_argument(
+        "--operation",
+        action="append",
+        choices=OPERATIONS,
+        help="Operation to measure, can be given more than once. Default all, extraction only on benign zips",
+    )
+    args.add_argument(
+        "--killswitch_seconds",
+        type=int,
+        default=60,
+        help="Killswitch for every scan, high enough for the full corpus to finish",
+    )
+    args.add_argument(
+        "--full_report",
+        default=False,
+        action="store_true",
+        help="Toggle to scan with full_report instead of stopping at the first finding",
+    )
+    args.add_argument(
+        "--output",
+        "-o",
+        type=Path,
+        help="File to write the JSON results to. Default stdout",
+    )
+    return args.parse_args()
+
+
+def main() -> int:
+    opts = parse_arguments()
+    corpus = build(opts.corpus, opts.scale)
+    options = {
+        "killswitch_seconds": opts.killswitch_seconds,
+        "full_report": opts.full_report,
+    }
+    results = []
+    for name in opts.scenario or SCENARIOS:
+        for operation in opts.operation or OPERATIONS:
+            if operation != "scan" and not SCENARIOS[name].benign:
+                continue
+            result = measure(name, corpus[name], operation, options, opts.repeat)
+            print(_summary(result), file=sys.stderr)
+            results.append(result)
+
+    report = {
+        "meta": {
+            "defusezip": __version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "scale": opts.scale,
+            "repeat": opts.repeat,
+            "options": options,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if opts.output:
+        opts.output.write_text(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+def measure(
+    scenario: str, path: Path, operation: str, options: Dict[str, Any], repeat: int
+) -> Dict[str, Any]:
+    """Runs one operation on one zip ``repeat`` times, each in a fresh process so peak RSS is its own
+
+    Args:
+        scenario (str): name of the scenario
+        path (Path): the scenario's zip
+        operation (str): one of OPERATIONS
+        options (Dict[str, Any]): DefuseZip arguments
+        repeat (int): number of runs
+
+    Returns:
+        Dict[str, Any]: median and best time, throughput and the highest peak RSS of the runs
+    """
+    with open(path, "rb") as f:
+        entries = len(read_central_directory(f))
+    compressed_bytes = path.stat().st_size
+    result: Dict[str, Any] = {
+        "scenario": scenario,
+        "operation": operation,
+        "compressed_bytes": compressed_bytes,
+        "entries": entries,
+    }
+
+    runs: List[Dict[str, Any]] = []
+    context = multiprocessing.get_context("spawn")
+    for _ in range(repeat):
+        receiver, sender = context.Pipe(duplex=False)
+        worker = context.Process(
+            target=_run_in_child, args=(str(path), operation, options, sender)
+        )
+        worker.start()
+        sender.close()
+        try:
+            run: Optional[Dict[str, Any]] = receiver.recv()
+        except EOFError:
+            run = None
+        finally:
+            receiver.close()
+            worker.join()
+        if run is None:
+            result["error"] = f"worker exited with code {worker.exitcode}"
+            return result
+        runs.append(run)
+
+    seconds = statistics.median(run["seconds"] for run in runs)
+    result.update(
+        {
+            "seconds": seconds,
+            "seconds_min": min(run["seconds"] for run in runs),
+            "throughput_mib_s": compressed_bytes / seconds / 2**20
+            if seconds
+            else None,
+            "entries_per_second": entries / seconds if seconds else None,
+            "peak_rss_kib": max(run["peak_rss_kib"] for run in runs),
+            "rss_growth_kib": max(
+                run["peak_rss_kib"] - run["baseline_rss_kib"] for run in runs
+            ),
+            "dangerous": runs[-1]["dangerous"],
+        }
+    )
+    return result
+
+
+def _run_in_child(
+    path: str, operation: str, options: Dict[str, Any], sender: Connection
+):
+    """Times the operation alone, extraction operations scan first without timing it"""
+    baseline_rss = _peak_rss_kib()
+    defusezip = DefuseZip(Path(path), **options)
+    with tempfile.TemporaryDirectory() as destination:
+        start = time.perf_counter()
+        try:
+            defusezip.scan()
+        except MaliciousFileException:
+            pass
+        if operation == "safe_extract":
+            start = time.perf_counter()
+            defusezip.safe_extract(Path(destination), max_cpu_time=3600)
+        elif operation == "extract_all":
+            start = time.perf_counter()
+            defusezip.extract_all(Path(destination))
+        seconds = time.perf_counter() - start
+    sender.send(
+        {
+            "seconds": seconds,
+            "peak_rss_kib": _peak_rss_kib(),
+            "baseline_rss_kib": baseline_rss,
+            "dangerous": defusezip.is_dangerous,
+        }
+    )
+    sender.close()
+
+
+def _peak_rss_kib() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _summary(result: Dict[str, Any]) -> str:
+    name = f"{result['scenario']:<12} {result['operation']:<13}"
+    if "error" in result:
+        return f"{name} {result['error']}"
+    return (
+        f"{name} {result['seconds']:>9.4f} s {result['throughput_mib_s'] or 0:>10.2f} MiB/s "
+        f"{result['peak_rss_kib'] / 1024:>8.1f} MiB peak RSS"
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
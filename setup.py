@@ -24,6 +24,7 @@ setup(
     url='https://github.com/kuviokelluja/DefuseZip',
     packages=find_packages(include=['DefuseZip','DefuseZip.*']),
     install_requires=['psutil==5.8.0', 'loguru<1.0.0'],
+    extras_require={'toml': ["tomli; python_version < '3.11'"]},
     python_requires=">=3.7",
     entry_points={
         'console_scripts': ['DefuseZip=DefuseZip.__main__:main']
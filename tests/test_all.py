@@ -1,12 +1,50 @@
+import asyncio
+import gzip
+import io
+import json
+import mmap
+import os
+import stat
+import struct
 import sys
+import tarfile
 import tempfile
+import threading
+import zipfile
+from argparse import Namespace
 from pathlib import Path
 from shutil import copy
+from typing import IO
+from typing import List
+from typing import Union
 
 import pytest
+from loguru import logger
 
+from DefuseZip.__main__ import discover
+from DefuseZip.__main__ import discover_each
+from DefuseZip.__main__ import read_manifest
+from DefuseZip.__main__ import scan_files
+from DefuseZip.aio import AsyncDefuseZip
+from DefuseZip.aio import scan_async
+from DefuseZip.client import ScanClient
+from DefuseZip.incremental import IncrementalScanner
 from DefuseZip.loader import DefuseZip
 from DefuseZip.loader import MaliciousFileException
+from DefuseZip.server import ScanServer
+from DefuseZip.utils.cache import ScanCache
+from DefuseZip.utils.central_directory import read_central_directory
+from DefuseZip.utils.extract import ExtractionPool
+from DefuseZip.utils.extract import StagedExtraction
+from DefuseZip.utils.policy import Policy
+from DefuseZip.utils.pool import configure_scan_pool
+from DefuseZip.utils.pool import scan_pool
+from DefuseZip.utils.pool import ScanPool
+from DefuseZip.utils.report import PrometheusExporter
+from DefuseZip.utils.report import ScanReport
+from DefuseZip.utils.streams import open_member
+from DefuseZip.utils.streams import SeekableView
+from DefuseZip.utils.streams import SpoolLimitError
 
 
 class Test_all:
@@ -51,8 +89,9 @@ class Test_all:
         assert defusezip.has_travelsal
         assert defusezip.is_dangerous
 
+    @pytest.mark.parametrize("memory_budget", [16777216, 0])
     @pytest.mark.parametrize("filename,expected", testdata)
-    def test_is_safe(self, filename: str, expected: bool):
+    def test_is_safe(self, filename: str, expected: bool, memory_budget: int):
         file = Path(__file__).parent / "example_zips" / filename
         defusezip = DefuseZip(
             file,
@@ -60,6 +99,7 @@ class Test_all:
             killswitch_seconds=5,
             nested_zips_limit=100000,
             ratio_threshold=1032,
+            memory_budget=memory_budget,
         )
         try:
             defusezip.scan()
@@ -68,6 +108,646 @@ class Test_all:
 
         assert defusezip.is_dangerous == expected
 
+    @staticmethod
+    def _in_memory(
+        f: IO[bytes], source: str
+    ) -> Union[bytes, memoryview, mmap.mmap, IO[bytes]]:
+        if source == "file":
+            return f
+        if source == "mmap":
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data = f.read()
+        return memoryview(data) if source == "memoryview" else data
+
+    @pytest.mark.parametrize("source", ["bytes", "memoryview", "mmap", "file"])
+    @pytest.mark.parametrize("filename,expected", testdata[:5])
+    def test_in_memory_source(self, filename: str, expected: bool, source: str):
+        file = Path(__file__).parent / "example_zips" / filename
+        with open(file, "rb") as f:
+            defusezip = DefuseZip(
+                self._in_memory(f, source),
+                nested_levels_limit=100,
+                killswitch_seconds=5,
+                nested_zips_limit=100000,
+                hard_killswitch=source == "file",
+            )
+            try:
+                defusezip.scan()
+            except MaliciousFileException as e:
+                assert str(e) == (filename if source == "file" else "<memory>")
+
+        assert defusezip.is_dangerous == expected
+
+    def test_stored_member_view(self, tmpdir):
+        inner = io.BytesIO()
+        with zipfile.ZipFile(inner, "w") as zf:
+            zf.writestr("inner.txt", b"a" * 1000)
+        file = Path(tmpdir) / "stored.zip"
+        with zipfile.ZipFile(file, "w", zipfile.ZIP_STORED) as zf:
+            zf.writestr("first.txt", b"b" * 10)
+            zf.writestr("nested.zip", inner.getvalue())
+        with zipfile.ZipFile(file) as zf, open(file, "rb") as f:
+            info = zf.getinfo("nested.zip")
+            with open_member(f, zf, info, 0, 0, lambda: False) as member:
+                assert isinstance(member, io.BufferedReader)
+                assert isinstance(member.raw, SeekableView)
+                assert member.read() == inner.getvalue()
+
+        defusezip = DefuseZip(file, nested_zips_limit=100, nested_levels_limit=100)
+        assert not defusezip.scan()
+        assert defusezip.nested_zips_count == 1
+
+    @staticmethod
+    def _write_inflating_zip(file: Path, size: int):
+        with zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED) as zf:
+            with zf.open("inner.zip", "w") as member:
+                for _ in range(size // 1048576):
+                    member.write(bytes(1048576))
+
+    def test_spool_rollover_to_disk(self, tmpdir):
+        file = Path(tmpdir) / "deflated.zip"
+        self._write_inflating_zip(file, 4194304)
+        with zipfile.ZipFile(file) as zf, open(file, "rb") as f:
+            info = zf.getinfo("inner.zip")
+            with open_member(
+                f, zf, info, 1024, info.file_size, lambda: False
+            ) as member:
+                assert member._rolled  # type: ignore
+                assert member.seek(0, 2) == info.file_size
+            with pytest.raises(SpoolLimitError):
+                open_member(f, zf, info, 1024, info.file_size - 1, lambda: False)
+            with pytest.raises(SpoolLimitError):
+                open_member(f, zf, info, 1024, info.file_size, lambda: True)
+
+    @pytest.mark.parametrize(
+        "ratio_threshold, disk_budget, killswitch_seconds",
+        [(100, 1073741824, 5), (100000, 1048576, 5), (100000, 1073741824, 0)],
+    )
+    def test_spool_limits_stop_inflating(
+        self, tmpdir, ratio_threshold: int, disk_budget: int, killswitch_seconds: int
+    ):
+        file = Path(tmpdir) / "deflated.zip"
+        self._write_inflating_zip(file, 67108864)
+        defusezip = DefuseZip(
+            file,
+            ratio_threshold=ratio_threshold,
+            memory_budget=0,
+            disk_budget=disk_budget,
+            killswitch_seconds=killswitch_seconds,
+        )
+        with pytest.raises(MaliciousFileException):
+            defusezip.scan()
+        assert defusezip.is_dangerous
+
+    def test_hard_killswitch(self, tmpdir):
+        file = Path(tmpdir) / "deflated.zip"
+        self._write_inflating_zip(file, 67108864)
+        defusezip = DefuseZip(
+            file,
+            ratio_threshold=100000,
+            killswitch_seconds=0,
+            hard_killswitch=True,
+        )
+        with pytest.raises(MaliciousFileException):
+            defusezip.scan()
+        assert defusezip.is_dangerous
+
+        license_zip = Path(__file__).parent / "example_zips" / "LICENSE.zip"
+        defusezip = DefuseZip(license_zip, hard_killswitch=True)
+        assert not defusezip.scan()
+        defusezip.output()
+
+        not_a_zip = Path(tmpdir) / "not_a.zip"
+        not_a_zip.write_bytes(b"not a zip")
+        with pytest.raises(zipfile.BadZipFile):
+            DefuseZip(not_a_zip, hard_killswitch=True).scan()
+
+    def test_scan_cache(self, tmpdir, caplog):
+        cache = ScanCache(maxsize=1, path=Path(tmpdir) / "cache.sqlite")
+        travelsal_zip = Path(__file__).parent / "example_zips" / "travelsal.zip"
+        copied_zip = Path(tmpdir) / "copied.zip"
+        copy(travelsal_zip, copied_zip)
+
+        for file in (travelsal_zip, copied_zip):
+            defusezip = DefuseZip(file, cache=cache)
+            with pytest.raises(MaliciousFileException):
+                defusezip.scan()
+            assert defusezip.has_travelsal
+            defusezip.output()
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert caplog.text.count("Directory travelsal = True") == 2
+
+        defusezip = DefuseZip(
+            travelsal_zip, directory_travelsal_allowed=True, cache=cache
+        )
+        assert not defusezip.scan()
+        assert len(cache) == 1
+        cache.close()
+
+        cache = ScanCache(path=Path(tmpdir) / "cache.sqlite")
+        defusezip = DefuseZip(copied_zip, cache=cache)
+        with pytest.raises(MaliciousFileException):
+            defusezip.scan()
+        assert cache.hits == 1
+        cache.close()
+
+    @staticmethod
+    def _write_fan_out_zip(file: Path, fan_out: int, levels: int, extra: bytes = b""):
+        data = b"x" * 1000
+        name = "leaf.txt"
+        for level in range(levels):
+            inner = io.BytesIO()
+            with zipfile.ZipFile(inner, "w", zipfile.ZIP_DEFLATED) as zf:
+                for n in range(fan_out):
+                    zf.writestr(f"{level}-{n}.zip" if level else f"{n}-{name}", data)
+            data = inner.getvalue()
+        with zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED) as zf:
+            for n in range(fan_out):
+                zf.writestr(f"top-{n}.zip", data)
+            zf.writestr("extra.txt", extra)
+
+    def test_nested_results_reused(self, tmpdir):
+        file = Path(tmpdir) / "fan_out.zip"
+        self._write_fan_out_zip(file, 4, 2)
+        license_zip = Path(__file__).parent / "example_zips" / "LICENSE.zip"
+        cache = ScanCache(maxsize=2)
+        assert not DefuseZip(license_zip, cache=cache).scan()
+        defusezip = DefuseZip(
+            file, ratio_threshold=100000, nested_zips_limit=0, cache=cache
+        )
+        assert not defusezip.scan()
+        assert defusezip.nested_zips_count == 4 + 4 * 4
+        assert defusezip.highest_level == 2
+        assert defusezip._DefuseZip__zipsize == 4 * 4 * 4 * 1000  # type: ignore
+        assert cache.hits == 0
+        # Results of the nested zips don't evict whole scan results
+        assert not DefuseZip(license_zip, cache=cache).scan()
+        assert cache.hits == 1
+
+        cache_file = Path(tmpdir) / "cache.sqlite"
+        cache = ScanCache(path=cache_file)
+        defusezip = DefuseZip(
+            file, ratio_threshold=100000, nested_zips_limit=0, cache=cache
+        )
+        assert not defusezip.scan()
+        cache.close()
+        other = Path(tmpdir) / "other.zip"
+        self._write_fan_out_zip(other, 4, 2, extra=b"different")
+        cache = ScanCache(path=cache_file)
+        defusezip = DefuseZip(
+            other, ratio_threshold=100000, nested_zips_limit=0, cache=cache
+        )
+        assert not defusezip.scan()
+        assert defusezip.nested_zips_count == 4 + 4 * 4
+        assert defusezip.highest_level == 2
+        assert cache.hits == 1
+        cache.close()
+
+    def test_scan_async(self):
+        travelsal_zip = Path(__file__).parent / "example_zips" / "travelsal.zip"
+        license_zip = Path(__file__).parent / "example_zips" / "LICENSE.zip"
+
+        async def stream(data: bytes):
+            for start in range(0, len(data), 100):
+                end = start + 100
+                yield data[start:end]
+
+        async def scan_all():
+            scanner = AsyncDefuseZip(max_workers=2)
+            try:
+                return await asyncio.gather(
+                    scanner.scan(license_zip),
+                    scanner.scan(travelsal_zip.read_bytes()),
+                    scanner.scan(stream(travelsal_zip.read_bytes())),
+                    scan_async(str(license_zip)),
+                )
+            finally:
+                scanner.close()
+
+        results = asyncio.run(scan_all())
+        assert [result.is_dangerous for result in results] == [
+            False,
+            True,
+            True,
+            False,
+        ]
+        assert results[2].has_travelsal
+
+    def test_scan_pool(self):
+        pool = ScanPool(max_workers=1, max_queued=1)
+        release = threading.Event()
+        running = pool.submit(release.wait)
+        queued = pool.submit(lambda: "queued")
+        submitted = threading.Event()
+
+        def burst():
+            pool.submit(lambda: None)
+            submitted.set()
+
+        # A third call is held back until the running one completes
+        threading.Thread(target=burst).start()
+        assert not submitted.wait(0.2)
+        release.set()
+        assert submitted.wait(5)
+        assert running.result() and queued.result() == "queued"
+
+        async def burst_async():
+            blocker = threading.Event()
+            tasks = [
+                asyncio.ensure_future(pool.submit_async(blocker.wait)) for _ in range(3)
+            ]
+            await asyncio.sleep(0.2)
+            submitted = [task.done() for task in tasks]
+            blocker.set()
+            await asyncio.gather(*await asyncio.gather(*tasks))
+            return submitted
+
+        # The third coroutine waits in the event loop without blocking it
+        assert asyncio.run(burst_async()) == [True, True, False]
+        pool.close()
+
+        configure_scan_pool(max_workers=2)
+        try:
+            assert scan_pool() is scan_pool()
+            assert scan_pool().max_workers == AsyncDefuseZip().pool.max_workers == 2
+            travelsal_zip = Path(__file__).parent / "example_zips" / "travelsal.zip"
+            assert scan_pool().scan(travelsal_zip).result().is_dangerous
+        finally:
+            # The process wide pool is shared with the other tests
+            configure_scan_pool()
+
+    @pytest.mark.parametrize("filename", [data[0] for data in testdata[:-1]])
+    def test_central_directory_matches_zipfile(self, filename: str):
+        file = Path(__file__).parent / "example_zips" / filename
+        with zipfile.ZipFile(file) as zf, open(file, "rb") as f:
+            infolist = zf.infolist()
+            table = read_central_directory(f)
+        assert list(table.names()) == [info.filename for info in infolist]
+        assert list(table.file_size) == [info.file_size for info in infolist]
+        assert list(table.compress_size) == [info.compress_size for info in infolist]
+        assert table.total_uncompressed == sum(info.file_size for info in infolist)
+        assert list(table.header_offset) == [info.header_offset for info in infolist]
+        assert table.overlapping_entries() == 0
+
+    @pytest.mark.parametrize("full_report", [False, True])
+    def test_overlapping_entries(self, tmpdir, full_report: bool):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("kernel.txt", b"a" * 1000)
+        data = buffer.getvalue()
+        _, _, _, _, _, size_cd, offset_cd, _ = struct.unpack_from(
+            "<4s4H2LH", data, len(data) - 22
+        )
+        end = offset_cd + size_cd
+        central_directory = data[offset_cd:end] * 3
+        file = Path(tmpdir) / "overlapping.zip"
+        file.write_bytes(
+            data[:offset_cd]
+            + central_directory
+            + struct.pack(
+                "<4s4H2LH",
+                b"PK\005\006",
+                0,
+                0,
+                3,
+                3,
+                len(central_directory),
+                offset_cd,
+                0,
+            )
+        )
+        with open(file, "rb") as f:
+            assert read_central_directory(f).overlapping_entries() == 2
+
+        defusezip = DefuseZip(file, full_report=full_report)
+        with pytest.raises(MaliciousFileException):
+            defusezip.scan()
+        assert defusezip.has_overlaps
+
+    def test_central_directory_fast_path(self, tmpdir):
+        file = Path(tmpdir) / "flat.zip"
+        with open(file, "wb") as f:
+            f.write(b"prepended data")
+            with zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as zf:
+                zf.comment = b"archive comment"
+                for n in range(100):
+                    zf.writestr(f"file{n}.txt", b"x" * n)
+        with open(file, "rb") as f:
+            table = read_central_directory(f)
+        assert len(table) == 100
+        assert table.total_uncompressed == sum(range(100))
+        assert not table.has_name_ending(b".zip")
+        assert set(table.compress_type) == {zipfile.ZIP_DEFLATED}
+        assert not table.has_symlinks()
+
+        defusezip = DefuseZip(file)
+        assert not defusezip.scan()
+        assert defusezip.nested_zips_count == 0
+
+    def test_central_directory_symlinks(self, tmpdir):
+        file = Path(tmpdir) / "links.zip"
+        with zipfile.ZipFile(file, "w") as zf:
+            zf.writestr("readme.txt", b"a" * 100)
+            link = zipfile.ZipInfo("link")
+            link.external_attr = (stat.S_IFLNK | 0o777) << 16
+            zf.writestr(link, "/etc/passwd")
+        with open(file, "rb") as f:
+            assert read_central_directory(f).has_symlinks()
+
+        with pytest.raises(MaliciousFileException):
+            DefuseZip(file).scan()
+        defusezip = DefuseZip(file, symlinks_allowed=True)
+        assert not defusezip.scan()
+        assert defusezip.has_links
+
+    @staticmethod
+    def _tar_gz(members) -> bytes:
+        data = io.BytesIO()
+        with tarfile.open(fileobj=data, mode="w:gz") as tf:
+            for name, content in members:
+                info = tarfile.TarInfo(name)
+                if content is None:
+                    info.type = tarfile.SYMTYPE
+                    info.linkname = "/etc/passwd"
+                    tf.addfile(info)
+                else:
+                    info.size = len(content)
+                    tf.addfile(info, io.BytesIO(content))
+        return data.getvalue()
+
+    def test_nested_containers_sniffed(self, tmpdir):
+        inner = io.BytesIO()
+        with zipfile.ZipFile(inner, "w") as zf:
+            zf.writestr("inner.txt", b"a" * 1000)
+        file = Path(tmpdir) / "outer.zip"
+        with zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("renamed.dat", inner.getvalue())
+            zf.writestr("logs.tar.gz", self._tar_gz([("log.txt", b"b" * 2000)]))
+        defusezip = DefuseZip(file)
+        assert not defusezip.scan()
+        assert defusezip.nested_zips_count == 1
+        defusezip = DefuseZip(file, sniff_contents=True)
+        assert not defusezip.scan()
+        assert defusezip.nested_zips_count == 2
+        assert defusezip.report().uncompressed_size == 3000
+        defusezip = DefuseZip(file, sniff_contents=True, sniff_budget=0)
+        assert not defusezip.scan()
+        assert defusezip.nested_zips_count == 1
+
+        tarball = Path(tmpdir) / "logs.tar.gz"
+        tarball.write_bytes(self._tar_gz([("inner.zip", inner.getvalue())]))
+        defusezip = DefuseZip(tarball)
+        assert not defusezip.scan()
+        assert defusezip.nested_zips_count == 1
+        assert defusezip.highest_level == 1
+
+    def test_flat_zip_not_sniffed(self):
+        class Reads(io.BytesIO):
+            def __init__(self, data: bytes):
+                super().__init__(data)
+                self.starts: List[int] = []
+
+            def read(self, size=-1):  # type: ignore
+                self.starts.append(self.tell())
+                return super().read(size)
+
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED) as zf:
+            for index in range(100):
+                zf.writestr(f"{index}.bin", gzip.compress(bytes(1000 + index)))
+            central_directory = zf.start_dir
+        reads = Reads(data.getvalue())
+        assert not DefuseZip(reads).scan()
+        assert all(start == 0 or start >= central_directory for start in reads.starts)
+
+        reads = Reads(data.getvalue())
+        defusezip = DefuseZip(reads, nested_zips_limit=1000, sniff_contents=True)
+        assert not defusezip.scan()
+        assert defusezip.nested_zips_count == 100
+        assert not all(start >= central_directory for start in reads.starts)
+
+    def test_nested_container_dangers(self, tmpdir):
+        file = Path(tmpdir) / "gzip_bomb.zip"
+        with zipfile.ZipFile(file, "w", zipfile.ZIP_STORED) as zf:
+            zf.writestr("data.gz", gzip.compress(bytes(16777216)))
+        defusezip = DefuseZip(file, ratio_threshold=100)
+        with pytest.raises(MaliciousFileException):
+            defusezip.scan()
+        assert defusezip.is_dangerous
+
+        file = Path(tmpdir) / "links.zip"
+        with zipfile.ZipFile(file, "w") as zf:
+            zf.writestr("links.tar.gz", self._tar_gz([("passwd", None)]))
+        defusezip = DefuseZip(file)
+        with pytest.raises(MaliciousFileException):
+            defusezip.scan()
+        assert defusezip.report().symlinks
+
+    @pytest.mark.parametrize("filename, expected", testdata)
+    def test_incremental_scan(self, filename: str, expected: bool):
+        data = (Path(__file__).parent / "example_zips" / filename).read_bytes()
+        scanner = IncrementalScanner(
+            filename, nested_levels_limit=100, nested_zips_limit=100000
+        )
+        try:
+            for start in range(0, len(data), 1000):
+                scanner.feed(data[start:][:1000])
+            scanner.close()
+        except MaliciousFileException as e:
+            assert str(e) == filename
+        assert scanner.is_dangerous == expected
+
+    def test_incremental_streamed_upload(self):
+        inner = io.BytesIO()
+        with zipfile.ZipFile(inner, "w") as zf:
+            zf.writestr("inner.txt", b"a" * 1000)
+
+        class Unseekable(io.BytesIO):
+            def tell(self) -> int:
+                raise io.UnsupportedOperation
+
+        # zipfile writes data descriptors after each entry when it can't seek back to the local header
+        upload = Unseekable()
+        with zipfile.ZipFile(upload, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("inner.zip", inner.getvalue())
+            zf.writestr("text.txt", b"b" * 2000)
+        data = upload.getvalue()
+        scanner = IncrementalScanner()
+        for start in range(0, len(data), 7):
+            scanner.feed(data[start:][:7])
+        assert not scanner.close()
+        report = scanner.report()
+        assert (report.nested_zips, report.nested_levels) == (1, 1)
+        assert report.uncompressed_size == 3000
+
+        # The central directory declaring other sizes than the local header
+        tampered = bytearray(data)
+        size_offset = tampered.rindex(b"PK\001\002") + 24
+        struct.pack_into("<L", tampered, size_offset, 1)
+        scanner = IncrementalScanner()
+        scanner.feed(bytes(tampered))
+        with pytest.raises(MaliciousFileException):
+            scanner.close()
+        assert scanner.report().size_mismatch
+
+    def test_incremental_rejects_midstream(self, tmpdir):
+        file = Path(tmpdir) / "deflated.zip"
+        self._write_inflating_zip(file, 67108864)
+        data = file.read_bytes()
+        scanner = IncrementalScanner(ratio_threshold=100)
+        with pytest.raises(MaliciousFileException):
+            for start in range(0, len(data), 4096):
+                scanner.feed(data[start:][:4096])
+        assert start < len(data) // 2
+        assert scanner.is_dangerous
+        assert scanner.report().stopped_early
+
+    def test_incremental_policy(self):
+        inner = io.BytesIO()
+        with zipfile.ZipFile(inner, "w") as zf:
+            zf.writestr("bin/setup.exe", b"MZ" * 100)
+        for name, content, finding in (
+            ("../evil.exe", b"MZ" * 100, "../evil.exe"),
+            ("tools.zip", inner.getvalue(), "bin/setup.exe"),
+        ):
+            data = io.BytesIO()
+            with zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED) as zf:
+                zf.writestr(name, content)
+                zf.writestr("padding.bin", os.urandom(100000))
+            scanner = IncrementalScanner(
+                directory_travelsal_allowed=True, policy=Policy(deny=["*.exe"])
+            )
+            with pytest.raises(MaliciousFileException):
+                scanner.feed(data.getvalue()[:50000])
+            assert scanner.report().violations == (f"denied_name: {finding}",)
+
+        scanner = IncrementalScanner(policy=Policy(max_entries=1))
+        scanner.feed(data.getvalue())
+        with pytest.raises(MaliciousFileException):
+            scanner.close()
+        assert scanner.report().violations == ("max_entries: 2 entries",)
+
+    def test_policy(self, tmpdir):
+        inner = io.BytesIO()
+        with zipfile.ZipFile(inner, "w") as zf:
+            zf.writestr("bin/setup.exe", b"MZ" * 100)
+        file = Path(tmpdir) / "policy.zip"
+        with zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("readme.txt", b"a" * 100)
+            zf.writestr("/etc/cron.d/job", b"b" * 100)
+            zf.writestr("tools.zip", inner.getvalue())
+            link = zipfile.ZipInfo("link")
+            link.external_attr = (stat.S_IFLNK | 0o777) << 16
+            zf.writestr(link, "/etc/passwd")
+
+        defusezip = DefuseZip(file, symlinks_allowed=True)
+        assert not defusezip.scan()
+        assert defusezip.has_links
+        with pytest.raises(MaliciousFileException):
+            DefuseZip(file).scan()
+
+        policy_file = Path(tmpdir) / "policy.toml"
+        policy_file.write_text(
+            'deny = ["*.exe", "[!a-z]*"]\nabsolute_paths_allowed = false\nmax_entries = 10\n'
+        )
+        policy = Policy.load(policy_file)
+        defusezip = DefuseZip(
+            file, symlinks_allowed=True, full_report=True, policy=policy
+        )
+        with pytest.raises(MaliciousFileException):
+            defusezip.scan()
+        assert defusezip.report().violations == (
+            "absolute_path: /etc/cron.d/job",
+            "denied_name: /etc/cron.d/job",
+        )
+
+        with pytest.raises(ValueError):
+            Policy.from_dict({"max_entry": 10})
+
+    def test_policy_rules_combined(self, tmpdir):
+        policy = Policy(deny=["*.exe"], absolute_paths_allowed=False)
+        assert policy.match_name("../evil.exe") == ("travelsal", "denied_name")
+        assert policy.match_name("/a/../x.exe") == (
+            "travelsal",
+            "absolute_path",
+            "denied_name",
+        )
+        assert policy.match_name("readme.txt") == ()
+
+        file = Path(tmpdir) / "combined.zip"
+        with zipfile.ZipFile(file, "w") as zf:
+            zf.writestr("a/../../x.exe", b"a" * 100)
+            zf.writestr("b/../y.txt", b"b" * 100)
+        table = read_central_directory(io.BytesIO(file.read_bytes()))
+        assert Policy(deny=["*.exe"]).evaluate(table, 1000) == {
+            "travelsal": "a/../../x.exe and 1 more",
+            "denied_name": "a/../../x.exe",
+        }
+
+        # Allowing travelsal doesn't let a prefixed name past the deny patterns
+        for name in ("../evil.exe", "logs.tar.gz"):
+            file = Path(tmpdir) / "evil.zip"
+            with zipfile.ZipFile(file, "w") as zf:
+                if name == "logs.tar.gz":
+                    zf.writestr(name, self._tar_gz([("../evil.exe", b"MZ")]))
+                else:
+                    zf.writestr(name, b"MZ")
+            defusezip = DefuseZip(
+                file, directory_travelsal_allowed=True, policy=Policy(deny=["*.exe"])
+            )
+            with pytest.raises(MaliciousFileException):
+                defusezip.scan()
+            assert defusezip.has_travelsal
+            assert defusezip.report().violations == ("denied_name: ../evil.exe",)
+
+    def test_member_ratios(self, tmpdir):
+        inner = io.BytesIO()
+        with zipfile.ZipFile(inner, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("deep/zeros.bin", b"\0" * 1000000)
+        file = Path(tmpdir) / "ratios.zip"
+        with zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED) as zf:
+            for i in range(50):
+                zf.writestr(f"logs/{i}.txt", os.urandom(100))
+            zf.writestr("zeros.bin", b"\0" * 100000)
+            zf.writestr("nested.zip", inner.getvalue())
+
+        cache = ScanCache()
+        for cached in (False, True):
+            defusezip = DefuseZip(file, top_members=2, cache=cache)
+            defusezip.scan()
+            report = defusezip.report()
+            assert report.cached == cached
+            assert [(m.name, m.level) for m in report.top_members] == [
+                ("deep/zeros.bin", 1),
+                ("zeros.bin", 0),
+            ]
+            assert len(report.level_ratios) == 2
+            assert report.level_ratios[1] == report.top_members[0].ratio > 900
+        record = json.loads(report.to_json())
+        assert record["top_members"][1]["file_size"] == 100000
+
+        # A flat zip is summed from its central directory alone
+        flat = Path(tmpdir) / "flat.zip"
+        with zipfile.ZipFile(file) as src, zipfile.ZipFile(flat, "w") as zf:
+            for info in src.infolist()[:51]:
+                zf.writestr(info, src.read(info))
+        defusezip = DefuseZip(flat, top_members=1)
+        defusezip.scan()
+        assert [m.name for m in defusezip.report().top_members] == ["zeros.bin"]
+
+        scanner = IncrementalScanner(top_members=1)
+        scanner.feed(file.read_bytes())
+        scanner.close()
+        assert scanner.report().top_members == report.top_members[:1]
+
+        policy = Policy(max_member_ratio=500)
+        defusezip = DefuseZip(flat, policy=policy)
+        with pytest.raises(MaliciousFileException):
+            defusezip.scan()
+        assert (
+            defusezip.report().violations[0].startswith("max_member_ratio: zeros.bin, ")
+        )
+
     testdata2 = [
         ("nonexistant.zip", FileNotFoundError, False),
         ("exists_for_a_while.zip", FileNotFoundError, True),
@@ -105,6 +785,18 @@ class Test_all:
 
         assert "Dangerous = False" in caplog.text
 
+        records = []
+        sink = logger.add(lambda message: records.append(message.record))
+        try:
+            defusezip.output()
+        finally:
+            logger.remove(sink)
+        assert records
+        assert all(
+            (record["name"], record["function"]) == (__name__, "test_output_safe")
+            for record in records
+        )
+
     def test_safe_extract(self):
         file = Path(__file__).parent / "example_zips" / "single.zip"
         retval = False
@@ -135,6 +827,87 @@ class Test_all:
         assert ex
         assert retval
 
+    @pytest.mark.parametrize("corrupt", [False, True])
+    def test_staged_extraction(self, tmpdir, corrupt: bool):
+        file = Path(tmpdir) / "two.zip"
+        with zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("dir/first.txt", b"first" * 100)
+            zf.writestr("../second.txt", b"second" * 100)
+        if corrupt:
+            data = bytearray(file.read_bytes())
+            # Flip the CRC of the second member in its central directory record
+            data[data.rindex(b"../second.txt") - 46 + 16] ^= 0xFF
+            file.write_bytes(data)
+        destination = Path(tmpdir) / "out"
+        destination.mkdir()
+        (destination / "existing.txt").write_bytes(b"existing")
+
+        pool = ExtractionPool(1)
+        try:
+            staging = StagedExtraction(destination)
+            limits = (60, 1 << 30, 1 << 20)
+            if corrupt:
+                with pytest.raises(zipfile.BadZipFile):
+                    with staging:
+                        staging.extract_isolated(file, pool, 1 << 20, limits)
+            else:
+                with staging:
+                    staging.extract_isolated(file, pool, 1 << 20, limits)
+        finally:
+            pool.close()
+
+        extracted = sorted(
+            str(path.relative_to(destination)) for path in destination.rglob("*")
+        )
+        if corrupt:
+            assert extracted == ["existing.txt"]
+        else:
+            assert extracted == ["dir", "dir/first.txt", "existing.txt", "second.txt"]
+            assert (destination / "second.txt").read_bytes() == b"second" * 100
+
+    def test_extraction_pool_limits(self, tmpdir):
+        resource = pytest.importorskip("resource")
+        file = Path(tmpdir) / "big.zip"
+        with zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("big.txt", b"a" * 100000)
+        limits_before = resource.getrlimit(resource.RLIMIT_FSIZE)
+        pool = ExtractionPool(1)
+        try:
+            with pytest.raises(OSError):
+                with StagedExtraction(Path(tmpdir) / "small") as staging:
+                    staging.extract_isolated(file, pool, 1 << 20, (60, 1 << 30, 1000))
+            with StagedExtraction(Path(tmpdir) / "large") as staging:
+                staging.extract_isolated(file, pool, 1 << 20, (60, 1 << 30, 1 << 20))
+        finally:
+            pool.close()
+        assert resource.getrlimit(resource.RLIMIT_FSIZE) == limits_before
+        assert not (Path(tmpdir) / "small").exists()
+        assert (Path(tmpdir) / "large" / "big.txt").stat().st_size == 100000
+
+    @pytest.mark.parametrize("max_total", [None, 50000])
+    def test_parallel_extraction(self, tmpdir, max_total):
+        file = Path(tmpdir) / "many.zip"
+        with zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED) as zf:
+            for index in range(20):
+                zf.writestr(
+                    f"dir{index % 3}/{index}.txt", bytes([index]) * 1000 * index
+                )
+        destination = Path(tmpdir) / "out"
+
+        staging = StagedExtraction(destination, max_total)
+        if max_total:
+            with pytest.raises(SpoolLimitError):
+                with staging:
+                    staging.extract_parallel(file, 3, 1 << 20)
+            assert not destination.exists()
+        else:
+            with staging:
+                assert staging.extract_parallel(file, 3, 1 << 20) == 190000
+            for index in range(20):
+                member = destination / f"dir{index % 3}" / f"{index}.txt"
+                assert member.read_bytes() == bytes([index]) * 1000 * index
+            assert len(list(destination.rglob("*"))) == 23
+
     def test_output_dangerous(self, caplog):
         file = Path(__file__).parent / "example_zips" / "travelsal.zip"
         defusezip = DefuseZip(
@@ -180,7 +953,206 @@ class Test_all:
             with tempfile.TemporaryDirectory() as tmpdir:
                 defusezip.safe_extract(Path(tmpdir))
 
+    @pytest.mark.parametrize("full_report", [False, True])
+    def test_fail_fast(self, tmpdir, full_report: bool):
+        file = Path(tmpdir) / "travelsal_first.zip"
+        with zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("../evil.txt", b"x")
+            for index in range(100):
+                zf.writestr(f"{index}.txt", b"a" * 10000)
+        defusezip = DefuseZip(file, full_report=full_report)
+        with pytest.raises(MaliciousFileException):
+            defusezip.scan()
+        assert defusezip.has_travelsal
+        ratio = float(defusezip.get_compression_ratio())
+        assert (ratio > 1) if full_report else (ratio == 0)
+
+    @pytest.mark.parametrize(
+        "content,declared_size,verify_budget,expected",
+        [
+            (bytes(range(100)) * 100, 10000, 1073741824, SAFE),
+            (bytes(range(100)) * 100, 100, 1073741824, DANGEROUS),
+            (bytes(range(100)) * 100, 10000, 5000, DANGEROUS),
+            (os.urandom(1048576), 1048576, 1073741824, SAFE),
+            (os.urandom(1048576), 1000, 1073741824, DANGEROUS),
+        ],
+    )
+    def test_verify(
+        self,
+        tmpdir,
+        content: bytes,
+        declared_size: int,
+        verify_budget: int,
+        expected: bool,
+    ):
+        file = Path(tmpdir) / "declared.zip"
+        with zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("a.txt", content)
+        data = bytearray(file.read_bytes())
+        # Patch the declared size in both the local header and the central directory record
+        for offset in (22, data.index(b"PK\001\002") + 24):
+            struct.pack_into("<L", data, offset, declared_size)
+        file.write_bytes(data)
+
+        defusezip = DefuseZip(
+            file, verify=True, verify_budget=verify_budget, full_report=True
+        )
+        try:
+            defusezip.scan()
+        except MaliciousFileException:
+            pass
+        assert defusezip.is_dangerous == expected
+        if verify_budget > len(content):
+            # The size measured by inflating is reported, not the declared one
+            report = defusezip.report()
+            assert report.uncompressed_size == len(content)
+            assert report.size_mismatch == (declared_size != len(content))
+
     def test_extract_all(self, tmpdir):
         zfile = Path(__file__).parent / "example_zips" / "single.zip"
         defusezip = DefuseZip(zfile)
         assert defusezip.extract_all(tmpdir)
+
+    def scan_options(self, jobs: int, fmt: str = "text") -> Namespace:
+        return Namespace(
+            ratio_threshold=1032,
+            nested_zips_limit=100000,
+            nested_levels_limit=100,
+            killswitch_seconds=5,
+            symlinks_allowed=False,
+            directory_travelsal_allowed=False,
+            memory_budget=16777216,
+            disk_budget=1073741824,
+            hard_killswitch=False,
+            cache_file=None,
+            full_report=False,
+            verify=False,
+            verify_budget=1073741824,
+            sniff_contents=False,
+            format=fmt,
+            metrics_file=None,
+            policy=None,
+            jobs=jobs,
+            safe_extract=False,
+            destination=None,
+        )
+
+    @pytest.mark.parametrize("jobs", [1, 2])
+    def test_scan_files_jobs(self, caplog, tmpdir, jobs: int):
+        files = [
+            Path(__file__).parent / "example_zips" / filename
+            for filename in ("LICENSE.zip", "single.zip", "travelsal.zip")
+        ]
+        # Deleted after it was listed
+        files.insert(1, Path(tmpdir) / "deleted.zip")
+        assert scan_files(files, self.scan_options(jobs)) == 0
+        assert caplog.text.count("Dangerous = False") == 2
+        assert caplog.text.count("Dangerous = True") == 1
+
+    def test_report_ndjson(self, capsys):
+        files = [
+            Path(__file__).parent / "example_zips" / filename
+            for filename in ("single.zip", "travelsal.zip")
+        ]
+        assert scan_files(files, self.scan_options(1, "ndjson")) == 0
+        records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+        assert [record["dangerous"] for record in records] == [False, True]
+        assert records[1]["directory_travelsal"] is True
+        assert records[0]["uncompressed_size"] > 0
+
+        defusezip = DefuseZip(files[0])
+        defusezip.scan()
+        report = defusezip.report()
+        assert report.file == str(files[0])
+        assert report.ratio == pytest.approx(
+            report.uncompressed_size / report.compressed_size
+        )
+        record = json.loads(report.to_json())
+        assert record["ratio"] == report.ratio
+        assert record["metrics"]["entries"] == report.metrics.entries > 0
+
+    def test_discover(self, tmpdir, caplog):
+        root = Path(tmpdir)
+        example_zips = Path(__file__).parent / "example_zips"
+        (root / "a" / "b").mkdir(parents=True)
+        copy(example_zips / "single.zip", root / "a" / "b" / "no_extension")
+        copy(example_zips / "travelsal.zip", root / "travelsal.zip")
+        (root / "a" / "notes.txt").write_text("not a zip")
+
+        found = sorted(discover(root))
+        assert found == sorted(
+            [
+                root / "a" / "b" / "no_extension",
+                root / "a" / "notes.txt",
+                root / "travelsal.zip",
+            ]
+        )
+        assert list(discover(root / "travelsal.zip")) == [root / "travelsal.zip"]
+
+        manifest = io.StringIO(f"{root / 'a'}\n\n{root / 'missing.zip'}\n")
+        paths = list(discover_each(read_manifest(manifest)))
+        assert sorted(paths) == found[:2]
+        assert "File/Folder not found" in caplog.text
+
+        assert scan_files(discover(root), self.scan_options(1)) == 0
+        assert caplog.text.count("Skipped, not an archive") == 1
+        assert caplog.text.count("Dangerous = False") == 1
+        assert caplog.text.count("Dangerous = True") == 1
+
+    @pytest.mark.skipif(sys.platform == "win32", reason="Unix domain sockets")
+    def test_serve(self, tmpdir):
+        example_zips = Path(__file__).parent / "example_zips"
+        path = str(tmpdir / "defusezip.sock")
+        server = ScanServer(path, self.scan_options(1))
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            with ScanClient(path, timeout=30) as client:
+                safe = client.scan(example_zips / "single.zip", tmpdir / "extracted")
+                dangerous = client.scan(example_zips / "travelsal.zip")
+                missing = client.scan(tmpdir / "missing.zip")
+            assert safe["dangerous"] is False and safe["extracted"] is True
+            assert any((tmpdir / "extracted").listdir())
+            assert dangerous["dangerous"] is True
+            assert dangerous["directory_travelsal"] is True
+            assert missing["error"] == "File not found"
+            with pytest.raises(FileExistsError):
+                ScanServer(path, self.scan_options(1))
+        finally:
+            server.shutdown()
+            server.server_close()
+        assert not Path(path).exists()
+
+    def test_metrics(self, tmpdir):
+        zfile = Path(__file__).parent / "example_zips" / "double_nested.zip"
+        reports = []
+        exporter = PrometheusExporter()
+
+        def observe(report: ScanReport):
+            reports.append(report)
+            exporter.observe(report)
+
+        defusezip = DefuseZip(
+            zfile,
+            nested_zips_limit=100000,
+            nested_levels_limit=100,
+            metrics_callback=observe,
+        )
+        defusezip.scan()
+        metrics = reports[0].metrics
+        assert metrics.bytes_read >= zfile.stat().st_size
+        assert metrics.nested_opened > 0
+        assert metrics.entries > metrics.nested_opened
+        assert metrics.peak_buffered_bytes > 0
+        assert {"central_directory", "walk", "inflate"} <= set(metrics.phases)
+
+        opts = self.scan_options(1)
+        opts.metrics_file = str(tmpdir / "defusezip.prom")
+        assert scan_files([zfile], opts) == 0
+        text = Path(opts.metrics_file).read_text()
+        assert 'defusezip_scans_total{dangerous="false",cached="false"} 1' in text
+        assert 'defusezip_phase_seconds_total{phase="walk"}' in text
+        assert (
+            f"defusezip_nested_opened_total {metrics.nested_opened}"
+            in exporter.render()
+        )